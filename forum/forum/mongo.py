@@ -1,13 +1,99 @@
-import pymongo
+import os
+
 from django.conf import settings
 
+#pymongo is imported on first use, processes that never touch the read models
+#(MONGODB_READ_MODELS off, most management commands) don't pay for it at startup
+
 _client = None
+_client_pid = None
+
+def _client_options():
+    # Pool and timeout knobs, all overridable from settings (values in ms)
+    return {
+        'maxPoolSize': getattr(settings, 'MONGODB_MAX_POOL_SIZE', 50),
+        'minPoolSize': getattr(settings, 'MONGODB_MIN_POOL_SIZE', 0),
+        'maxIdleTimeMS': getattr(settings, 'MONGODB_MAX_IDLE_TIME_MS', 60000),
+        'serverSelectionTimeoutMS': getattr(settings, 'MONGODB_SERVER_SELECTION_TIMEOUT_MS', 3000),
+        'connectTimeoutMS': getattr(settings, 'MONGODB_CONNECT_TIMEOUT_MS', 3000),
+        'socketTimeoutMS': getattr(settings, 'MONGODB_SOCKET_TIMEOUT_MS', 5000),
+        'waitQueueTimeoutMS': getattr(settings, 'MONGODB_WAIT_QUEUE_TIMEOUT_MS', 2000),
+    }
 
 def get_client():
-    global _client
+    global _client, _client_pid
+    # MongoClient is not fork safe. A pre-fork server (gunicorn, uwsgi) can hand
+    # workers a client created in the master, so each process builds its own
+    if _client is not None and _client_pid != os.getpid():
+        _client = None
     if _client is None:
-        _client = pymongo.MongoClient(settings.MONGODB_URI)
+        uri = settings.MONGODB_URI
+        if uri.startswith('mongomock://'):
+            # In-process stand-in for tests and local dev, no server needed
+            import mongomock
+            _client = mongomock.MongoClient()
+        else:
+            import pymongo
+            _client = pymongo.MongoClient(uri, connect=False, **_client_options())
+        _client_pid = os.getpid()
     return _client
 
 def get_db():
-    return get_client()[settings.MONGODB_DB]
\ No newline at end of file
+    return get_client()[settings.MONGODB_DB]
+
+def reset_client():
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        _client.close()
+    _client = None
+    _client_pid = None
+
+def _forget_client_after_fork():
+    # Sockets belong to the parent; drop the reference without closing them
+    global _client, _client_pid
+    _client = None
+    _client_pid = None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_client_after_fork)
+
+
+class BulkWriter:
+    """
+    Buffer write operations and send them with bulk_write in bounded batches.
+
+        with BulkWriter(get_db()['post_documents'], batch_size=500) as writer:
+            for doc in docs:
+                writer.add(ReplaceOne({'_id': doc['_id']}, doc, upsert=True))
+
+    ordered=False lets the server apply a batch in parallel and keep going
+    past individual failures, which is what you want for idempotent upserts.
+    """
+
+    def __init__(self, collection, batch_size=None, ordered=False):
+        self.collection = collection
+        self.batch_size = batch_size or getattr(settings, 'MONGODB_BULK_BATCH_SIZE', 1000)
+        self.ordered = ordered
+        self.buffer = []
+        self.sent = 0
+
+    def add(self, operation):
+        self.buffer.append(operation)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return None
+        ops, self.buffer = self.buffer, []
+        result = self.collection.bulk_write(ops, ordered=self.ordered)
+        self.sent += len(ops)
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        return False
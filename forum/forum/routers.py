@@ -0,0 +1,123 @@
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+#Primary/replica routing.
+#Writes always go to the primary ('default'). Reads go to a random replica from
+#settings.DATABASE_REPLICAS unless the request is pinned to the primary, the
+#primary is mid-transaction, or every replica lags more than REPLICA_MAX_LAG_SECONDS.
+
+_pinned = ContextVar('forum_db_pinned', default=False)
+
+PIN_COOKIE = 'forum_pin'
+PIN_HEADER = 'X-Forum-Pin'
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+def pin_to_primary():
+    """Route this context's reads to the primary. Returns a token for unpin()."""
+    return _pinned.set(True)
+
+def unpin(token):
+    _pinned.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not replicas() or _pinned.get():
+            return DEFAULT_DB_ALIAS
+        # Reads inside a write transaction must see its uncommitted rows
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        max_lag = getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 5)
+        fresh = [alias for alias in replicas() if replica_lag(alias) <= max_lag]
+        if not fresh:
+            return DEFAULT_DB_ALIAS
+        return random.choice(fresh)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db not in replicas()
+
+
+_lag_cache = {}
+
+def replica_lag(alias):
+    """Replication lag in seconds, cached for REPLICA_LAG_CHECK_INTERVAL."""
+    interval = getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL', 2)
+    checked_at, lag = _lag_cache.get(alias, (None, None))
+    now = time.monotonic()
+    if checked_at is None or now - checked_at > interval:
+        lag = measure_lag(alias)
+        _lag_cache[alias] = (now, lag)
+    return lag
+
+def measure_lag(alias):
+    """
+    Use the activity log as a heartbeat: the oldest event the replica has not
+    seen yet tells how far behind it is. A replica we cannot reach counts as
+    infinitely behind.
+    """
+    from forum_main.models import ActivityEvent
+
+    try:
+        seen = ActivityEvent.objects.using(alias).order_by('-pk').values_list('pk', flat=True).first() or 0
+        missing = (
+            ActivityEvent.objects.using(DEFAULT_DB_ALIAS)
+            .filter(pk__gt=seen).order_by('pk').values_list('created_at', flat=True).first()
+        )
+    except Exception:
+        return float('inf')
+    if missing is None:
+        return 0.0
+    return max((timezone.now() - missing).total_seconds(), 0.0)
+
+
+class ReadYourWritesMiddleware:
+    """
+    Pin unsafe requests, and safe requests made shortly after a write by the
+    same client, to the primary. The pin travels as a cookie, or as the
+    X-Forum-Pin header for clients that don't send cookies (the header value
+    is returned on every successful write).
+    """
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        writing = request.method not in self.SAFE_METHODS
+        token = _pinned.set(writing or self.recently_wrote(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _pinned.reset(token)
+
+        if writing and response.status_code < 400:
+            stamp = str(int(time.time()))
+            response.set_cookie(PIN_COOKIE, stamp, max_age=self.pin_seconds(), samesite='Lax')
+            response[PIN_HEADER] = stamp
+        return response
+
+    def pin_seconds(self):
+        return getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+
+    def recently_wrote(self, request):
+        stamp = request.COOKIES.get(PIN_COOKIE) or request.headers.get(PIN_HEADER)
+        try:
+            return time.time() - int(stamp) < self.pin_seconds()
+        except (TypeError, ValueError):
+            return False
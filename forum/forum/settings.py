@@ -14,6 +14,7 @@ import os
 import environ
 from pathlib import Path
 from datetime import timedelta
+from corsheaders.defaults import default_headers
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 env = environ.Env()
@@ -54,6 +55,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'forum.routers.ReadYourWritesMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -110,6 +112,22 @@ DATABASES = {
     }
 }
 
+# Read replicas: add their entries to DATABASES and list the aliases here,
+# e.g. DATABASE_REPLICAS=replica1,replica2. See forum/routers.py
+DATABASE_REPLICAS = env.list('DATABASE_REPLICAS', default=[])
+DATABASE_ROUTERS = ['forum.routers.PrimaryReplicaRouter']
+# Reads stay on the primary this long after a client writes
+REPLICA_PIN_SECONDS = env.int('REPLICA_PIN_SECONDS', default=10)
+# Replicas further behind than this are skipped
+REPLICA_MAX_LAG_SECONDS = env.float('REPLICA_MAX_LAG_SECONDS', default=5)
+REPLICA_LAG_CHECK_INTERVAL = env.float('REPLICA_LAG_CHECK_INTERVAL', default=2)
+
+# Shared cache for counters (notification unread counts etc). Per-process
+# memory by default, point CACHE_URL at redis/memcached when running several workers
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -155,9 +173,18 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL  = '/media/'
+# STORAGES alias avatars are kept in, user/storage.py stores them content addressed on top of it
+AVATAR_STORAGE = env('AVATAR_STORAGE', default='default')
 
 AUTH_USER_MODEL = 'user.User'
 
+# Password hashing runs on a bounded thread pool (user/hashing.py): at most
+# PASSWORD_HASH_WORKERS at once, PASSWORD_HASH_QUEUE_SIZE more waiting, the rest get a 503
+AUTHENTICATION_BACKENDS = ['user.backends.PooledModelBackend']
+PASSWORD_HASH_WORKERS = env.int('PASSWORD_HASH_WORKERS', default=os.cpu_count() or 2)
+PASSWORD_HASH_QUEUE_SIZE = env.int('PASSWORD_HASH_QUEUE_SIZE', default=64)
+PASSWORD_HASH_TIMEOUT = env.float('PASSWORD_HASH_TIMEOUT', default=10)
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
@@ -178,9 +205,100 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    # Blacklist lives in the cache, see user/tokens.py
+    'TOKEN_OBTAIN_SERIALIZER': 'user.tokens.CachedTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'user.tokens.CachedTokenRefreshSerializer',
 }
+# Cache alias holding blacklisted refresh token ids. It has to be shared by
+# every process (redis/memcached via CACHE_URL) once there is more than one;
+# settings_production.py refuses to start with a locmem/dummy cache here
+JWT_BLACKLIST_CACHE = env('JWT_BLACKLIST_CACHE', default='default')
 
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
 ] 
-# set the frontend domain here
\ No newline at end of file
+# set the frontend domain here
+
+# Read-your-writes pin header, see forum/routers.py
+CORS_ALLOW_HEADERS = (*default_headers, 'x-forum-pin')
+CORS_EXPOSE_HEADERS = ['X-Forum-Pin']
+
+# Activity log projections skip events younger than this (seconds), see forum_main/projections.py
+FORUM_PROJECTION_SETTLE_SECONDS = env.float('FORUM_PROJECTION_SETTLE_SECONDS', default=1)
+
+# MongoDB, used for denormalized post documents (forum_main/readmodels.py)
+# Use mongomock://localhost to run against an in-process stand-in
+MONGODB_URI = env('MONGODB_URI', default='mongodb://localhost:27017')
+MONGODB_DB = env('MONGODB_DB', default='forum')
+MONGODB_READ_MODELS = env.bool('MONGODB_READ_MODELS', default=False)
+MONGODB_MAX_POOL_SIZE = env.int('MONGODB_MAX_POOL_SIZE', default=50)
+MONGODB_MIN_POOL_SIZE = env.int('MONGODB_MIN_POOL_SIZE', default=0)
+MONGODB_MAX_IDLE_TIME_MS = env.int('MONGODB_MAX_IDLE_TIME_MS', default=60000)
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = env.int('MONGODB_SERVER_SELECTION_TIMEOUT_MS', default=3000)
+MONGODB_CONNECT_TIMEOUT_MS = env.int('MONGODB_CONNECT_TIMEOUT_MS', default=3000)
+MONGODB_SOCKET_TIMEOUT_MS = env.int('MONGODB_SOCKET_TIMEOUT_MS', default=5000)
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = env.int('MONGODB_WAIT_QUEUE_TIMEOUT_MS', default=2000)
+MONGODB_BULK_BATCH_SIZE = env.int('MONGODB_BULK_BATCH_SIZE', default=1000)
+
+# Background task queue (forum_main/queue.py), run workers with `manage.py run_worker`
+# Eager mode runs tasks in-process after commit, handy for runserver (TASK_QUEUE_EAGER=true)
+TASK_QUEUE_EAGER = env.bool('TASK_QUEUE_EAGER', default=False)
+TASK_QUEUE_CONCURRENCY = env.int('TASK_QUEUE_CONCURRENCY', default=4)
+TASK_QUEUE_VISIBILITY_TIMEOUT = env.int('TASK_QUEUE_VISIBILITY_TIMEOUT', default=300)
+
+# Bulk moderation requests touching more rows than this run on the task queue
+MODERATION_SYNC_LIMIT = env.int('MODERATION_SYNC_LIMIT', default=500)
+
+# Soft deleted posts/replies are hard deleted by the purger after this grace period,
+# PURGE_BATCH_SIZE rows at a time and only while the activity log sees fewer than
+# PURGE_QUIET_EVENTS_PER_MINUTE writes per minute
+PURGE_GRACE_SECONDS = env.int('PURGE_GRACE_SECONDS', default=3600)
+PURGE_BATCH_SIZE = env.int('PURGE_BATCH_SIZE', default=100)
+PURGE_MAX_BATCHES_PER_RUN = env.int('PURGE_MAX_BATCHES_PER_RUN', default=50)
+PURGE_QUIET_EVENTS_PER_MINUTE = env.int('PURGE_QUIET_EVENTS_PER_MINUTE', default=60)
+# A run that stopped early (busy, or PURGE_MAX_BATCHES_PER_RUN reached) retries after this long
+PURGE_RETRY_SECONDS = env.int('PURGE_RETRY_SECONDS', default=60)
+
+# Following feeds (forum_main/feeds.py). Authors with more followers than
+# FEED_FANOUT_MAX_FOLLOWERS are merged in on read instead of fanned out on write
+FEED_FANOUT_MAX_FOLLOWERS = env.int('FEED_FANOUT_MAX_FOLLOWERS', default=1000)
+FEED_MAX_LENGTH = env.int('FEED_MAX_LENGTH', default=1000)
+FEED_PAGE_SIZE = env.int('FEED_PAGE_SIZE', default=20)
+
+# Cached unread notification counters expire after this many seconds (forum_main/notifications.py)
+NOTIFICATION_COUNT_TTL = env.int('NOTIFICATION_COUNT_TTL', default=300)
+
+# Seconds between reputation reconciliation runs, started with `manage.py reconcile_reputation --schedule`
+REPUTATION_RECONCILE_INTERVAL = env.int('REPUTATION_RECONCILE_INTERVAL', default=24 * 3600)
+
+# User directory autocomplete answers are cached this long (user/directory.py)
+USER_DIRECTORY_CACHE_SECONDS = env.int('USER_DIRECTORY_CACHE_SECONDS', default=60)
+
+# Every Nth revision of a post/reply is stored in full, the rest as deltas (forum_main/revisions.py)
+REVISION_SNAPSHOT_EVERY = env.int('REVISION_SNAPSHOT_EVERY', default=10)
+
+# Statistics rollups (forum_main/rollups.py): minute buckets are folded into hours
+# after STATS_MINUTE_RETENTION seconds, hours into days after STATS_HOUR_RETENTION.
+# Compaction runs every STATS_COMPACT_INTERVAL seconds once `manage.py compact_stats --schedule` was run
+STATS_MINUTE_RETENTION = env.int('STATS_MINUTE_RETENTION', default=2 * 3600)
+STATS_HOUR_RETENTION = env.int('STATS_HOUR_RETENTION', default=7 * 86400)
+STATS_COMPACT_INTERVAL = env.int('STATS_COMPACT_INTERVAL', default=600)
+
+# Near-duplicate detection on new posts/replies (forum_main/spam.py). Content of at least
+# SPAM_MIN_WORDS words with SPAM_DUPLICATE_LIMIT or more near duplicates (estimated word
+# set similarity >= SPAM_MIN_SIMILARITY) from the last SPAM_WINDOW seconds is held for moderators
+SPAM_WINDOW = env.int('SPAM_WINDOW', default=86400)
+SPAM_MIN_SIMILARITY = env.float('SPAM_MIN_SIMILARITY', default=0.7)
+SPAM_DUPLICATE_LIMIT = env.int('SPAM_DUPLICATE_LIMIT', default=1)
+SPAM_MIN_WORDS = env.int('SPAM_MIN_WORDS', default=8)
+SPAM_MAX_CANDIDATES = env.int('SPAM_MAX_CANDIDATES', default=200)
+# Signatures past SPAM_WINDOW are pruned every SPAM_PRUNE_INTERVAL seconds once
+# `manage.py prune_spam_signatures --schedule` was run
+SPAM_PRUNE_INTERVAL = env.int('SPAM_PRUNE_INTERVAL', default=3600)
+
+# Related posts (forum_main/related.py) need numpy and scipy on the worker running them.
+# Lists keep RELATED_POSTS_K neighbours scoring at least RELATED_POSTS_MIN_SCORE and are
+# refreshed every RELATED_POSTS_INTERVAL seconds once `manage.py build_related_posts --schedule` was run
+RELATED_POSTS_K = env.int('RELATED_POSTS_K', default=10)
+RELATED_POSTS_MIN_SCORE = env.float('RELATED_POSTS_MIN_SCORE', default=0.05)
+RELATED_POSTS_INTERVAL = env.int('RELATED_POSTS_INTERVAL', default=900)
@@ -0,0 +1,58 @@
+"""
+Lean settings profile for production workers.
+
+    DJANGO_SETTINGS_MODULE=forum.settings_production gunicorn forum.wsgi
+
+Same as forum/settings.py minus what an API-only worker never uses: the
+admin (and the messages app it needs), staticfiles and the browsable API
+renderer. Fewer apps and renderers mean fewer modules imported and less
+app registry work at boot, which is what spin-up latency is made of.
+Run `manage.py profile_startup --settings=forum.settings_production` to
+see where the remaining startup time goes. SECRET_KEY and ALLOWED_HOSTS
+must be set in the environment.
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+from .settings import env
+
+DEBUG = env.bool('DEBUG', default=False)
+# No defaults: settings.py's key is committed and signs every JWT, refuse to boot without real values
+SECRET_KEY = env('SECRET_KEY')
+ALLOWED_HOSTS = env.list('ALLOWED_HOSTS')
+
+_UNUSED_APPS = ('django.contrib.admin', 'django.contrib.messages', 'django.contrib.staticfiles')
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in _UNUSED_APPS]
+MIDDLEWARE = [m for m in MIDDLEWARE if m != 'django.contrib.messages.middleware.MessageMiddleware']
+TEMPLATES = [{
+    **TEMPLATES[0],
+    'OPTIONS': {
+        **TEMPLATES[0]['OPTIONS'],
+        'context_processors': [
+            p for p in TEMPLATES[0]['OPTIONS']['context_processors']
+            if p != 'django.contrib.messages.context_processors.messages'
+        ],
+    },
+}]
+
+# JSON only, the browsable API pulls in templates and forms on the first request
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': ('rest_framework.renderers.JSONRenderer',),
+}
+
+# Caches every worker has to see. Revoked refresh tokens (logout, rotation) live
+# in JWT_BLACKLIST_CACHE and have to outlive a restart. The default cache holds
+# unread notification counters, which task workers bump for the web processes to read
+_PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+_SHARED_CACHES = [
+    (JWT_BLACKLIST_CACHE, 'JWT_BLACKLIST_CACHE ({!r}) must be a shared cache such as redis or memcached (set CACHE_URL), a process local one forgets revoked tokens'),
+    ('default', 'The {!r} cache must be a shared cache such as redis or memcached (set CACHE_URL), task workers update unread counters web processes read from it'),
+]
+for _alias, _message in _SHARED_CACHES:
+    if not DEBUG and CACHES.get(_alias, {}).get('BACKEND', _PROCESS_LOCAL_CACHES[0]) in _PROCESS_LOCAL_CACHES:
+        raise ImproperlyConfigured(_message.format(_alias))
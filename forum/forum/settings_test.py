@@ -0,0 +1,28 @@
+"""
+Settings for running the test suite locally, without the SQL Server instance.
+
+    python manage.py test --settings=forum.settings_test
+
+Two SQLite databases: 'default' and a 'replica' alias that the test runner
+sets up as a mirror of it (TEST MIRROR), so reads routed to the replica see
+the primary's committed rows through a connection of their own. The replica is
+not listed in DATABASE_REPLICAS here, tests that exercise routing turn it on
+with override_settings.
+"""
+
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db_replica.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    },
+}
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ForumMainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'forum_main'
+
+    def ready(self):
+        # Register background tasks by name
+        from . import tasks  # noqa: F401
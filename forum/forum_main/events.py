@@ -0,0 +1,46 @@
+from .models import ActivityEvent, Reply
+from .projections import schedule_projections
+
+#Helpers for writing to the activity log.
+#Call these inside the same transaction.atomic() block as the write itself,
+#so an event exists if and only if the change was committed.
+
+def record(kind, actor=None, post=None, reply=None, **payload):
+    event = ActivityEvent.objects.create(
+        kind=kind,
+        actor_id=_pk(actor),
+        post_id=_pk(post),
+        reply_id=_pk(reply),
+        payload=payload,
+    )
+    schedule_projections()
+    return event
+
+def record_many(kind, actor, rows, batch_size=500):
+    # rows: (post_id, reply_id, payload) tuples, written set-based. Content that
+    # predates its events (imports) passes (post_id, reply_id, payload, actor, created_at)
+    log = []
+    for post_id, reply_id, payload, *backdated in rows:
+        row_actor, created_at = backdated or (actor, None)
+        event = ActivityEvent(kind=kind, actor_id=_pk(row_actor), post_id=post_id, reply_id=reply_id, payload=payload)
+        if created_at is not None:
+            event.created_at = created_at
+        log.append(event)
+    ActivityEvent.objects.bulk_create(log, batch_size=batch_size)
+    schedule_projections()
+
+def reply_subtree_ids(root_ids):
+    # Walk the reply tree one level at a time, one query per level
+    ids = list(root_ids)
+    frontier = ids
+    while frontier:
+        frontier = list(
+            Reply.all_objects.filter(parent_id__in=frontier).values_list('id', flat=True)
+        )
+        ids.extend(frontier)
+    return ids
+
+def _pk(obj):
+    if obj is None:
+        return None
+    return getattr(obj, 'pk', obj)
@@ -0,0 +1,136 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from . import events
+from .models import ActivityEvent, Follow, ForumPost, Reply, TimelineEntry, UserStats
+
+#Following timelines.
+#New posts and replies are fanned out on write into TimelineEntry rows of every
+#follower (driven by the timelines projection), so reading a feed is one scan of
+#the (user, event_id) index. Authors with more than FEED_FANOUT_MAX_FOLLOWERS
+#followers are skipped on write, their followers pull those events from the
+#activity log on read instead and the two streams are merged by event id.
+
+FEED_KINDS = (ActivityEvent.POST_CREATED, ActivityEvent.REPLY_CREATED)
+
+def fanout_limit():
+    return getattr(settings, 'FEED_FANOUT_MAX_FOLLOWERS', 1000)
+
+def max_length():
+    return getattr(settings, 'FEED_MAX_LENGTH', 1000)
+
+def popular_authors(author_ids):
+    return set(
+        UserStats.objects.filter(user_id__in=author_ids, follower_count__gt=fanout_limit())
+        .values_list('user_id', flat=True)
+    )
+
+def follow(user, author=None, post=None):
+    """Toggle a follow of an author or a post, returns whether `user` follows afterwards."""
+    with transaction.atomic():
+        deleted, _ = Follow.objects.filter(follower=user, author=author, post=post).delete()
+        if not deleted:
+            Follow.objects.create(follower=user, author=author, post=post)
+        if author is not None:
+            # Follower counts live in the user_stats projection
+            events.record(ActivityEvent.USER_FOLLOWED, actor=user, users=[author.pk], followed=not deleted)
+    return not deleted
+
+def fan_out(log, batch_size=500):
+    created = [e for e in log if e.kind in FEED_KINDS]
+    if not created:
+        return 0
+    # Skip what was removed since, a replay must not resurrect it
+    live_posts = set(
+        ForumPost.objects.filter(pk__in={e.post_id for e in created}, is_hidden=False)
+        .values_list('pk', flat=True)
+    )
+    live_replies = set(
+        Reply.objects.filter(pk__in={e.reply_id for e in created if e.reply_id}, is_hidden=False)
+        .values_list('pk', flat=True)
+    )
+    created = [
+        e for e in created
+        if e.post_id in live_posts and (e.kind == ActivityEvent.POST_CREATED or e.reply_id in live_replies)
+    ]
+
+    authors = {e.actor_id for e in created}
+    popular = popular_authors(authors)
+    followers = {}
+    for follower_id, author_id in Follow.objects.filter(author_id__in=authors - popular).values_list('follower_id', 'author_id'):
+        followers.setdefault(('author', author_id), set()).add(follower_id)
+    reply_posts = {e.post_id for e in created if e.kind == ActivityEvent.REPLY_CREATED}
+    for follower_id, post_id in Follow.objects.filter(post_id__in=reply_posts).values_list('follower_id', 'post_id'):
+        followers.setdefault(('post', post_id), set()).add(follower_id)
+
+    rows = []
+    for e in created:
+        users = set(followers.get(('author', e.actor_id), ()))
+        if e.kind == ActivityEvent.REPLY_CREATED:
+            users |= followers.get(('post', e.post_id), set())
+        users.discard(e.actor_id)
+        rows += [
+            TimelineEntry(
+                user_id=user_id, event_id=e.pk, kind=e.kind,
+                post_id=e.post_id, reply_id=e.reply_id, created_at=e.created_at,
+            )
+            for user_id in users
+        ]
+    TimelineEntry.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+    trim({row.user_id for row in rows})
+    return len(rows)
+
+def trim(user_ids, chunk_size=500):
+    # One DELETE per chunk of users, rows are ranked newest first per user
+    # and everything ranked past FEED_MAX_LENGTH goes
+    keep = max_length()
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), chunk_size):
+        stale = (
+            TimelineEntry.objects.filter(user_id__in=user_ids[start:start + chunk_size])
+            .annotate(rank=Window(RowNumber(), partition_by=F('user_id'), order_by=F('event_id').desc()))
+            .filter(rank__gt=keep)
+            .values('pk')
+        )
+        TimelineEntry.objects.filter(pk__in=stale).delete()
+
+def read_timeline(user, before=None, limit=20):
+    """
+    One page of `user`'s feed, newest first, as (items, next_cursor).
+    Each item is a dict with the event id, kind, created_at and the live
+    post/reply objects; entries whose post or reply is gone are dropped.
+    """
+    entries = TimelineEntry.objects.filter(user=user)
+    if before is not None:
+        entries = entries.filter(event_id__lt=before)
+    items = {
+        row['event_id']: row
+        for row in entries.order_by('-event_id')
+        .values('event_id', 'kind', 'post_id', 'reply_id', 'created_at')[:limit]
+    }
+
+    followed = Follow.objects.filter(follower=user, author__isnull=False).values_list('author_id', flat=True)
+    popular = popular_authors(followed)
+    if popular:
+        pulled = ActivityEvent.objects.filter(actor_id__in=popular, kind__in=FEED_KINDS)
+        if before is not None:
+            pulled = pulled.filter(pk__lt=before)
+        for row in pulled.order_by('-pk').values('pk', 'kind', 'post_id', 'reply_id', 'created_at')[:limit]:
+            row['event_id'] = row.pop('pk')
+            items.setdefault(row['event_id'], row)
+
+    page = sorted(items.values(), key=lambda row: -row['event_id'])[:limit]
+    next_cursor = page[-1]['event_id'] if len(page) == limit else None
+
+    posts = ForumPost.objects.filter(pk__in={row['post_id'] for row in page}, is_hidden=False).select_related('author').in_bulk()
+    replies = Reply.objects.filter(pk__in={row['reply_id'] for row in page if row['reply_id']}, is_hidden=False).select_related('author').in_bulk()
+    result = []
+    for row in page:
+        post = posts.get(row['post_id'])
+        reply = replies.get(row['reply_id']) if row['reply_id'] else None
+        if post is None or (row['reply_id'] and reply is None):
+            continue
+        result.append(dict(row, post=post, reply=reply))
+    return result, next_cursor
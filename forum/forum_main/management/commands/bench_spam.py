@@ -0,0 +1,72 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from forum_main import spam
+from forum_main.models import ContentSignature
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the per-post cost of near-duplicate detection against a window "
+        "of recent signatures. Everything runs in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=20000, help="Recent signatures to compare against")
+        parser.add_argument('--checks', type=int, default=500, help="New posts to check")
+        parser.add_argument('--words', type=int, default=60, help="Words per post")
+        parser.add_argument('--duplicates', type=float, default=0.2, help="Share of checked posts that are near copies")
+
+    def handle(self, *args, **options):
+        rng = random.Random(1)
+        vocabulary = [''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(2, 9))) for _ in range(5000)]
+
+        def text():
+            return ' '.join(rng.choices(vocabulary, k=options['words']))
+
+        with transaction.atomic():
+            author = User.objects.create_user(username=f'spambench{rng.getrandbits(32)}', password=None,
+                                              nickname=f'spambench{rng.getrandbits(32)}')
+            texts = []
+            started = time.perf_counter()
+            for _ in range(options['seed']):
+                texts.append(text())
+                signature = spam.check(author, texts[-1])
+                signature.held = False
+                spam.remember(signature)
+            self.stdout.write(f"Seeded {options['seed']} signature(s) in {time.perf_counter() - started:.1f}s")
+
+            timings, hashing, caught, copies = [], [], 0, 0
+            for _ in range(options['checks']):
+                if rng.random() < options['duplicates']:
+                    # A near copy: a few words swapped out
+                    words = rng.choice(texts).split()
+                    for _ in range(max(1, len(words) // 20)):
+                        words[rng.randrange(len(words))] = rng.choice(vocabulary)
+                    body, copies = ' '.join(words), copies + 1
+                else:
+                    body = text()
+                started = time.perf_counter()
+                spam.minhash(spam.WORD.findall(body.lower()))
+                hashing.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                signature = spam.check(author, body)
+                timings.append(time.perf_counter() - started)
+                caught += signature.duplicates > 0
+
+            transaction.set_rollback(True)
+
+        timings.sort()
+        self.stdout.write(
+            f"{len(timings)} check(s) of {options['words']} words: mean {statistics.mean(timings) * 1000:.2f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95)] * 1000:.2f} ms (hashing alone {statistics.mean(hashing) * 1000:.2f} ms)"
+        )
+        self.stdout.write(f"Flagged {caught} of {len(timings)}, {copies} were near copies")
+        self.stdout.write(f"{ContentSignature.objects.count()} signature(s) left behind")
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from forum_main import related
+from forum_main.tasks import schedule_related_refresh
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute related posts from TF-IDF similarity. Updates posts created or "
+        "edited since the last run, or everything with --full. Needs numpy and scipy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Rebuild every post's list")
+        parser.add_argument('--chunk-size', type=int, default=256, help="Posts per sparse matrix product")
+        parser.add_argument('--schedule', action='store_true',
+                            help="Queue the periodic refresh task instead of running now")
+
+    def handle(self, *args, **options):
+        if not related.available():
+            raise CommandError("Related posts need numpy and scipy, install them on this worker")
+        if options['schedule']:
+            schedule_related_refresh()
+            self.stdout.write(self.style.SUCCESS("Related posts refresh scheduled"))
+            return
+        started = time.perf_counter()
+        run = related.build if options['full'] else related.refresh
+        done = run(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated related posts of {done} post(s) in {time.perf_counter() - started:.1f}s"
+        ))
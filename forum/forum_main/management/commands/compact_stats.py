@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from forum_main import rollups
+from forum_main.tasks import schedule_stats_compaction
+
+
+class Command(BaseCommand):
+    help = "Fold aged minute statistics buckets into hours, and hours into days."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Buckets per transaction")
+        parser.add_argument('--schedule', action='store_true',
+                            help="Queue the periodic compaction task instead of running now")
+
+    def handle(self, *args, **options):
+        if options['schedule']:
+            schedule_stats_compaction()
+            self.stdout.write(self.style.SUCCESS("Statistics compaction scheduled"))
+            return
+        folded = rollups.compact(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Folded {folded} bucket(s)"))
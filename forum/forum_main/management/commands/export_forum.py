@@ -0,0 +1,24 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from forum_main import transfer
+
+
+class Command(BaseCommand):
+    help = "Stream users, posts, replies and upvotes to a JSONL file (or stdout)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', nargs='?', default='-', help="File to write, - for stdout")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched per round trip")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['output'] == '-':
+            count = transfer.export_jsonl(sys.stdout, options['chunk_size'])
+        else:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                count = transfer.export_jsonl(f, options['chunk_size'])
+        elapsed = time.monotonic() - started
+        self.stderr.write(f"Exported {count} object(s) in {elapsed:.1f}s ({count / max(elapsed, 1e-6):.0f}/s)")
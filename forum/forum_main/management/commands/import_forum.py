@@ -0,0 +1,46 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from forum_main import transfer
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a JSONL file written by export_forum. Ids are remapped, usernames "
+        "that already exist get the old id appended (or with --merge-users are "
+        "taken to be the same person), and a rerun with the same --source resumes "
+        "after the last committed batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="JSONL file to read")
+        parser.add_argument('--source', help="Name of this import for mappings and checkpoints, default the file name")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Objects per bulk_create and commit")
+        parser.add_argument('--merge-users', action='store_true', help="Map users onto existing accounts with the same username")
+
+    def handle(self, *args, **options):
+        source = options['source'] or os.path.basename(options['input'])
+        try:
+            importer = transfer.Importer(source, batch_size=options['batch_size'], merge_users=options['merge_users'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        resume = importer.position()
+        if resume:
+            self.stdout.write(f"Resuming {source} after line {resume}")
+        started = time.monotonic()
+        with open(options['input'], encoding='utf-8') as f:
+            try:
+                counts = importer.run(f)
+            except (ValueError, KeyError) as e:
+                raise CommandError(f"Stopped after line {importer.position()}: {e!r}, fix the input and rerun to resume")
+        elapsed = time.monotonic() - started
+        total = sum(counts.values())
+        for kind, n in counts.items():
+            self.stdout.write(f"  {kind}: {n}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {total} object(s) in {elapsed:.1f}s ({total / max(elapsed, 1e-6):.0f}/s)"
+        ))
+        self.stdout.write("Stats catch up from the activity log, run rebuild_read_models if MongoDB documents are on")
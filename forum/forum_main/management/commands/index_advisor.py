@@ -0,0 +1,219 @@
+import json
+import re
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import get_runner
+
+DEFAULT_APPS = ['forum_main', 'user']
+
+SHOWPLAN_NS = {'p': 'http://schemas.microsoft.com/sqlserver/2004/07/showplan'}
+# Operators that read the whole table, or the whole of one of its indexes
+MSSQL_SCANS = {'Table Scan', 'Clustered Index Scan', 'Index Scan'}
+
+
+class QueryCollector:
+    """
+    connection.execute_wrapper() hook that remembers every distinct statement
+    (with one sample of its params) touching the tables we care about.
+    """
+
+    def __init__(self, tables):
+        self.tables = set(tables)
+        self.queries = {}
+        self.counts = defaultdict(int)
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            if any(t in sql for t in self.tables):
+                self.counts[sql] += 1
+                self.queries.setdefault(sql, params)
+        return execute(sql, params, many, context)
+
+
+class IndexAdvisor:
+    def __init__(self, conn, tables):
+        self.conn = conn
+        self.tables = tables
+
+    @classmethod
+    def supported(cls):
+        return sorted(name[len('_explain_'):] for name in dir(cls) if name.startswith('_explain_'))
+
+    @classmethod
+    def check_vendor(cls, vendor):
+        if vendor not in cls.supported():
+            raise CommandError(
+                f"EXPLAIN is not supported for the {vendor} backend, only for {', '.join(cls.supported())}"
+            )
+
+    def analyze(self, queries, counts):
+        self.check_vendor(self.conn.vendor)
+        explain = getattr(self, f'_explain_{self.conn.vendor}')
+
+        scans = defaultdict(list)
+        sorts = []
+        used = set()
+        with self.conn.cursor() as cursor:
+            for sql, params in queries.items():
+                try:
+                    with transaction.atomic(using=self.conn.alias):
+                        plan = explain(cursor, sql, params)
+                except Exception:
+                    continue
+                for table in plan['scans']:
+                    if table in self.tables:
+                        scans[table].append((counts[sql], sql))
+                if plan['temp_sort']:
+                    sorts.append((counts[sql], sql))
+                used.update(plan['indexes'])
+            declared = self._declared_indexes(cursor)
+
+        unused = sorted(
+            (table, name) for table, names in declared.items()
+            for name in names if name not in used
+        )
+        return {'scans': scans, 'sorts': sorts, 'unused': unused}
+
+    def _declared_indexes(self, cursor):
+        declared = {}
+        for table in self.tables:
+            constraints = self.conn.introspection.get_constraints(cursor, table)
+            declared[table] = [
+                name for name, info in constraints.items()
+                if info['index'] and not info['primary_key'] and not info['unique']
+            ]
+        return declared
+
+    def _explain_sqlite(self, cursor, sql, params):
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        details = [row[-1] for row in cursor.fetchall()]
+        plan = {'scans': set(), 'indexes': set(), 'temp_sort': False}
+        for detail in details:
+            # SCAN walks every row, even when it goes through an index to get the order
+            m = re.match(r'SCAN (?:TABLE )?"?(\w+)"?', detail)
+            if m:
+                plan['scans'].add(m.group(1))
+            m = re.search(r'USING (?:COVERING )?INDEX "?(\w+)"?', detail)
+            if m:
+                plan['indexes'].add(m.group(1))
+            if 'USE TEMP B-TREE FOR ORDER BY' in detail:
+                plan['temp_sort'] = True
+        return plan
+
+    def _explain_postgresql(self, cursor, sql, params):
+        # Test tables are nearly empty, so make the planner show whether an index could be used at all
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        raw = cursor.fetchone()[0]
+        nodes = [(raw if isinstance(raw, list) else json.loads(raw))[0]['Plan']]
+        plan = {'scans': set(), 'indexes': set(), 'temp_sort': False}
+        while nodes:
+            node = nodes.pop()
+            if node['Node Type'] == 'Seq Scan':
+                plan['scans'].add(node['Relation Name'])
+            if 'Index Name' in node:
+                plan['indexes'].add(node['Index Name'])
+            if node['Node Type'] == 'Sort':
+                plan['temp_sort'] = True
+            nodes.extend(node.get('Plans', []))
+        return plan
+
+    def _explain_microsoft(self, cursor, sql, params):
+        # SQL Server (mssql-django): with SHOWPLAN_XML on, statements return their estimated plan instead of running
+        cursor.execute('SET SHOWPLAN_XML ON')
+        try:
+            cursor.execute(sql, params)
+            raw = cursor.fetchone()[0]
+        finally:
+            cursor.execute('SET SHOWPLAN_XML OFF')
+        return parse_showplan(raw)
+
+
+def parse_showplan(raw):
+    plan = {'scans': set(), 'indexes': set(), 'temp_sort': False}
+    for op in ET.fromstring(raw).iter(f"{{{SHOWPLAN_NS['p']}}}RelOp"):
+        physical = op.get('PhysicalOp')
+        if physical == 'Sort':
+            plan['temp_sort'] = True
+        # The operator's own table, not those of nested operators
+        for obj in op.findall('./*/p:Object', SHOWPLAN_NS):
+            table = obj.get('Table', '').strip('[]')
+            if physical in MSSQL_SCANS:
+                plan['scans'].add(table)
+            if obj.get('Index'):
+                plan['indexes'].add(obj.get('Index').strip('[]'))
+    return plan
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the test suite, capture the queries it issues, EXPLAIN them on the "
+        "active backend (SQLite, PostgreSQL or SQL Server) and report full table "
+        "scans, sorts without an index and indexes no captured query used."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('test_labels', nargs='*', help="Test labels, defaults to the whole suite")
+        parser.add_argument('--app', action='append', dest='apps',
+                            help=f"App whose tables are checked (repeatable), default {', '.join(DEFAULT_APPS)}")
+        parser.add_argument('--top', type=int, default=5, help="Example queries shown per finding")
+
+    def handle(self, *args, **options):
+        # Before spending a whole suite run on it
+        IndexAdvisor.check_vendor(connection.vendor)
+        tables = self.tables(options['apps'] or DEFAULT_APPS)
+        collector = QueryCollector(tables)
+        report = {}
+
+        class AdvisorRunner(get_runner(settings)):
+            def run_suite(self, suite, **kwargs):
+                with connection.execute_wrapper(collector):
+                    result = super().run_suite(suite, **kwargs)
+                # Analyze before teardown, while the test database still exists
+                report.update(IndexAdvisor(connection, tables).analyze(collector.queries, collector.counts))
+                return result
+
+        failures = AdvisorRunner(verbosity=0, interactive=False).run_tests(options['test_labels'])
+        if failures:
+            self.stderr.write(f"{failures} test(s) failed, the capture may be incomplete")
+        self.print_report(report, collector, options['top'])
+
+    def tables(self, app_labels):
+        tables = set()
+        for label in app_labels:
+            for model in apps.get_app_config(label).get_models(include_auto_created=True):
+                tables.add(model._meta.db_table)
+        return tables
+
+    def print_report(self, report, collector, top):
+        total = sum(collector.counts.values())
+        self.stdout.write(f"Captured {len(collector.queries)} distinct statement(s), {total} execution(s)\n")
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Full table scans"))
+        if not report['scans']:
+            self.stdout.write("  none")
+        for table, hits in sorted(report['scans'].items(), key=lambda kv: -sum(n for n, _ in kv[1])):
+            self.stdout.write(f"  {table}: {len(hits)} statement(s), {sum(n for n, _ in hits)} execution(s)")
+            for n, sql in sorted(hits, reverse=True)[:top]:
+                self.stdout.write(f"    x{n} {self.short(sql)}")
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Sorts without a supporting index"))
+        if not report['sorts']:
+            self.stdout.write("  none")
+        for n, sql in sorted(report['sorts'], reverse=True)[:top]:
+            self.stdout.write(f"  x{n} {self.short(sql)}")
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Indexes not used by any captured query"))
+        if not report['unused']:
+            self.stdout.write("  none")
+        for table, name in report['unused']:
+            self.stdout.write(f"  {table}.{name}")
+
+    def short(self, sql, width=160):
+        sql = ' '.join(sql.split())
+        return sql if len(sql) <= width else sql[:width - 3] + '...'
@@ -0,0 +1,91 @@
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+IMPORTTIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+# Runs in a fresh interpreter: import the server entry point and the URLconf
+# (which otherwise loads on the first request), then print the elapsed seconds
+BOOT = '''
+import time
+start = time.perf_counter()
+import importlib
+importlib.import_module({module!r})
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(time.perf_counter() - start)
+'''
+
+
+def parse_importtime(output):
+    """(module, self_us, cumulative_us, depth) for each line of `python -X importtime` output."""
+    rows = []
+    for line in output.splitlines():
+        match = IMPORTTIME.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+
+def by_package(rows):
+    totals = defaultdict(int)
+    for module, self_us, _, _ in rows:
+        totals[module.split('.')[0]] += self_us
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+
+class Command(BaseCommand):
+    help = (
+        "Boot the WSGI/ASGI application in fresh interpreters and report the "
+        "startup time and what the imports cost, per package and per module. "
+        "Uses the settings this command runs with (see --settings)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=('wsgi', 'asgi'), default='wsgi')
+        parser.add_argument('--repeat', type=int, default=5, help="Cold starts to time")
+        parser.add_argument('--top', type=int, default=15, help="Rows per table")
+
+    def handle(self, *args, **options):
+        module = f'forum.{options["target"]}'
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'forum.settings'),
+            PYTHONPATH=os.pathsep.join(p for p in sys.path if p),
+        )
+        # No stale bytecode writes or eager task side effects skewing the numbers
+        env['PYTHONDONTWRITEBYTECODE'] = '1'
+
+        timings, rows = [], []
+        for _ in range(max(options['repeat'], 1)):
+            proc = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', BOOT.format(module=module)],
+                capture_output=True, text=True, env=env, cwd=settings.BASE_DIR,
+            )
+            if proc.returncode:
+                raise CommandError(f"Booting {module} failed:\n{proc.stderr[-2000:]}")
+            timings.append(float(proc.stdout.strip().splitlines()[-1]))
+            rows = parse_importtime(proc.stderr)
+
+        top = options['top']
+        total_us = sum(self_us for _, self_us, _, _ in rows)
+        self.stdout.write(
+            f"{module} with {env['DJANGO_SETTINGS_MODULE']}: boot {min(timings) * 1000:.0f} ms best, "
+            f"{statistics.median(timings) * 1000:.0f} ms median of {len(timings)}; "
+            f"{len(rows)} module(s) imported in {total_us / 1000:.0f} ms"
+        )
+
+        self.stdout.write("\nSelf import time by top-level package:")
+        for package, self_us in by_package(rows)[:top]:
+            self.stdout.write(f"  {self_us / 1000:8.1f} ms  {package}")
+
+        self.stdout.write("\nSlowest modules (self / cumulative):")
+        for name, self_us, cumulative_us, _ in sorted(rows, key=lambda row: -row[1])[:top]:
+            self.stdout.write(f"  {self_us / 1000:8.1f} / {cumulative_us / 1000:8.1f} ms  {name}")
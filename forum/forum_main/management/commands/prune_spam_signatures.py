@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from forum_main import spam
+from forum_main.tasks import schedule_spam_prune
+
+
+class Command(BaseCommand):
+    help = "Delete near-duplicate signatures older than SPAM_WINDOW (held ones stay until reviewed)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Signatures per transaction")
+        parser.add_argument('--schedule', action='store_true',
+                            help="Queue the periodic prune task instead of running now")
+
+    def handle(self, *args, **options):
+        if options['schedule']:
+            schedule_spam_prune()
+            self.stdout.write(self.style.SUCCESS("Signature pruning scheduled"))
+            return
+        deleted = spam.prune(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} signature(s)"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from forum_main import moderation
+
+
+class Command(BaseCommand):
+    help = "Hard-delete soft deleted posts and replies whose grace period is over."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows per transaction, default PURGE_BATCH_SIZE")
+        parser.add_argument('--max-batches', type=int, default=None, help="Stop after this many batches")
+        parser.add_argument('--force', action='store_true', help="Keep going even when the forum is busy")
+
+    def handle(self, *args, **options):
+        posts, replies, finished = moderation.purge_deleted(
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            force=options['force'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Purged {posts} post(s) and {replies} reply(ies)"))
+        if not finished:
+            self.stdout.write("Stopped early, deleted rows remain")
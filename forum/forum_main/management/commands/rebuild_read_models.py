@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from forum_main import readmodels
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized post documents in MongoDB from SQL."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Operations per bulk_write call")
+
+    def handle(self, *args, **options):
+        count = readmodels.rebuild_all(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} post document(s)"))
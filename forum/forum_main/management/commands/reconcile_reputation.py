@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from forum_main import reputation
+from forum_main.tasks import schedule_reputation_reconcile
+
+
+class Command(BaseCommand):
+    help = "Recompute user reputation from the vote tables, fixing rows that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Users per transaction")
+        parser.add_argument('--schedule', action='store_true',
+                            help="Queue the periodic reconciliation task instead of running now")
+
+    def handle(self, *args, **options):
+        if options['schedule']:
+            schedule_reputation_reconcile()
+            self.stdout.write(self.style.SUCCESS("Reputation reconciliation scheduled"))
+            return
+        fixed = reputation.reconcile(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Fixed reputation of {fixed} user(s)"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from forum_main.projections import replay_projections
+
+
+class Command(BaseCommand):
+    help = "Rebuild read model projections from offset zero of the activity log."
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Projection names, defaults to all")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            done = replay_projections(options['names'], batch_size=options['batch_size'])
+        except KeyError as e:
+            raise CommandError(e.args[0])
+        for name, count in done.items():
+            self.stdout.write(self.style.SUCCESS(f"{name}: replayed {count} event(s)"))
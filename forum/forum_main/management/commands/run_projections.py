@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from forum_main.projections import run_projections
+
+
+class Command(BaseCommand):
+    help = "Apply new activity events to the read model projections."
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Projection names, defaults to all")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--follow', action='store_true', help="Keep polling for new events")
+        parser.add_argument('--interval', type=float, default=1.0, help="Poll interval in seconds with --follow")
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                done = run_projections(options['names'], batch_size=options['batch_size'])
+                for name, count in done.items():
+                    if count:
+                        self.stdout.write(f"{name}: {count} event(s)")
+                if not options['follow']:
+                    break
+                time.sleep(options['interval'])
+        except KeyError as e:
+            raise CommandError(e.args[0])
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from forum_main.queue import Worker
+
+
+class Command(BaseCommand):
+    help = "Run background tasks from the database queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=None, help="Worker threads, defaults to TASK_QUEUE_CONCURRENCY")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Run one batch and exit")
+
+    def handle(self, *args, **options):
+        worker = Worker(concurrency=options['concurrency'])
+        if options['once']:
+            results = worker.run_once()
+            self.stdout.write(f"Ran {len(results)} task(s), {results.count(False)} failed")
+            return
+        self.stdout.write(f"Worker {worker.worker_id} started with {worker.concurrency} thread(s)")
+        worker.run_forever(poll_interval=options['poll_interval'])
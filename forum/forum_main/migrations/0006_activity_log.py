@@ -0,0 +1,82 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:23
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def seed_events(apps, schema_editor):
+    # Give content created before the log existed a creation event, so a
+    # replay from offset zero covers the whole forum
+    ForumPost = apps.get_model('forum_main', 'ForumPost')
+    Reply = apps.get_model('forum_main', 'Reply')
+    ActivityEvent = apps.get_model('forum_main', 'ActivityEvent')
+    db = schema_editor.connection.alias
+
+    rows = [
+        ActivityEvent(kind='post_created', actor_id=author_id, post_id=pk, created_at=created_at)
+        for pk, author_id, created_at in ForumPost.objects.using(db)
+        .order_by('created_at', 'pk').values_list('pk', 'author_id', 'created_at')
+    ]
+    rows += [
+        ActivityEvent(
+            kind='reply_created', actor_id=author_id, post_id=post_id, reply_id=pk,
+            payload={'parent': parent_id}, created_at=created_at
+        )
+        for pk, author_id, post_id, parent_id, created_at in Reply.objects.using(db)
+        .order_by('created_at', 'pk').values_list('pk', 'author_id', 'post_id', 'parent_id', 'created_at')
+    ]
+    ActivityEvent.objects.using(db).bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('forum_main', '0005_alter_reply_parent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post_created', 'Post created'), ('post_edited', 'Post edited'), ('post_deleted', 'Post deleted'), ('reply_created', 'Reply created'), ('reply_edited', 'Reply edited'), ('reply_deleted', 'Reply deleted'), ('post_voted', 'Post vote toggled'), ('reply_voted', 'Reply vote toggled')], max_length=32)),
+                ('actor_id', models.BigIntegerField(blank=True, null=True)),
+                ('post_id', models.BigIntegerField(blank=True, null=True)),
+                ('reply_id', models.BigIntegerField(blank=True, null=True)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PostStats',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='forum_main.forumpost')),
+                ('reply_count', models.IntegerField(default=0)),
+                ('upvotes', models.IntegerField(default=0)),
+                ('latest_reply_time', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProjectionState',
+            fields=[
+                ('name', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('post_count', models.IntegerField(default=0)),
+                ('reply_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_events, migrations.RunPython.noop),
+    ]
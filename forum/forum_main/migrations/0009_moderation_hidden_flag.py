@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum_main', '0008_post_reply_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forumpost',
+            name='is_hidden',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='is_hidden',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='activityevent',
+            name='kind',
+            field=models.CharField(choices=[('post_created', 'Post created'), ('post_edited', 'Post edited'), ('post_deleted', 'Post deleted'), ('reply_created', 'Reply created'), ('reply_edited', 'Reply edited'), ('reply_deleted', 'Reply deleted'), ('post_voted', 'Post vote toggled'), ('reply_voted', 'Reply vote toggled'), ('post_hidden', 'Post hidden'), ('reply_hidden', 'Reply hidden')], max_length=32),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum_main', '0009_moderation_hidden_flag'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='forumpost',
+            name='post_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='forumpost',
+            name='post_author_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='reply',
+            name='reply_post_created_idx',
+        ),
+        migrations.AddField(
+            model_name='forumpost',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='forumpost',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['-created_at'], name='post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='forumpost',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['author', '-created_at'], name='post_author_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='forumpost',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='post_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reply',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['post', 'created_at'], name='reply_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reply',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='reply_deleted_idx'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:38
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum_main', '0010_soft_delete'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Follow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.BigIntegerField()),
+                ('kind', models.CharField(max_length=32)),
+                ('created_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='userstats',
+            name='follower_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='activityevent',
+            name='kind',
+            field=models.CharField(choices=[('post_created', 'Post created'), ('post_edited', 'Post edited'), ('post_deleted', 'Post deleted'), ('reply_created', 'Reply created'), ('reply_edited', 'Reply edited'), ('reply_deleted', 'Reply deleted'), ('post_voted', 'Post vote toggled'), ('reply_voted', 'Reply vote toggled'), ('post_hidden', 'Post hidden'), ('reply_hidden', 'Reply hidden'), ('post_purged', 'Post hard deleted'), ('reply_purged', 'Reply hard deleted'), ('user_followed', 'Author follow toggled')], max_length=32),
+        ),
+        migrations.AddIndex(
+            model_name='activityevent',
+            index=models.Index(condition=models.Q(('kind__in', ['post_created', 'reply_created'])), fields=['actor_id', '-id'], name='event_actor_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='follow',
+            name='author',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='followers', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='follow',
+            name='follower',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='following', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='follow',
+            name='post',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='followers', to='forum_main.forumpost'),
+        ),
+        migrations.AddField(
+            model_name='timelineentry',
+            name='post',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='forum_main.forumpost'),
+        ),
+        migrations.AddField(
+            model_name='timelineentry',
+            name='reply',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='forum_main.reply'),
+        ),
+        migrations.AddField(
+            model_name='timelineentry',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(condition=models.Q(('author__isnull', False)), fields=('follower', 'author'), name='follow_author_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(condition=models.Q(('post__isnull', False)), fields=('follower', 'post'), name='follow_post_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'event_id'), name='timeline_user_event_uniq'),
+        ),
+    ]
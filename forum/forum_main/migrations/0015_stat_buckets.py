@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum_main', '0014_import_tracking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=16)),
+                ('resolution', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour'), ('day', 'Day')], max_length=6)),
+                ('start', models.DateTimeField()),
+                ('key', models.BigIntegerField(default=0)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['resolution', 'start'], name='stat_bucket_age_idx')],
+                'constraints': [models.UniqueConstraint(fields=('metric', 'resolution', 'start', 'key'), name='stat_bucket_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum_main', '0015_stat_buckets'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activityevent',
+            name='kind',
+            field=models.CharField(choices=[('post_created', 'Post created'), ('post_edited', 'Post edited'), ('post_deleted', 'Post deleted'), ('reply_created', 'Reply created'), ('reply_edited', 'Reply edited'), ('reply_deleted', 'Reply deleted'), ('post_voted', 'Post vote toggled'), ('reply_voted', 'Reply vote toggled'), ('post_hidden', 'Post hidden'), ('reply_hidden', 'Reply hidden'), ('post_purged', 'Post hard deleted'), ('reply_purged', 'Reply hard deleted'), ('user_followed', 'Author follow toggled'), ('post_approved', 'Held post approved'), ('reply_approved', 'Held reply approved')], max_length=32),
+        ),
+        migrations.CreateModel(
+            name='ContentSignature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minhash', models.JSONField()),
+                ('duplicates', models.IntegerField(default=0)),
+                ('held', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='forum_main.forumpost')),
+                ('reply', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='forum_main.reply')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ContentBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('signature', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='forum_main.contentsignature')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='contentsignature',
+            index=models.Index(condition=models.Q(('held', True)), fields=['created_at'], name='signature_held_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contentband',
+            index=models.Index(fields=['key', 'created_at'], name='content_band_key_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:13
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum_main', '0016_content_signatures'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedPosts',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='forum_main.forumpost')),
+                ('related', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum_main', '0017_related_posts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contentsignature',
+            index=models.Index(fields=['created_at'], name='signature_created_idx'),
+        ),
+    ]
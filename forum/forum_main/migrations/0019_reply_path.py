@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    # One level of the reply trees at a time, one UPDATE per reply that has children
+    Reply = apps.get_model('forum_main', 'Reply')
+    db = schema_editor.connection.alias
+    frontier = {pk: '' for pk in Reply.objects.using(db).filter(parent__isnull=True).values_list('pk', flat=True)}
+    while frontier:
+        parents = list(frontier)
+        children, with_children = {}, set()
+        for start in range(0, len(parents), 500):
+            rows = Reply.objects.using(db).filter(parent_id__in=parents[start:start + 500]).values_list('pk', 'parent_id')
+            for pk, parent_id in rows:
+                children[pk] = f'{frontier[parent_id]}{parent_id}/'
+                with_children.add(parent_id)
+        for parent_id in with_children:
+            Reply.objects.using(db).filter(parent_id=parent_id).update(path=f'{frontier[parent_id]}{parent_id}/')
+        frontier = children
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum_main', '0018_content_signature_created_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reply',
+            name='path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=1000),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='reply',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['post'], name='reply_deleted_post_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 20:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum_main', '0019_reply_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100, unique=True)),
+                ('df', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RelatedBacklink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('holder', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='forum_main.forumpost')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='forum_main.forumpost')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('post', 'holder'), name='related_backlink_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RelatedPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weight', models.FloatField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='forum_main.forumpost')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='forum_main.relatedterm')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('term', 'post'), name='related_posting_uniq')],
+            },
+        ),
+    ]
@@ -1,9 +1,30 @@
 from django.db import models
+from django.db.models import CharField, Exists, F, OuterRef, Value
+from django.db.models.functions import Cast, Concat
+from django.db.models.lookups import StartsWith
 from django.conf import settings
 from django.utils import timezone
 
 #Forum models
 
+#Soft deleted rows stay in the table until the purger removes them
+#(forum_main.moderation.purge_deleted). `objects` only sees live rows,
+#use `all_objects` when deleted ones matter.
+class LiveManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+#Deleting a post or reply stamps only that row. Replies also disappear while
+#their post or any reply above them is deleted, the purger takes them later.
+class LiveReplyManager(LiveManager):
+    def get_queryset(self):
+        deleted_above = (
+            self.model._base_manager.filter(post_id=OuterRef('post_id'), deleted_at__isnull=False)
+            .annotate(below=Concat(F('path'), Cast('pk', CharField()), Value('/'), output_field=CharField()))
+            .filter(StartsWith(OuterRef('path'), F('below')))
+        )
+        return super().get_queryset().filter(post__deleted_at__isnull=True).filter(~Exists(deleted_above))
+
 #Forum post model with title, content, author, created_at, and upvotes
 class ForumPost(models.Model):
     title = models.CharField(max_length=100)
@@ -19,6 +40,24 @@ class ForumPost(models.Model):
         related_name='upvoted_posts',
         blank=True,
     )
+    #Hidden by a moderator, kept out of every public list
+    is_hidden   = models.BooleanField(default=False)
+    deleted_at  = models.DateTimeField(null=True, blank=True)
+
+    objects     = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            #Post list and per-user lists are newest first, live rows only
+            models.Index(fields=['-created_at'], name='post_created_idx',
+                         condition=models.Q(deleted_at__isnull=True)),
+            models.Index(fields=['author', '-created_at'], name='post_author_created_idx',
+                         condition=models.Q(deleted_at__isnull=True)),
+            #What the purger picks up
+            models.Index(fields=['deleted_at'], name='post_deleted_idx',
+                         condition=models.Q(deleted_at__isnull=False)),
+        ]
 
     @property
     def upvotes_count(self):
@@ -48,13 +87,406 @@ class Reply(models.Model):
         on_delete=models.CASCADE,
         related_name='+'
     )
+    #Ids of the replies above this one, top first: '12/40/'. Set on save
+    path        = models.CharField(max_length=1000, default='', blank=True, editable=False)
 
     upvoted_by  = models.ManyToManyField(
         settings.AUTH_USER_MODEL,
         related_name='upvoted_replies',
         blank=True,
     )
+    is_hidden   = models.BooleanField(default=False)
+    deleted_at  = models.DateTimeField(null=True, blank=True)
+
+    objects     = LiveReplyManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            #Replies of a post in display order
+            models.Index(fields=['post', 'created_at'], name='reply_post_created_idx',
+                         condition=models.Q(deleted_at__isnull=True)),
+            models.Index(fields=['deleted_at'], name='reply_deleted_idx',
+                         condition=models.Q(deleted_at__isnull=False)),
+            #Deleted replies of a post, for LiveReplyManager
+            models.Index(fields=['post'], name='reply_deleted_post_idx',
+                         condition=models.Q(deleted_at__isnull=False)),
+        ]
 
     @property
     def upvotes(self):
-        return self.upvoted_by.count()
\ No newline at end of file
+        return self.upvoted_by.count()
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.parent_id and not self.path:
+            self.path = reply_path(self.parent)
+        super().save(*args, **kwargs)
+
+def reply_path(parent):
+    """`path` of a reply to `parent`."""
+    return f'{parent.path}{parent.pk}/'
+
+#Append-only activity log, written in the same transaction as the change it describes.
+#Ids are plain integers on purpose, the log outlives the rows it points at.
+class ActivityEvent(models.Model):
+    POST_CREATED  = 'post_created'
+    POST_EDITED   = 'post_edited'
+    POST_DELETED  = 'post_deleted'
+    REPLY_CREATED = 'reply_created'
+    REPLY_EDITED  = 'reply_edited'
+    REPLY_DELETED = 'reply_deleted'
+    POST_VOTED    = 'post_voted'
+    REPLY_VOTED   = 'reply_voted'
+    POST_HIDDEN   = 'post_hidden'
+    REPLY_HIDDEN  = 'reply_hidden'
+    POST_PURGED   = 'post_purged'
+    REPLY_PURGED  = 'reply_purged'
+    USER_FOLLOWED = 'user_followed'
+    POST_APPROVED = 'post_approved'
+    REPLY_APPROVED = 'reply_approved'
+
+    KIND_CHOICES = [
+        (POST_CREATED, 'Post created'),
+        (POST_EDITED, 'Post edited'),
+        (POST_DELETED, 'Post deleted'),
+        (REPLY_CREATED, 'Reply created'),
+        (REPLY_EDITED, 'Reply edited'),
+        (REPLY_DELETED, 'Reply deleted'),
+        (POST_VOTED, 'Post vote toggled'),
+        (REPLY_VOTED, 'Reply vote toggled'),
+        (POST_HIDDEN, 'Post hidden'),
+        (REPLY_HIDDEN, 'Reply hidden'),
+        (POST_PURGED, 'Post hard deleted'),
+        (REPLY_PURGED, 'Reply hard deleted'),
+        (USER_FOLLOWED, 'Author follow toggled'),
+        (POST_APPROVED, 'Held post approved'),
+        (REPLY_APPROVED, 'Held reply approved'),
+    ]
+
+    kind       = models.CharField(max_length=32, choices=KIND_CHOICES)
+    actor_id   = models.BigIntegerField(null=True, blank=True)
+    post_id    = models.BigIntegerField(null=True, blank=True)
+    reply_id   = models.BigIntegerField(null=True, blank=True)
+    payload    = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            #Feeds read new posts/replies of popular authors straight from the log
+            models.Index(fields=['actor_id', '-id'], name='event_actor_created_idx',
+                         condition=models.Q(kind__in=['post_created', 'reply_created'])),
+        ]
+
+    def __str__(self):
+        return f'{self.id} {self.kind}'
+
+#How far each projection has read into the event log
+class ProjectionState(models.Model):
+    name       = models.CharField(max_length=64, primary_key=True)
+    position   = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}@{self.position}'
+
+#Read models maintained by forum_main.projections, safe to drop and replay
+class PostStats(models.Model):
+    post              = models.OneToOneField(
+        ForumPost,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats'
+    )
+    reply_count       = models.IntegerField(default=0)
+    upvotes           = models.IntegerField(default=0)
+    latest_reply_time = models.DateTimeField(null=True, blank=True)
+
+class UserStats(models.Model):
+    user        = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats'
+    )
+    post_count  = models.IntegerField(default=0)
+    reply_count = models.IntegerField(default=0)
+    follower_count = models.IntegerField(default=0)
+
+#A user follows either an author or a post
+class Follow(models.Model):
+    follower   = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='following'
+    )
+    author     = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='followers'
+    )
+    post       = models.ForeignKey(
+        ForumPost,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='followers'
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['follower', 'author'], name='follow_author_uniq',
+                                    condition=models.Q(author__isnull=False)),
+            models.UniqueConstraint(fields=['follower', 'post'], name='follow_post_uniq',
+                                    condition=models.Q(post__isnull=False)),
+        ]
+
+#Per-user feed rows written by the timelines projection (fan-out on write),
+#newest first by event id and trimmed to FEED_MAX_LENGTH
+class TimelineEntry(models.Model):
+    user       = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    event_id   = models.BigIntegerField()
+    kind       = models.CharField(max_length=32)
+    post       = models.ForeignKey(ForumPost, on_delete=models.CASCADE, related_name='+')
+    reply      = models.ForeignKey(Reply, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            #Also the index a feed page is read from
+            models.UniqueConstraint(fields=['user', 'event_id'], name='timeline_user_event_uniq'),
+        ]
+
+#Background job row, the database doubles as the queue broker (see forum_main/queue.py)
+class Task(models.Model):
+    QUEUED  = 'queued'
+    RUNNING = 'running'
+    FAILED  = 'failed'
+
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    ]
+
+    name         = models.CharField(max_length=100)
+    args         = models.JSONField(default=list, blank=True)
+    kwargs       = models.JSONField(default=dict, blank=True)
+    #Optional dedupe key, only one queued task per key at a time
+    key          = models.CharField(max_length=150, blank=True, db_index=True)
+    priority     = models.SmallIntegerField(default=0)
+    status       = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts     = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after    = models.DateTimeField(default=timezone.now)
+    locked_by    = models.CharField(max_length=100, blank=True)
+    locked_at    = models.DateTimeField(null=True, blank=True)
+    last_error   = models.TextField(blank=True)
+    created_at   = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_after'], name='task_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
+
+#In-app notification, one unread row per (recipient, kind, post, parent) that
+#new replies are coalesced into ("5 new replies on your post")
+class Notification(models.Model):
+    REPLY_ON_POST  = 'reply_on_post'
+    REPLY_ON_REPLY = 'reply_on_reply'
+
+    KIND_CHOICES = [
+        (REPLY_ON_POST, 'Reply on your post'),
+        (REPLY_ON_REPLY, 'Reply to your reply'),
+    ]
+
+    recipient    = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='notifications'
+    )
+    kind         = models.CharField(max_length=32, choices=KIND_CHOICES)
+    post         = models.ForeignKey(ForumPost, on_delete=models.CASCADE, related_name='+')
+    #The reply that was answered, for REPLY_ON_REPLY
+    parent       = models.ForeignKey(Reply, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    latest_reply = models.ForeignKey(Reply, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    count        = models.PositiveIntegerField(default=1)
+    updated_at   = models.DateTimeField(default=timezone.now)
+    read_at      = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', '-updated_at'], name='notification_recipient_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['recipient', 'kind', 'post', 'parent'], name='notification_unread_uniq',
+                                    condition=models.Q(read_at__isnull=True)),
+        ]
+
+#One saved version of a post or reply. Every REVISION_SNAPSHOT_EVERY-th
+#revision keeps the full text, the ones in between only a delta against the
+#revision before (see forum_main/revisions.py)
+class Revision(models.Model):
+    post       = models.ForeignKey(ForumPost, on_delete=models.CASCADE, null=True, blank=True, related_name='revisions')
+    reply      = models.ForeignKey(Reply, on_delete=models.CASCADE, null=True, blank=True, related_name='revisions')
+    number     = models.PositiveIntegerField()
+    editor     = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    title      = models.CharField(max_length=100, blank=True)
+    snapshot   = models.TextField(null=True, blank=True)
+    #[[start, end, text], ...] replacing old[start:end] with text
+    delta      = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'number'], name='revision_post_number_uniq',
+                                    condition=models.Q(post__isnull=False)),
+            models.UniqueConstraint(fields=['reply', 'number'], name='revision_reply_number_uniq',
+                                    condition=models.Q(reply__isnull=False)),
+        ]
+
+#Autosaved work in progress: a new post (no post/reply) or an edit of one.
+#Updated with small patches checked against `version`
+class Draft(models.Model):
+    author     = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='drafts'
+    )
+    post       = models.ForeignKey(ForumPost, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    reply      = models.ForeignKey(Reply, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    title      = models.CharField(max_length=100, blank=True)
+    content    = models.TextField(blank=True)
+    version    = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+#Old id -> new id for rows brought in by `manage.py import_forum`, per import source.
+#Kept in the database so a resumed import still knows earlier batches
+class ImportMapping(models.Model):
+    source = models.CharField(max_length=64)
+    kind   = models.CharField(max_length=16)
+    old_id = models.BigIntegerField()
+    new_id = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'kind', 'old_id'], name='import_mapping_uniq'),
+        ]
+
+#Lines of an import source already committed
+class ImportCheckpoint(models.Model):
+    source     = models.CharField(max_length=64, primary_key=True)
+    position   = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+#Time bucketed counters kept by the rollups projection (forum_main/rollups.py).
+#`key` is 0 for forum wide metrics, the post id for thread activity and the
+#user id for active users. Minute buckets are folded into hours and hours into
+#days as they age, so every counted event lives in exactly one bucket
+class StatBucket(models.Model):
+    MINUTE = 'minute'
+    HOUR   = 'hour'
+    DAY    = 'day'
+
+    RESOLUTION_CHOICES = [
+        (MINUTE, 'Minute'),
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    ]
+
+    metric     = models.CharField(max_length=16)
+    resolution = models.CharField(max_length=6, choices=RESOLUTION_CHOICES)
+    start      = models.DateTimeField()
+    key        = models.BigIntegerField(default=0)
+    value      = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['metric', 'resolution', 'start', 'key'], name='stat_bucket_uniq'),
+        ]
+        indexes = [
+            # Compaction picks the oldest buckets of a resolution
+            models.Index(fields=['resolution', 'start'], name='stat_bucket_age_idx'),
+        ]
+
+#MinHash of new posts/replies for near-duplicate detection (forum_main/spam.py)
+class ContentSignature(models.Model):
+    post       = models.ForeignKey(ForumPost, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    reply      = models.ForeignKey(Reply, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    author     = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    minhash    = models.JSONField()
+    #Near duplicates found when it was written
+    duplicates = models.IntegerField(default=0)
+    #Created hidden, waiting for a moderator
+    held       = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            #Moderator queue
+            models.Index(fields=['created_at'], name='signature_held_idx', condition=models.Q(held=True)),
+            #Pruning past SPAM_WINDOW
+            models.Index(fields=['created_at'], name='signature_created_idx'),
+        ]
+
+#LSH bands of a signature, one row per band. Similar texts share a band key
+#with high probability, so candidates come from one indexed IN lookup
+class ContentBand(models.Model):
+    signature  = models.ForeignKey(ContentSignature, on_delete=models.CASCADE, related_name='bands')
+    key        = models.BigIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['key', 'created_at'], name='content_band_key_idx'),
+        ]
+
+#Precomputed related posts of a post (forum_main/related.py), [[post id, score], ...] best first
+class RelatedPosts(models.Model):
+    post       = models.OneToOneField(ForumPost, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    related    = models.JSONField(default=list)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+#Which posts hold `post` in their RelatedPosts list, so refresh() finds the lists a changed post is in
+class RelatedBacklink(models.Model):
+    post   = models.ForeignKey(ForumPost, on_delete=models.CASCADE, related_name='+')
+    holder = models.ForeignKey(ForumPost, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'holder'], name='related_backlink_uniq'),
+        ]
+
+#Vocabulary of the related posts index, df is how many indexed posts use the term
+class RelatedTerm(models.Model):
+    term = models.CharField(max_length=100, unique=True)
+    df   = models.IntegerField(default=0)
+
+#Inverted index of the related posts: a post's L2 normalised TF-IDF weight for
+#one term, with the idf of the time it was indexed
+class RelatedPosting(models.Model):
+    term   = models.ForeignKey(RelatedTerm, on_delete=models.CASCADE, related_name='postings')
+    post   = models.ForeignKey(ForumPost, on_delete=models.CASCADE, related_name='+')
+    weight = models.FloatField()
+
+    class Meta:
+        constraints = [
+            #Also the index a term's posting list is read from
+            models.UniqueConstraint(fields=['term', 'post'], name='related_posting_uniq'),
+        ]
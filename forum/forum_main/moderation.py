@@ -0,0 +1,262 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import models, router, transaction
+from django.utils import timezone
+from user import directory
+
+from . import events, readmodels
+from .models import ActivityEvent, ForumPost, Reply
+from .queue import enqueue
+
+User = get_user_model()
+
+#Set-based moderation helpers.
+#Work is split into chunks of `chunk_size` ids, each in its own short
+#transaction, so a large cleanup never holds locks for long. Deletes skip the
+#ORM collector (which loads every cascaded row into memory) and walk the reverse
+#relations themselves, issuing one DELETE ... WHERE fk IN (...) per table.
+#
+#Deleting is two-step: delete_posts/delete_replies only stamp deleted_at, which
+#is a single-row update per object however big the thread is. purge_deleted()
+#hard-deletes stamped rows later, in small batches and only while the forum is quiet.
+
+CHUNK_SIZE = 500
+
+def chunks(ids, size=CHUNK_SIZE):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+def hide_posts(ids, actor, chunk_size=CHUNK_SIZE):
+    done = 0
+    for chunk in chunks(ids, chunk_size):
+        with transaction.atomic():
+            rows = list(ForumPost.objects.filter(pk__in=chunk, is_hidden=False).values_list('pk', 'author_id'))
+            ForumPost.objects.filter(pk__in=[pk for pk, _ in rows]).update(is_hidden=True)
+            events.record_many(ActivityEvent.POST_HIDDEN, actor, [
+                (pk, None, {'users': [author_id]}) for pk, author_id in rows
+            ])
+            readmodels.schedule_refresh_many([pk for pk, _ in rows])
+        done += len(rows)
+    return done
+
+def hide_replies(ids, actor, chunk_size=CHUNK_SIZE):
+    done = 0
+    for chunk in chunks(ids, chunk_size):
+        with transaction.atomic():
+            rows = list(Reply.objects.filter(pk__in=chunk, is_hidden=False).values_list('pk', 'post_id', 'author_id'))
+            Reply.objects.filter(pk__in=[pk for pk, _, _ in rows]).update(is_hidden=True)
+            events.record_many(ActivityEvent.REPLY_HIDDEN, actor, [
+                (post_id, pk, {'users': [author_id]}) for pk, post_id, author_id in rows
+            ])
+            readmodels.schedule_refresh_many({post_id for _, post_id, _ in rows})
+        done += len(rows)
+    return done
+
+def delete_posts(ids, actor, chunk_size=CHUNK_SIZE):
+    done = 0
+    for chunk in chunks(ids, chunk_size):
+        with transaction.atomic():
+            rows = list(ForumPost.objects.filter(pk__in=chunk).values_list('pk', 'author_id'))
+            ForumPost.objects.filter(pk__in=[pk for pk, _ in rows]).update(deleted_at=timezone.now())
+            # Its replies stop counting for their authors too
+            users = defaultdict(set)
+            for post_id, author_id in Reply.all_objects.filter(post_id__in=[pk for pk, _ in rows]).values_list('post_id', 'author_id').distinct():
+                users[post_id].add(author_id)
+            events.record_many(ActivityEvent.POST_DELETED, actor, [
+                (pk, None, {'users': sorted({author_id} | users[pk])}) for pk, author_id in rows
+            ])
+            readmodels.schedule_refresh_many([pk for pk, _ in rows])
+            schedule_purge()
+        done += len(rows)
+    return done
+
+def delete_replies(ids, actor, chunk_size=CHUNK_SIZE):
+    # Only the listed replies are stamped, LiveReplyManager hides the replies
+    # below them and the purger takes the whole subtree
+    done = 0
+    for chunk in chunks(ids, chunk_size):
+        with transaction.atomic():
+            rows = list(Reply.objects.filter(pk__in=chunk).values_list('pk', 'post_id', 'path', 'author_id'))
+            Reply.objects.filter(pk__in=[pk for pk, _, _, _ in rows]).update(deleted_at=timezone.now())
+            below = subtree_authors(rows)
+            events.record_many(ActivityEvent.REPLY_DELETED, actor, [
+                (post_id, pk, {'users': sorted({author_id} | below[pk])}) for pk, post_id, _, author_id in rows
+            ])
+            readmodels.schedule_refresh_many({post_id for _, post_id, _, _ in rows})
+            schedule_purge()
+        done += len(rows)
+    return done
+
+def subtree_authors(rows):
+    # Authors of the replies below each (pk, post_id, path, author_id) row, their stats change with it
+    below = defaultdict(set)
+    if not rows:
+        return below
+    prefixes = {f'{path}{pk}/': pk for pk, _, path, _ in rows}
+    match = models.Q()
+    for pk, post_id, path, _ in rows:
+        match |= models.Q(post_id=post_id, path__startswith=f'{path}{pk}/')
+    for path, author_id in Reply.all_objects.filter(match).values_list('path', 'author_id').distinct():
+        for prefix, pk in prefixes.items():
+            if path.startswith(prefix):
+                below[pk].add(author_id)
+    return below
+
+def hard_delete_posts(ids, chunk_size=CHUNK_SIZE):
+    done = 0
+    for chunk in chunks(ids, chunk_size):
+        with transaction.atomic():
+            users = defaultdict(set)
+            for pk, author_id in ForumPost.all_objects.filter(pk__in=chunk).values_list('pk', 'author_id'):
+                users[pk].add(author_id)
+            for post_id, author_id in Reply.all_objects.filter(post_id__in=chunk).values_list('post_id', 'author_id').distinct():
+                users[post_id].add(author_id)
+
+            purge(ForumPost, list(users), chunk_size)
+            events.record_many(ActivityEvent.POST_PURGED, None, [
+                (pk, None, {'users': sorted(authors)}) for pk, authors in users.items()
+            ])
+        done += len(users)
+    return done
+
+def hard_delete_replies(ids, chunk_size=CHUNK_SIZE):
+    done = 0
+    for chunk in chunks(ids, chunk_size):
+        with transaction.atomic():
+            subtree = events.reply_subtree_ids(chunk)
+            rows = list(Reply.all_objects.filter(pk__in=subtree).values_list('pk', 'post_id', 'author_id'))
+            purge(Reply, [pk for pk, _, _ in rows], chunk_size)
+            events.record_many(ActivityEvent.REPLY_PURGED, None, [
+                (post_id, pk, {'users': [author_id]}) for pk, post_id, author_id in rows
+            ])
+            readmodels.schedule_refresh_many({post_id for _, post_id, _ in rows})
+        done += len(rows)
+    return done
+
+# The purger's own writes, they must not make the forum look busy
+PURGE_KINDS = (ActivityEvent.POST_PURGED, ActivityEvent.REPLY_PURGED)
+
+def schedule_purge(delay=None):
+    delay = settings.PURGE_GRACE_SECONDS if delay is None else delay
+    enqueue('moderation.purge_deleted', key='moderation.purge_deleted', delay=delay)
+
+def is_quiet():
+    # Quiet means few writes in the last minute, judged from the activity log
+    since = timezone.now() - timedelta(minutes=1)
+    recent = ActivityEvent.objects.filter(created_at__gte=since).exclude(kind__in=PURGE_KINDS).count()
+    return recent < settings.PURGE_QUIET_EVENTS_PER_MINUTE
+
+def purge_deleted(batch_size=None, max_batches=None, force=False):
+    """
+    Hard-delete soft deleted posts and replies older than PURGE_GRACE_SECONDS,
+    `batch_size` rows per transaction. Stops early when the forum gets busy
+    unless `force`. Returns (posts, replies, finished).
+    """
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(seconds=settings.PURGE_GRACE_SECONDS)
+    posts = replies = batches = 0
+    while max_batches is None or batches < max_batches:
+        if not force and not is_quiet():
+            return posts, replies, False
+        post_ids = list(
+            ForumPost.all_objects.filter(deleted_at__lte=cutoff)
+            .order_by('deleted_at').values_list('pk', flat=True)[:batch_size]
+        )
+        reply_ids = []
+        if not post_ids:
+            reply_ids = list(
+                Reply.all_objects.filter(deleted_at__lte=cutoff)
+                .order_by('deleted_at').values_list('pk', flat=True)[:batch_size]
+            )
+        if not post_ids and not reply_ids:
+            return posts, replies, True
+        posts += hard_delete_posts(post_ids, batch_size)
+        replies += hard_delete_replies(reply_ids, batch_size)
+        batches += 1
+    return posts, replies, False
+
+def user_content(user_id):
+    post_ids = list(ForumPost.objects.filter(author_id=user_id).values_list('pk', flat=True))
+    reply_ids = list(Reply.objects.filter(author_id=user_id).values_list('pk', flat=True))
+    return post_ids, reply_ids
+
+def ban_user(user_id):
+    names = User.objects.filter(pk=user_id).values_list('username', 'nickname').first() or ()
+    banned = User.objects.filter(pk=user_id).update(is_active=False)
+    # update() sends no signals, drop the banned user from cached autocomplete answers
+    directory.invalidate_names(*names)
+    return banned
+
+def run_bulk(action, actor, posts=(), replies=(), user=None, ban=False, chunk_size=CHUNK_SIZE):
+    posts, replies = list(posts), list(replies)
+    if user is not None:
+        if ban:
+            ban_user(user)
+        user_posts, user_replies = user_content(user)
+        posts += user_posts
+        replies += user_replies
+    if action == 'delete':
+        return {
+            'posts': delete_posts(posts, actor, chunk_size),
+            'replies': delete_replies(replies, actor, chunk_size),
+        }
+    return {
+        'posts': hide_posts(posts, actor, chunk_size),
+        'replies': hide_replies(replies, actor, chunk_size),
+    }
+
+
+def purge(model, ids, chunk_size=CHUNK_SIZE):
+    """
+    Hard-delete rows by id without loading them, cascading through reverse
+    relations table by table. Self references (reply trees) are expanded so
+    the whole subtree goes in the same statement.
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    db = router.db_for_write(model)
+    for rel in _reverse_relations(model):
+        if rel.related_model is model:
+            ids = _closure(model, rel.field.name, ids)
+    for rel in _reverse_relations(model):
+        if rel.related_model is model:
+            continue
+        for chunk in chunks(ids, chunk_size):
+            dependents = rel.related_model._base_manager.using(db).filter(**{f'{rel.field.name}__in': chunk})
+            if rel.on_delete is models.CASCADE:
+                if _reverse_relations(rel.related_model):
+                    purge(rel.related_model, dependents.values_list('pk', flat=True), chunk_size)
+                else:
+                    dependents._raw_delete(db)
+            elif rel.on_delete is models.SET_NULL:
+                dependents.update(**{rel.field.name: None})
+            elif rel.on_delete is not models.DO_NOTHING:
+                raise ValueError(f"Can't purge {model.__name__}, {rel.related_model.__name__}.{rel.field.name} is not cascading")
+    for chunk in chunks(ids, chunk_size):
+        model._base_manager.using(db).filter(pk__in=chunk)._raw_delete(db)
+    return len(ids)
+
+def _reverse_relations(model):
+    return [
+        f for f in model._meta.get_fields(include_hidden=True)
+        if f.auto_created and not f.concrete and (f.one_to_many or f.one_to_one)
+    ]
+
+def _closure(model, field, ids):
+    seen = set(ids)
+    frontier = list(ids)
+    while frontier:
+        found = []
+        for chunk in chunks(frontier):
+            found += [
+                pk for pk in model._base_manager.filter(**{f'{field}__in': chunk}).values_list('pk', flat=True)
+                if pk not in seen
+            ]
+        seen.update(found)
+        frontier = found
+    return list(seen)
@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ActivityEvent, Notification, Reply
+
+#Reply notifications.
+#The notifications projection turns reply_created events into Notification
+#rows, coalescing a whole batch per (recipient, kind, post, parent) into one
+#unread row with a count. Unread counts are kept as cached counters bumped on
+#commit, a COUNT only runs when the cache misses; the TTL bounds any drift.
+
+def _key(user_id):
+    return f'forum:notifications:unread:{user_id}'
+
+def _ttl():
+    return getattr(settings, 'NOTIFICATION_COUNT_TTL', 300)
+
+def unread_count(user_id):
+    count = cache.get(_key(user_id))
+    if count is None:
+        count = Notification.objects.filter(recipient_id=user_id, read_at__isnull=True).count()
+        cache.set(_key(user_id), count, _ttl())
+    return count
+
+def _bump(user_id, delta):
+    try:
+        cache.incr(_key(user_id), delta)
+    except ValueError:
+        # Not cached, the next read counts
+        pass
+
+def forget_counts(user_ids):
+    """Drop cached unread counts once the transaction commits, the next reads count the rows."""
+    keys = [_key(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+def deliver(events):
+    reply_ids = [e.reply_id for e in events if e.kind == ActivityEvent.REPLY_CREATED]
+    if not reply_ids:
+        return 0
+    replies = (
+        Reply.objects.filter(pk__in=reply_ids, is_hidden=False)
+        .values('pk', 'post_id', 'author_id', 'parent_id', 'parent__author_id', 'post__author_id', 'created_at')
+        .order_by('pk')
+    )
+
+    groups = {}
+    for r in replies:
+        # Only the author being replied to hears about it
+        if r['parent_id']:
+            key = (r['parent__author_id'], Notification.REPLY_ON_REPLY, r['post_id'], r['parent_id'])
+        else:
+            key = (r['post__author_id'], Notification.REPLY_ON_POST, r['post_id'], None)
+        if key[0] is None or key[0] == r['author_id']:
+            continue
+        count, _, _ = groups.get(key, (0, None, None))
+        groups[key] = (count + 1, r['pk'], r['created_at'])
+
+    created = {}
+    for (recipient_id, kind, post_id, parent_id), (count, latest, at) in groups.items():
+        updated = Notification.objects.filter(
+            recipient_id=recipient_id, kind=kind, post_id=post_id, parent_id=parent_id, read_at__isnull=True
+        ).update(count=F('count') + count, latest_reply_id=latest, updated_at=at)
+        if not updated:
+            Notification.objects.create(
+                recipient_id=recipient_id, kind=kind, post_id=post_id, parent_id=parent_id,
+                latest_reply_id=latest, count=count, updated_at=at,
+            )
+            created[recipient_id] = created.get(recipient_id, 0) + 1
+
+    def bump():
+        for user_id, n in created.items():
+            _bump(user_id, n)
+    transaction.on_commit(bump)
+    return len(groups)
+
+def mark_read(user_id, ids=None):
+    """Mark the given (or all) unread notifications of a user as read, returns how many."""
+    unread = Notification.objects.filter(recipient_id=user_id, read_at__isnull=True)
+    if ids is not None:
+        unread = unread.filter(pk__in=ids)
+    marked = unread.update(read_at=timezone.now())
+    if ids is None:
+        transaction.on_commit(lambda: cache.set(_key(user_id), 0, _ttl()))
+    elif marked:
+        transaction.on_commit(lambda: _bump(user_id, -marked))
+    return marked
@@ -1,15 +1,33 @@
 from rest_framework import permissions
 
 class IsAuthorOrMod(permissions.BasePermission):
+    # Methods anyone may use, the rest need the author or a moderator
+    open_methods = permissions.SAFE_METHODS
 
     def has_object_permission(self, request, view, obj):
-        if request.method in permissions.SAFE_METHODS:
+        if request.method in self.open_methods:
             return True
-        return (
+        return bool(
             request.user and
+            request.user.is_authenticated and
             (request.user.is_moderator or obj.author.id == request.user.id)
         )
 
+class IsAuthorOrModToRead(IsAuthorOrMod):
+    # Reads included, for things that aren't public such as edit history
+    open_methods = ()
+
+class IsModerator(permissions.BasePermission):
+
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(
+            user and
+            user.is_authenticated and
+            user.is_active and
+            user.is_moderator
+        )
+
 class IsAuthenticatedAndActive(permissions.BasePermission):
     
     def has_permission(self, request, view):
@@ -0,0 +1,225 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from . import rollups
+from .models import (
+    ActivityEvent, Follow, ForumPost, Notification, PostStats, ProjectionState, Reply, StatBucket, TimelineEntry, UserStats,
+)
+from .queue import enqueue
+
+User = get_user_model()
+
+#Projections consume the activity log in id order and keep read models up to date.
+#Each one remembers its own position in ProjectionState, so they can be run,
+#rebuilt or added independently. Handlers recompute the rows an event touches
+#from the source tables, which keeps them idempotent and safe to replay.
+
+class Projection:
+    name = None
+
+    def reset(self):
+        raise NotImplementedError
+
+    def apply(self, events):
+        raise NotImplementedError
+
+
+class PostStatsProjection(Projection):
+    name = 'post_stats'
+
+    def reset(self):
+        PostStats.objects.all().delete()
+
+    def apply(self, events):
+        post_ids = {e.post_id for e in events if e.post_id is not None}
+        if post_ids:
+            refresh_post_stats(post_ids)
+
+
+class UserStatsProjection(Projection):
+    name = 'user_stats'
+
+    def reset(self):
+        UserStats.objects.all().delete()
+
+    def apply(self, events):
+        user_ids = set()
+        for e in events:
+            if e.actor_id is not None:
+                user_ids.add(e.actor_id)
+            user_ids.update(e.payload.get('users', []))
+        if user_ids:
+            refresh_user_stats(user_ids)
+
+
+class TimelineProjection(Projection):
+    name = 'timelines'
+
+    def reset(self):
+        TimelineEntry.objects.all().delete()
+
+    def apply(self, events):
+        # Imported here, feeds records events and events schedules projections
+        from .feeds import fan_out
+        fan_out(events)
+
+
+class NotificationProjection(Projection):
+    name = 'notifications'
+
+    def reset(self):
+        from .notifications import forget_counts
+        # Replaying brings every notification back as unread, the cached counters would count them twice
+        recipients = list(Notification.objects.values_list('recipient_id', flat=True).distinct())
+        Notification.objects.all().delete()
+        forget_counts(recipients)
+
+    def apply(self, events):
+        from .notifications import deliver
+        deliver(events)
+
+
+class RollupProjection(Projection):
+    name = rollups.LOCK
+
+    def reset(self):
+        StatBucket.objects.all().delete()
+
+    def apply(self, events):
+        rollups.add(StatBucket.MINUTE, rollups.count_events(events))
+
+
+def refresh_post_stats(post_ids):
+    post_ids = set(post_ids)
+    existing = set(ForumPost.objects.filter(pk__in=post_ids).values_list('pk', flat=True))
+    PostStats.objects.filter(post_id__in=post_ids - existing).delete()
+
+    # Hidden replies don't count, hidden posts keep their row but never get listed
+    replies = {
+        row['post_id']: row
+        for row in Reply.objects.filter(post_id__in=existing, is_hidden=False)
+        .values('post_id')
+        .annotate(n=Count('id'), latest=Max('created_at'))
+    }
+    votes = dict(
+        ForumPost.upvoted_by.through.objects.filter(forumpost_id__in=existing)
+        .values('forumpost_id')
+        .annotate(n=Count('id'))
+        .values_list('forumpost_id', 'n')
+    )
+    for post_id in existing:
+        row = replies.get(post_id, {})
+        PostStats.objects.update_or_create(
+            post_id=post_id,
+            defaults={
+                'reply_count': row.get('n', 0),
+                'latest_reply_time': row.get('latest'),
+                'upvotes': votes.get(post_id, 0),
+            },
+        )
+
+def refresh_user_stats(user_ids):
+    user_ids = set(user_ids)
+    existing = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+    UserStats.objects.filter(user_id__in=user_ids - existing).delete()
+
+    posts = dict(
+        ForumPost.objects.filter(author_id__in=existing, is_hidden=False)
+        .values('author_id').annotate(n=Count('id')).values_list('author_id', 'n')
+    )
+    replies = dict(
+        Reply.objects.filter(author_id__in=existing, is_hidden=False)
+        .values('author_id').annotate(n=Count('id')).values_list('author_id', 'n')
+    )
+    followers = dict(
+        Follow.objects.filter(author_id__in=existing)
+        .values('author_id').annotate(n=Count('id')).values_list('author_id', 'n')
+    )
+    for user_id in existing:
+        UserStats.objects.update_or_create(
+            user_id=user_id,
+            defaults={
+                'post_count': posts.get(user_id, 0),
+                'reply_count': replies.get(user_id, 0),
+                'follower_count': followers.get(user_id, 0),
+            },
+        )
+
+
+PROJECTIONS = [
+    PostStatsProjection(),
+    UserStatsProjection(),
+    TimelineProjection(),
+    NotificationProjection(),
+    RollupProjection(),
+]
+
+def register(projection):
+    PROJECTIONS.append(projection)
+    return projection
+
+def get_projections(names=None):
+    if not names:
+        return list(PROJECTIONS)
+    by_name = {p.name: p for p in PROJECTIONS}
+    unknown = set(names) - set(by_name)
+    if unknown:
+        raise KeyError(f"Unknown projection(s): {', '.join(sorted(unknown))}")
+    return [by_name[n] for n in names]
+
+def schedule_projections():
+    # Coalesced, a burst of writes leaves a single queued update
+    enqueue(
+        'projections.update',
+        key='projections.update',
+        delay=getattr(settings, 'FORUM_PROJECTION_SETTLE_SECONDS', 1),
+    )
+
+def run_projection(projection, batch_size=500, settle=None):
+    """
+    Feed every unread event to one projection, batch by batch.
+    Events younger than `settle` seconds are left for the next run, which gives
+    slower transactions that grabbed a lower id time to commit before we move past it.
+    """
+    if settle is None:
+        settle = getattr(settings, 'FORUM_PROJECTION_SETTLE_SECONDS', 1)
+    horizon = timezone.now() - timedelta(seconds=settle)
+    processed = 0
+
+    while True:
+        with transaction.atomic():
+            state, _ = ProjectionState.objects.select_for_update().get_or_create(name=projection.name)
+            events = list(
+                ActivityEvent.objects
+                .filter(pk__gt=state.position, created_at__lte=horizon)
+                .order_by('pk')[:batch_size]
+            )
+            if not events:
+                return processed
+            projection.apply(events)
+            state.position = events[-1].pk
+            state.save(update_fields=['position', 'updated_at'])
+        processed += len(events)
+
+def run_projections(names=None, batch_size=500, settle=None):
+    return {
+        p.name: run_projection(p, batch_size=batch_size, settle=settle)
+        for p in get_projections(names)
+    }
+
+def replay_projections(names=None, batch_size=500):
+    """Throw away the read models and rebuild them from offset zero."""
+    projections = get_projections(names)
+    for p in projections:
+        with transaction.atomic():
+            p.reset()
+            ProjectionState.objects.update_or_create(name=p.name, defaults={'position': 0})
+    return {
+        p.name: run_projection(p, batch_size=batch_size, settle=0)
+        for p in projections
+    }
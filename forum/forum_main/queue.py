@@ -0,0 +1,153 @@
+import logging
+import os
+import socket
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from forum.routers import pin_to_primary, unpin
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+#A small database-backed task queue.
+#Tasks are registered by name with @task, enqueued as Task rows (inside the
+#caller's transaction, so they only exist if the write committed) and executed
+#by `manage.py run_worker`. Higher priority runs first, failures are retried
+#with exponential backoff until max_attempts, successful rows are deleted.
+#With TASK_QUEUE_EAGER on, tasks run in-process right after commit instead.
+
+_registry = {}
+
+def task(name, priority=0, max_attempts=3, retry_delay=5):
+    def decorator(func):
+        _registry[name] = {
+            'func': func,
+            'priority': priority,
+            'max_attempts': max_attempts,
+            'retry_delay': retry_delay,
+        }
+        func.task_name = name
+        func.delay = lambda *args, **kwargs: enqueue(name, args=args, kwargs=kwargs)
+        return func
+    return decorator
+
+def is_eager():
+    return getattr(settings, 'TASK_QUEUE_EAGER', False)
+
+def enqueue(name, args=(), kwargs=None, priority=None, delay=0, key=''):
+    """
+    Queue a registered task. With a `key`, nothing is queued while an
+    identical keyed task is still waiting, which coalesces bursts of writes.
+    """
+    spec = _registry[name]
+    kwargs = kwargs or {}
+    if is_eager():
+        transaction.on_commit(lambda: _run_eager(name, spec['func'], args, kwargs))
+        return None
+    if key and Task.objects.filter(key=key, status=Task.QUEUED).exists():
+        return None
+    return Task.objects.create(
+        name=name,
+        args=list(args),
+        kwargs=kwargs,
+        key=key,
+        priority=spec['priority'] if priority is None else priority,
+        max_attempts=spec['max_attempts'],
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+
+def _run_eager(name, func, args, kwargs):
+    # The write already committed, a failing side-effect must not fail the request
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception("Eager task %s failed", name)
+
+
+class Worker:
+    def __init__(self, concurrency=None, worker_id=None):
+        self.concurrency = concurrency or getattr(settings, 'TASK_QUEUE_CONCURRENCY', 4)
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.visibility_timeout = getattr(settings, 'TASK_QUEUE_VISIBILITY_TIMEOUT', 300)
+        self.pool = None
+        if self.concurrency > 1:
+            self.pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='task')
+
+    def claim(self, limit):
+        now = timezone.now()
+        candidates = Task.objects.filter(status=Task.QUEUED, run_after__lte=now).order_by('-priority', 'run_after', 'id')
+        claimed = []
+        with transaction.atomic():
+            if connection.features.has_select_for_update_skip_locked:
+                candidates = candidates.select_for_update(skip_locked=True)
+            ids = list(candidates.values_list('id', flat=True)[:limit * 2])
+            for task_id in ids:
+                # Conditional update, so two workers can never both win the same row
+                won = Task.objects.filter(id=task_id, status=Task.QUEUED).update(
+                    status=Task.RUNNING,
+                    locked_by=self.worker_id,
+                    locked_at=now,
+                    attempts=F('attempts') + 1,
+                )
+                if won:
+                    claimed.append(task_id)
+                if len(claimed) >= limit:
+                    break
+        return list(Task.objects.filter(id__in=claimed).order_by('-priority', 'run_after', 'id'))
+
+    def execute(self, task_row):
+        spec = _registry.get(task_row.name)
+        # Tasks act on what was just written, never read it from a lagging replica
+        pin = pin_to_primary()
+        try:
+            if spec is None:
+                raise LookupError(f'Unknown task {task_row.name!r}')
+            spec['func'](*task_row.args, **task_row.kwargs)
+        except Exception:
+            error = traceback.format_exc()
+            logger.warning("Task %s #%s failed (attempt %s)", task_row.name, task_row.id, task_row.attempts)
+            if spec is not None and task_row.attempts < task_row.max_attempts:
+                backoff = spec['retry_delay'] * 2 ** (task_row.attempts - 1)
+                Task.objects.filter(id=task_row.id).update(
+                    status=Task.QUEUED, locked_by='', locked_at=None, last_error=error,
+                    run_after=timezone.now() + timedelta(seconds=backoff),
+                )
+            else:
+                Task.objects.filter(id=task_row.id).update(status=Task.FAILED, last_error=error)
+            return False
+        else:
+            Task.objects.filter(id=task_row.id).delete()
+            return True
+        finally:
+            unpin(pin)
+            if self.pool is not None:
+                close_old_connections()
+
+    def requeue_stale(self):
+        # A worker that died mid-task leaves rows in running, give them back
+        cutoff = timezone.now() - timedelta(seconds=self.visibility_timeout)
+        return Task.objects.filter(status=Task.RUNNING, locked_at__lt=cutoff).update(
+            status=Task.QUEUED, locked_by='', locked_at=None
+        )
+
+    def run_once(self):
+        tasks = self.claim(self.concurrency)
+        if self.pool is None:
+            return [self.execute(t) for t in tasks]
+        return list(self.pool.map(self.execute, tasks))
+
+    def run_forever(self, poll_interval=1.0):
+        last_sweep = 0
+        while True:
+            if time.monotonic() - last_sweep > self.visibility_timeout / 2:
+                self.requeue_stale()
+                last_sweep = time.monotonic()
+            if not self.run_once():
+                time.sleep(poll_interval)
@@ -0,0 +1,115 @@
+import json
+import logging
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from forum.mongo import BulkWriter, get_db
+from .models import ForumPost, Reply
+from .queue import enqueue
+from .serializers import PostSerializer, ReplySerializer
+
+logger = logging.getLogger(__name__)
+
+#Denormalized post documents kept in MongoDB.
+#One document per post holds the serialized post, its replies (in display order,
+#tree kept through the `parent` ids) and the counters, so the post page and the
+#reply list are each served from a single key lookup.
+#Documents are rebuilt from SQL by a background task after each write,
+#SQL stays the source of truth.
+
+COLLECTION = 'post_documents'
+
+class Unavailable(Exception):
+    """Mongo could not serve the read, callers fall back to SQL."""
+
+def enabled():
+    return getattr(settings, 'MONGODB_READ_MODELS', False)
+
+def collection():
+    return get_db()[COLLECTION]
+
+def build_post_document(post):
+    replies = (
+        Reply.objects.filter(post=post, is_hidden=False)
+        .select_related('author', 'parent__author')
+        .order_by('created_at')
+    )
+    reply_data = ReplySerializer(replies, many=True).data
+    return _plain({
+        '_id': post.pk,
+        'post': PostSerializer(post).data,
+        'replies': reply_data,
+        'reply_count': len(reply_data),
+        'upvotes_count': post.upvotes_count,
+        'updated_at': timezone.now(),
+    })
+
+def refresh_post_document(post_id):
+    post = ForumPost.objects.select_related('author').filter(pk=post_id, is_hidden=False).first()
+    if post is None:
+        collection().delete_one({'_id': post_id})
+        return None
+    doc = build_post_document(post)
+    collection().replace_one({'_id': post_id}, doc, upsert=True)
+    return doc
+
+def rebuild_all(batch_size=None):
+    """Rebuild every post document, sent to Mongo in bulk batches."""
+    from pymongo import ReplaceOne
+
+    # Reads that land mid-rebuild just miss and build their document lazily
+    collection().delete_many({})
+    posts = ForumPost.objects.filter(is_hidden=False).select_related('author').order_by('pk')
+    with BulkWriter(collection(), batch_size=batch_size) as writer:
+        for post in posts.iterator(chunk_size=500):
+            writer.add(ReplaceOne({'_id': post.pk}, build_post_document(post), upsert=True))
+    return writer.sent
+
+def get_post_document(post_id):
+    """
+    Return the cached document, building it on a miss. None if the post is gone.
+    Raises Unavailable when Mongo is down or times out.
+    """
+    from pymongo.errors import PyMongoError
+
+    try:
+        doc = collection().find_one({'_id': post_id})
+        if doc is None:
+            doc = refresh_post_document(post_id)
+    except PyMongoError as e:
+        logger.warning("Post document %s unavailable: %s", post_id, e)
+        raise Unavailable from e
+    return doc
+
+def invalidate_user_documents(user_id):
+    # Author snippets are copied into documents; drop the ones that mention
+    # this user and let them rebuild lazily on the next read
+    collection().delete_many({'$or': [
+        {'post.author.id': user_id},
+        {'replies.author.id': user_id},
+    ]})
+
+def schedule_refresh(post_id):
+    if enabled():
+        enqueue('readmodels.refresh_post_document', args=[post_id], key=f'post_document:{post_id}')
+
+def schedule_refresh_many(post_ids):
+    post_ids = sorted(post_ids)
+    if enabled() and post_ids:
+        enqueue('readmodels.refresh_post_documents', args=[post_ids])
+
+def schedule_user_invalidation(user_id):
+    if enabled():
+        enqueue('readmodels.invalidate_user_documents', args=[user_id], key=f'user_documents:{user_id}')
+
+def absolutize(data, request):
+    # Documents store relative media urls, DRF would normally build absolute ones
+    author = data.get('author')
+    if author and author.get('avatar') and request is not None:
+        data = dict(data, author=dict(author, avatar=request.build_absolute_uri(author['avatar'])))
+    return data
+
+def _plain(data):
+    return json.loads(json.dumps(data, cls=DjangoJSONEncoder))
@@ -0,0 +1,323 @@
+import math
+import re
+from array import array
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import ActivityEvent, ForumPost, ProjectionState, RelatedBacklink, RelatedPosting, RelatedPosts, RelatedTerm
+
+#Related posts, precomputed offline.
+#build() turns every visible post into a TF-IDF vector (title words counted
+#twice, sublinear tf, smoothed idf, L2 normalised rows of a scipy sparse matrix)
+#and keeps each post's RELATED_POSTS_K best cosine neighbours, computed from
+#chunked sparse matrix products. Lists are stored one RelatedPosts row per post,
+#so the post page reads them with a primary key lookup. build() also stores the
+#vectors as an inverted index (RelatedTerm with its df, RelatedPosting weights)
+#and which lists hold each post (RelatedBacklink).
+#refresh() is the incremental path and costs what the changed posts touch:
+#posts created, edited, approved, hidden or deleted since the last run (read
+#from the activity log) are re-indexed with the current idf, scored against the
+#posts sharing a term with them by a join over the inverted index, and merged
+#into the lists of the posts they now resemble. Lists that held one of them are
+#recomputed whole from the index, an edit may have taken it out of their top K
+#altogether. Stored weights keep the idf they were indexed with, a periodic full
+#build() resets that drift.
+#NumPy and SciPy are imported only inside build(), web workers never load them.
+
+STATE = 'related_posts'
+DIRTY_KINDS = (
+    ActivityEvent.POST_CREATED, ActivityEvent.POST_EDITED, ActivityEvent.POST_APPROVED,
+    ActivityEvent.POST_HIDDEN, ActivityEvent.POST_DELETED,
+)
+WORD = re.compile(r'\w\w+')
+# Longer "words" are noise (urls, base64) and don't fit RelatedTerm
+MAX_TERM_LENGTH = 100
+
+def _libs():
+    try:
+        import numpy
+        from scipy import sparse
+    except ImportError as e:
+        raise RuntimeError("Related posts need numpy and scipy") from e
+    return numpy, sparse
+
+def available():
+    try:
+        _libs()
+    except RuntimeError:
+        return False
+    return True
+
+def _k():
+    return getattr(settings, 'RELATED_POSTS_K', 10)
+
+def _min_score():
+    return getattr(settings, 'RELATED_POSTS_MIN_SCORE', 0.05)
+
+def lookup(post_id):
+    """Visible related posts of `post_id` as [{'id', 'title', 'score'}], best first."""
+    related = RelatedPosts.objects.filter(post_id=post_id).values_list('related', flat=True).first()
+    if not related:
+        return []
+    titles = dict(
+        ForumPost.objects.filter(pk__in=[pk for pk, _ in related], is_hidden=False).values_list('pk', 'title')
+    )
+    return [{'id': pk, 'title': titles[pk], 'score': round(score, 4)} for pk, score in related if pk in titles]
+
+def terms(title, content):
+    """Counter of the terms of a post, title words counted twice."""
+    return Counter(w for w in WORD.findall(f"{title}\n{title}\n{content}".lower()) if len(w) <= MAX_TERM_LENGTH)
+
+def weigh(counts, idf):
+    """{term: L2 normalised sublinear tf-idf weight}, `idf` maps each term to its idf."""
+    weights = {term: (1 + math.log(n)) * idf[term] for term, n in counts.items()}
+    norm = math.sqrt(sum(w * w for w in weights.values())) or 1
+    return {term: w / norm for term, w in weights.items()}
+
+def smoothed_idf(df, n_docs):
+    return math.log((1 + n_docs) / (1 + df)) + 1
+
+def matrix(chunk_size=2000):
+    """(post ids, vocabulary, L2 normalised TF-IDF csr_matrix with one row per visible post)."""
+    np, sparse = _libs()
+    ids, vocabulary = [], {}
+    indptr, indices, counts = array('q', [0]), array('q'), array('d')
+    posts = ForumPost.objects.filter(is_hidden=False).order_by('pk').values_list('pk', 'title', 'content')
+    for pk, title, content in posts.iterator(chunk_size=chunk_size):
+        for term, n in terms(title, content).items():
+            indices.append(vocabulary.setdefault(term, len(vocabulary)))
+            counts.append(n)
+        indptr.append(len(indices))
+        ids.append(pk)
+
+    X = sparse.csr_matrix(
+        (np.frombuffer(counts, dtype=np.float64), np.frombuffer(indices, dtype=np.int64), np.frombuffer(indptr, dtype=np.int64)),
+        shape=(len(ids), len(vocabulary)),
+    )
+    df = np.bincount(X.indices, minlength=X.shape[1])
+    idf = np.log((1 + len(ids)) / (1 + df)) + 1
+    X.data = (1 + np.log(X.data)) * idf[X.indices]
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return ids, list(vocabulary), (sparse.diags(1 / norms) @ X).tocsr()
+
+def similarities(X, rows, chunk_size=256):
+    """(row, neighbour rows, scores) per row, self and scores under RELATED_POSTS_MIN_SCORE left out."""
+    XT = X.T.tocsc()
+    floor = _min_score()
+    for start in range(0, len(rows), chunk_size):
+        block = rows[start:start + chunk_size]
+        S = (X[block] @ XT).tocsr()
+        for i, row in enumerate(block):
+            cols = S.indices[S.indptr[i]:S.indptr[i + 1]]
+            scores = S.data[S.indptr[i]:S.indptr[i + 1]]
+            keep = (cols != row) & (scores >= floor)
+            yield row, cols[keep], scores[keep]
+
+def top(cols, scores, k):
+    np, _ = _libs()
+    if len(scores) > k:
+        best = np.argpartition(-scores, k)[:k]
+        cols, scores = cols[best], scores[best]
+    order = np.lexsort((cols, -scores))
+    return cols[order], scores[order]
+
+def _save(lists):
+    """Write {post id: [[id, score], ...]} and their backlinks in one go."""
+    now = timezone.now()
+    with transaction.atomic():
+        existing = set(RelatedPosts.objects.filter(post_id__in=list(lists)).values_list('post_id', flat=True))
+        rows = [RelatedPosts(post_id=pk, related=related, updated_at=now) for pk, related in lists.items()]
+        RelatedPosts.objects.bulk_update([r for r in rows if r.post_id in existing], ['related', 'updated_at'], batch_size=500)
+        RelatedPosts.objects.bulk_create([r for r in rows if r.post_id not in existing], batch_size=500)
+        RelatedBacklink.objects.filter(holder_id__in=list(lists)).delete()
+        RelatedBacklink.objects.bulk_create(
+            [RelatedBacklink(post_id=pk, holder_id=holder) for holder, related in lists.items() for pk, _ in related],
+            batch_size=500,
+        )
+
+def _drop(post_ids):
+    """Forget the lists of posts that are no longer indexed."""
+    RelatedPosts.objects.filter(post_id__in=post_ids).delete()
+    RelatedBacklink.objects.filter(holder_id__in=post_ids).delete()
+
+def _write_index(ids, vocabulary, X, batch_size=2000):
+    """Replace the inverted index with the rows of X."""
+    np, _ = _libs()
+    df = np.bincount(X.indices, minlength=X.shape[1])
+    with transaction.atomic():
+        RelatedPosting.objects.all().delete()
+        RelatedTerm.objects.all().delete()
+        RelatedTerm.objects.bulk_create(
+            [RelatedTerm(term=term, df=int(n)) for term, n in zip(vocabulary, df)], batch_size=batch_size,
+        )
+        term_ids = dict(RelatedTerm.objects.values_list('term', 'pk'))
+        column_ids = [term_ids[term] for term in vocabulary]
+        postings = []
+        for row, pk in enumerate(ids):
+            for at in range(X.indptr[row], X.indptr[row + 1]):
+                postings.append(RelatedPosting(term_id=column_ids[X.indices[at]], post_id=pk, weight=float(X.data[at])))
+            if len(postings) >= batch_size:
+                RelatedPosting.objects.bulk_create(postings, batch_size=batch_size)
+                postings = []
+        RelatedPosting.objects.bulk_create(postings, batch_size=batch_size)
+
+def _last_event():
+    return ActivityEvent.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+def _set_position(position):
+    ProjectionState.objects.update_or_create(name=STATE, defaults={'position': position})
+
+def build(chunk_size=256):
+    """Recompute every visible post's list and the index. Returns how many posts were indexed."""
+    # Read first, events that land while we work are picked up by the next refresh()
+    position = _last_event()
+    ids, vocabulary, X = matrix()
+    _write_index(ids, vocabulary, X)
+    k = _k()
+    lists = {}
+    for row, cols, scores in similarities(X, list(range(len(ids))), chunk_size):
+        cols, scores = top(cols, scores, k)
+        lists[ids[row]] = [[ids[c], float(s)] for c, s in zip(cols, scores)]
+        if len(lists) >= 500:
+            _save(lists)
+            lists = {}
+    _save(lists)
+    # Hidden or deleted since the last build
+    _drop(list(
+        RelatedPosts.objects.exclude(post_id__in=ForumPost.objects.filter(is_hidden=False).values('pk'))
+        .values_list('post_id', flat=True)
+    ))
+    _set_position(position)
+    return len(ids)
+
+def _add_df(counts, sign):
+    """Move the df of RelatedTerm ids by sign * n, one UPDATE per distinct n."""
+    by_n = defaultdict(list)
+    for term_id, n in counts.items():
+        by_n[n].append(term_id)
+    for n, term_ids in by_n.items():
+        for start in range(0, len(term_ids), 1000):
+            RelatedTerm.objects.filter(pk__in=term_ids[start:start + 1000]).update(df=F('df') + sign * n)
+
+def _term_ids(words):
+    """{term: RelatedTerm id}, creating the terms not seen before."""
+    words = list(words)
+    found = {}
+    for start in range(0, len(words), 1000):
+        found.update(RelatedTerm.objects.filter(term__in=words[start:start + 1000]).values_list('term', 'pk'))
+    missing = [word for word in words if word not in found]
+    if missing:
+        RelatedTerm.objects.bulk_create([RelatedTerm(term=word) for word in missing], batch_size=1000)
+        for start in range(0, len(missing), 1000):
+            found.update(RelatedTerm.objects.filter(term__in=missing[start:start + 1000]).values_list('term', 'pk'))
+    return found
+
+def reindex(post_ids):
+    """Replace the postings of `post_ids` with their current text, returns the ids still indexed."""
+    post_ids = list(post_ids)
+    removed = Counter(RelatedPosting.objects.filter(post_id__in=post_ids).values_list('term_id', flat=True))
+    RelatedPosting.objects.filter(post_id__in=post_ids).delete()
+    _add_df(removed, -1)
+
+    posts = {
+        pk: terms(title, content)
+        for pk, title, content in ForumPost.objects.filter(pk__in=post_ids, is_hidden=False).values_list('pk', 'title', 'content')
+    }
+    term_ids = _term_ids({term for counts in posts.values() for term in counts})
+    _add_df(Counter(term_ids[term] for counts in posts.values() for term in counts), 1)
+
+    n_docs = ForumPost.objects.filter(is_hidden=False).count()
+    df = {}
+    ids = list(term_ids.values())
+    for start in range(0, len(ids), 1000):
+        df.update(RelatedTerm.objects.filter(pk__in=ids[start:start + 1000]).values_list('pk', 'df'))
+    idf = {term: smoothed_idf(df[pk], n_docs) for term, pk in term_ids.items()}
+    RelatedPosting.objects.bulk_create(
+        [
+            RelatedPosting(term_id=term_ids[term], post_id=pk, weight=weight)
+            for pk, counts in posts.items() for term, weight in weigh(counts, idf).items()
+        ],
+        batch_size=1000,
+    )
+    return set(posts)
+
+def scores(post_ids, chunk_size=256):
+    """
+    {post id: [(other post id, cosine)]} from the inverted index, one join per
+    chunk of posts over the postings of the terms they use. Scores under
+    RELATED_POSTS_MIN_SCORE are left out.
+    """
+    post_ids = list(post_ids)
+    found = defaultdict(list)
+    for start in range(0, len(post_ids), chunk_size):
+        pairs = (
+            RelatedPosting.objects.filter(term__postings__post_id__in=post_ids[start:start + chunk_size])
+            .values(row=F('term__postings__post_id'), other=F('post_id'))
+            .annotate(score=Sum(F('weight') * F('term__postings__weight')))
+            .filter(score__gte=_min_score())
+            .values_list('row', 'other', 'score')
+        )
+        for row, other, score in pairs:
+            if row != other:
+                found[row].append((other, score))
+    return found
+
+def refresh(chunk_size=256):
+    """
+    Bring lists up to date with posts changed since the last run. Falls back
+    to build() the first time. Returns how many posts were redone.
+    """
+    state = ProjectionState.objects.filter(name=STATE).first()
+    if state is None or not RelatedTerm.objects.exists():
+        return build(chunk_size)
+    position = _last_event()
+    dirty = set(
+        ActivityEvent.objects.filter(pk__gt=state.position, pk__lte=position, kind__in=DIRTY_KINDS)
+        .values_list('post_id', flat=True)
+    )
+    if not dirty:
+        _set_position(position)
+        return 0
+
+    with transaction.atomic():
+        indexed = reindex(dirty)
+    # Stored scores against a dirty post are stale, their lists are redone whole
+    holders = set(RelatedBacklink.objects.filter(post_id__in=dirty).values_list('holder_id', flat=True)) - dirty
+    k = _k()
+    lists, incoming = {}, {}
+    for pk, found in scores(indexed | holders, chunk_size).items():
+        found.sort(key=lambda item: (-item[1], item[0]))
+        lists[pk] = [[other, score] for other, score in found[:k]]
+        if pk not in dirty:
+            continue
+        # Cosine is symmetric, this is also the post's score in everyone else's list
+        for other, score in found:
+            incoming.setdefault(other, []).append([pk, score])
+    # Nothing scored above the floor
+    lists.update({pk: [] for pk in (indexed | holders) - set(lists)})
+
+    # Merge into the lists of the posts they now resemble, dropping stale scores of the dirty posts
+    # (holders are recomputed above, only lists that never held one are left)
+    others = [pk for pk in incoming if pk not in lists]
+    for start in range(0, len(others), 500):
+        chunk = others[start:start + 500]
+        current = dict(RelatedPosts.objects.filter(post_id__in=chunk).values_list('post_id', 'related'))
+        changed = {}
+        for pk in chunk:
+            before = current.get(pk, [])
+            merged = [item for item in before if item[0] not in dirty] + incoming[pk]
+            merged.sort(key=lambda item: (-item[1], item[0]))
+            merged = merged[:k]
+            if merged != before:
+                changed[pk] = merged
+        _save(changed)
+    _save(lists)
+    # Hidden since, or gone
+    _drop(list(dirty - indexed))
+    _set_position(position)
+    return len(lists)
@@ -0,0 +1,58 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import ForumPost, Reply
+
+User = get_user_model()
+
+#User reputation.
+#Every upvote received on a post or reply is worth its points, votes on your
+#own content don't count. Vote views apply the change as an atomic
+#UPDATE ... SET reputation = reputation + n, reconcile() recomputes it from the
+#vote tables to repair drift (e.g. votes removed by the purger).
+
+POST_VOTE_POINTS  = 1
+REPLY_VOTE_POINTS = 1
+
+def apply_vote(author_id, voter_id, upvoted, points):
+    if author_id == voter_id:
+        return 0
+    delta = points if upvoted else -points
+    User.objects.filter(pk=author_id).update(reputation=F('reputation') + delta)
+    return delta
+
+def compute(user_ids):
+    """Reputation of the given users as counted from the vote tables."""
+    totals = dict.fromkeys(user_ids, 0)
+    for through, author, points in (
+        (ForumPost.upvoted_by.through, 'forumpost__author_id', POST_VOTE_POINTS),
+        (Reply.upvoted_by.through, 'reply__author_id', REPLY_VOTE_POINTS),
+    ):
+        rows = (
+            through.objects.filter(**{f'{author}__in': user_ids})
+            .exclude(user_id=F(author))
+            .values(author).annotate(n=Count('id')).values_list(author, 'n')
+        )
+        for user_id, n in rows:
+            totals[user_id] += n * points
+    return totals
+
+def reconcile(batch_size=500):
+    """Walk all users in pk order, batch by batch, fixing rows that drifted. Returns how many changed."""
+    fixed = 0
+    last = 0
+    while True:
+        with transaction.atomic():
+            # Locked, so a vote landing meanwhile waits and increments the fixed value
+            batch = dict(
+                User.objects.select_for_update().filter(pk__gt=last).order_by('pk')
+                .values_list('pk', 'reputation')[:batch_size]
+            )
+            if not batch:
+                return fixed
+            for user_id, reputation in compute(list(batch)).items():
+                if reputation != batch[user_id]:
+                    User.objects.filter(pk=user_id).update(reputation=reputation)
+                    fixed += 1
+        last = max(batch)
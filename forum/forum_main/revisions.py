@@ -0,0 +1,93 @@
+from difflib import SequenceMatcher
+
+from django.conf import settings
+
+from .models import Revision
+
+#Edit history as deltas.
+#A delta is a list of [start, end, text] ops, each replacing old[start:end]
+#(offsets into the old text, ascending) with text. They are computed line by
+#line, so an edit in a long post costs about the lines it touched. Revision 1
+#is the original text; every REVISION_SNAPSHOT_EVERY-th revision after it is a
+#full snapshot, so rebuilding one applies fewer than that many deltas.
+#Drafts reuse the same op format for autosave patches.
+
+def snapshot_every():
+    return max(getattr(settings, 'REVISION_SNAPSHOT_EVERY', 10), 1)
+
+def make_delta(old, new):
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    offsets = [0]
+    for line in a:
+        offsets.append(offsets[-1] + len(line))
+    return [
+        [offsets[i1], offsets[i2], ''.join(b[j1:j2])]
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+        if tag != 'equal'
+    ]
+
+def apply_delta(old, delta):
+    """Apply ops to `old`. Raises ValueError when they don't fit the text."""
+    pieces = []
+    pos = 0
+    for op in delta:
+        if not isinstance(op, (list, tuple)) or len(op) != 3:
+            raise ValueError("Each op is [start, end, text]")
+        start, end, text = op
+        if not (isinstance(start, int) and isinstance(end, int) and isinstance(text, str)):
+            raise ValueError("Each op is [start, end, text]")
+        if not pos <= start <= end <= len(old):
+            raise ValueError("Ops must be in order and inside the text")
+        pieces.append(old[pos:start])
+        pieces.append(text)
+        pos = end
+    pieces.append(old[pos:])
+    return ''.join(pieces)
+
+def _target(obj):
+    return {'post': obj} if obj._meta.model_name == 'forumpost' else {'reply': obj}
+
+def record_edit(obj, old_title, old_content, editor):
+    """
+    Store `obj`'s new text as the next revision. Call with the text it had
+    before the edit, while the row is locked. The first edit also stores the
+    original as revision 1.
+    """
+    target = _target(obj)
+    last = Revision.objects.filter(**target).order_by('-number').values_list('number', flat=True).first()
+    if last is None:
+        Revision.objects.create(
+            **target, number=1, editor_id=obj.author_id, title=old_title,
+            snapshot=old_content, created_at=obj.created_at,
+        )
+        last = 1
+    number = last + 1
+    new_title = getattr(obj, 'title', '')
+    if (number - 1) % snapshot_every() == 0:
+        return Revision.objects.create(**target, number=number, editor=editor, title=new_title, snapshot=obj.content)
+    return Revision.objects.create(
+        **target, number=number, editor=editor, title=new_title,
+        delta=make_delta(old_content, obj.content),
+    )
+
+def rebuild(obj, number):
+    """Text of revision `number`, or None when there is no such revision."""
+    target = _target(obj)
+    base = (
+        Revision.objects.filter(**target, number__lte=number, snapshot__isnull=False)
+        .order_by('-number').first()
+    )
+    if base is None:
+        return None
+    revisions = list(
+        Revision.objects.filter(**target, number__gt=base.number, number__lte=number).order_by('number')
+    )
+    if base.number + len(revisions) != number:
+        return None
+    content = base.snapshot
+    title = base.title
+    for rev in revisions:
+        content = apply_delta(content, rev.delta)
+        title = rev.title
+    return {'number': number, 'title': title, 'content': content, 'applied_deltas': len(revisions)}
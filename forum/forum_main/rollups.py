@@ -0,0 +1,175 @@
+from collections import Counter, defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import ActivityEvent, ProjectionState, StatBucket
+
+#Forum statistics from time bucketed rollups.
+#The rollups projection counts activity log events into minute buckets; compact()
+#folds minute buckets older than STATS_MINUTE_RETENTION into hours and hours
+#older than STATS_HOUR_RETENTION into days. Readers sum whatever buckets start
+#inside the window, so a dashboard query costs O(buckets) and old data is simply
+#coarser. Windows are aligned to bucket starts.
+
+POSTS        = 'posts'
+REPLIES      = 'replies'
+VOTES        = 'votes'
+ACTIVE_USERS = 'active_users'
+THREADS      = 'threads'
+
+SERIES_METRICS = (POSTS, REPLIES, VOTES)
+
+RESOLUTIONS = {
+    StatBucket.MINUTE: timedelta(minutes=1),
+    StatBucket.HOUR: timedelta(hours=1),
+    StatBucket.DAY: timedelta(days=1),
+}
+ORDER = [StatBucket.MINUTE, StatBucket.HOUR, StatBucket.DAY]
+
+# Anything a user does themselves makes them active
+ACTIVE_KINDS = {
+    ActivityEvent.POST_CREATED, ActivityEvent.POST_EDITED, ActivityEvent.REPLY_CREATED,
+    ActivityEvent.REPLY_EDITED, ActivityEvent.POST_VOTED, ActivityEvent.REPLY_VOTED,
+    ActivityEvent.USER_FOLLOWED,
+}
+
+# ProjectionState row of the rollups projection, compaction locks it too
+LOCK = 'rollups'
+
+def truncate(moment, resolution):
+    moment = moment.astimezone(dt_timezone.utc).replace(second=0, microsecond=0)
+    if resolution in (StatBucket.HOUR, StatBucket.DAY):
+        moment = moment.replace(minute=0)
+    if resolution == StatBucket.DAY:
+        moment = moment.replace(hour=0)
+    return moment
+
+def count_events(events):
+    """Counter of (metric, minute start, key) -> n for a batch of activity log events."""
+    counts = Counter()
+    for e in events:
+        minute = truncate(e.created_at, StatBucket.MINUTE)
+        if e.kind == ActivityEvent.POST_CREATED:
+            counts[POSTS, minute, 0] += 1
+        elif e.kind == ActivityEvent.REPLY_CREATED:
+            counts[REPLIES, minute, 0] += 1
+            counts[THREADS, minute, e.post_id] += 1
+        elif e.kind in (ActivityEvent.POST_VOTED, ActivityEvent.REPLY_VOTED) and 'upvoted' in e.payload:
+            # Taking a vote back takes it off the count, imported votes carry no flag
+            delta = 1 if e.payload['upvoted'] else -1
+            counts[VOTES, minute, 0] += delta
+            counts[THREADS, minute, e.post_id] += delta
+        if e.kind in ACTIVE_KINDS and e.actor_id is not None:
+            counts[ACTIVE_USERS, minute, e.actor_id] += 1
+    return counts
+
+def add(resolution, counts):
+    """Add counts to the buckets of one resolution. Callers hold the LOCK row."""
+    if not counts:
+        return
+    existing = {
+        (metric, start, key): pk
+        for pk, metric, start, key in StatBucket.objects.filter(
+            resolution=resolution,
+            metric__in={metric for metric, _, _ in counts},
+            start__in={start for _, start, _ in counts},
+        ).values_list('pk', 'metric', 'start', 'key')
+    }
+    # Mostly +1s, so one UPDATE per distinct increment
+    by_increment = defaultdict(list)
+    fresh = []
+    for (metric, start, key), n in counts.items():
+        if n == 0:
+            continue
+        pk = existing.get((metric, start, key))
+        if pk is None:
+            fresh.append(StatBucket(metric=metric, resolution=resolution, start=start, key=key, value=n))
+        else:
+            by_increment[n].append(pk)
+    for n, pks in by_increment.items():
+        for i in range(0, len(pks), 1000):
+            StatBucket.objects.filter(pk__in=pks[i:i + 1000]).update(value=F('value') + n)
+    StatBucket.objects.bulk_create(fresh, batch_size=500)
+
+def compact(now=None, batch_size=1000):
+    """Fold aged minute buckets into hours and hours into days. Returns how many buckets were folded."""
+    now = now or timezone.now()
+    retention = {
+        StatBucket.MINUTE: timedelta(seconds=getattr(settings, 'STATS_MINUTE_RETENTION', 2 * 3600)),
+        StatBucket.HOUR: timedelta(seconds=getattr(settings, 'STATS_HOUR_RETENTION', 7 * 86400)),
+    }
+    folded = 0
+    for finer, coarser in zip(ORDER, ORDER[1:]):
+        # Only whole coarser buckets, a partly folded hour would be read twice
+        cutoff = truncate(now - retention[finer], coarser)
+        while True:
+            with transaction.atomic():
+                # Same row the projection locks while it writes buckets
+                ProjectionState.objects.select_for_update().get_or_create(name=LOCK)
+                rows = list(
+                    StatBucket.objects.filter(resolution=finer, start__lt=cutoff)
+                    .order_by('start', 'pk').values_list('pk', 'metric', 'start', 'key', 'value')[:batch_size]
+                )
+                if not rows:
+                    break
+                counts = Counter()
+                for _, metric, start, key, value in rows:
+                    counts[metric, truncate(start, coarser), key] += value
+                add(coarser, counts)
+                StatBucket.objects.filter(pk__in=[row[0] for row in rows]).delete()
+            folded += len(rows)
+    return folded
+
+def _window(since, until):
+    buckets = StatBucket.objects.filter(start__gte=truncate(since, StatBucket.MINUTE))
+    if until is not None:
+        buckets = buckets.filter(start__lt=until)
+    return buckets
+
+def series(since, resolution, until=None, metrics=SERIES_METRICS):
+    """
+    [{'start': ..., metric: n, ...}] for every `resolution` step from `since`,
+    zero filled. Buckets already compacted past `resolution` are counted whole
+    at their own start.
+    """
+    until = until or timezone.now()
+    step = RESOLUTIONS[resolution]
+    points = {}
+    start = truncate(since, resolution)
+    while start < until:
+        points[start] = dict.fromkeys(metrics, 0)
+        start += step
+
+    rows = (
+        _window(since, until).filter(metric__in=metrics, key=0)
+        .values('metric', 'resolution', 'start').annotate(n=Sum('value'))
+    )
+    finest = ORDER.index(resolution)
+    for row in rows:
+        at = truncate(row['start'], ORDER[max(finest, ORDER.index(row['resolution']))])
+        point = points.setdefault(at, dict.fromkeys(metrics, 0))
+        point[row['metric']] += row['n']
+    return [dict(values, start=at) for at, values in sorted(points.items())]
+
+def totals(since, until=None, metrics=SERIES_METRICS):
+    counts = dict.fromkeys(metrics, 0)
+    rows = _window(since, until).filter(metric__in=metrics, key=0).values('metric').annotate(n=Sum('value'))
+    for row in rows:
+        counts[row['metric']] = row['n']
+    counts[ACTIVE_USERS] = active_users(since, until)
+    return counts
+
+def active_users(since, until=None):
+    return _window(since, until).filter(metric=ACTIVE_USERS).values('key').distinct().count()
+
+def top_threads(since, until=None, limit=10):
+    """[(post id, replies + upvotes)] for the busiest threads of the window."""
+    return list(
+        _window(since, until).filter(metric=THREADS)
+        .values('key').annotate(score=Sum('value')).filter(score__gt=0).order_by('-score', '-key')
+        .values_list('key', 'score')[:limit]
+    )
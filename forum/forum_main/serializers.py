@@ -1,6 +1,9 @@
+from datetime import timedelta
+
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import ForumPost, Reply
+from . import rollups
+from .models import ContentSignature, Draft, ForumPost, Notification, Reply, Revision, StatBucket
     
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -36,15 +39,128 @@ class ReplySerializer(serializers.ModelSerializer):
                             'parent_author','parent_content')
 
     def get_parent_author(self, obj):
-        if obj.parent:
+        if obj.parent and obj.parent.deleted_at is None and not obj.parent.is_hidden:
             return obj.parent.author.username
         return None
 
     def get_parent_content(self, obj):
-        if obj.parent:
+        if obj.parent and obj.parent.deleted_at is None and not obj.parent.is_hidden:
             return obj.parent.content
         return None
 
     def create(self, validated_data):
         validated_data['author'] = self.context['request'].user
         return super().create(validated_data)
+
+class BulkModerationSerializer(serializers.Serializer):
+    action  = serializers.ChoiceField(choices=['delete', 'hide'])
+    posts   = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    replies = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    # Everything written by this user
+    user    = serializers.IntegerField(required=False, allow_null=True, default=None)
+    ban     = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, attrs):
+        if not (attrs['posts'] or attrs['replies'] or attrs['user']):
+            raise serializers.ValidationError("Nothing to moderate")
+        if attrs['ban'] and not attrs['user']:
+            raise serializers.ValidationError({'ban': "Ban needs a user"})
+        return attrs
+
+
+class HeldContentSerializer(serializers.ModelSerializer):
+    author  = UserSerializer(read_only=True)
+    title   = serializers.CharField(source='post.title', default=None, read_only=True)
+    content = serializers.SerializerMethodField()
+
+    class Meta:
+        model  = ContentSignature
+        fields = ('id', 'post', 'reply', 'author', 'title', 'content', 'duplicates', 'created_at')
+
+    def get_content(self, obj):
+        target = obj.reply or obj.post
+        return target.content if target else None
+
+class HeldDecisionSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(choices=['approve', 'reject'])
+
+
+class FeedItemSerializer(serializers.Serializer):
+    # `id` is the activity event id, pass the last one as ?before= for the next page
+    id         = serializers.IntegerField(source='event_id')
+    kind       = serializers.CharField()
+    created_at = serializers.DateTimeField()
+    post       = PostSerializer()
+    reply      = ReplySerializer(allow_null=True)
+
+class NotificationSerializer(serializers.ModelSerializer):
+    post_title = serializers.CharField(source='post.title', read_only=True)
+    read       = serializers.SerializerMethodField()
+
+    class Meta:
+        model  = Notification
+        fields = ('id', 'kind', 'post', 'post_title', 'parent', 'latest_reply', 'count', 'updated_at', 'read')
+
+    def get_read(self, obj):
+        return obj.read_at is not None
+
+class MarkReadSerializer(serializers.Serializer):
+    # Leave out to mark everything read
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_null=True, default=None)
+
+class RevisionSerializer(serializers.ModelSerializer):
+    snapshot = serializers.SerializerMethodField()
+
+    class Meta:
+        model  = Revision
+        fields = ('number', 'editor', 'title', 'created_at', 'snapshot')
+
+    def get_snapshot(self, obj):
+        return obj.snapshot is not None
+
+class DraftSerializer(serializers.ModelSerializer):
+    class Meta:
+        model  = Draft
+        fields = ('id', 'post', 'reply', 'title', 'content', 'version', 'updated_at')
+        read_only_fields = ('version', 'updated_at')
+
+    def validate(self, attrs):
+        post, reply = attrs.get('post'), attrs.get('reply')
+        if post and reply:
+            raise serializers.ValidationError("A draft edits a post or a reply, not both")
+        user = self.context['request'].user
+        target = post or reply
+        if target and target.author_id != user.pk and not user.is_moderator:
+            raise serializers.ValidationError("You can only draft edits of your own posts")
+        return attrs
+
+class DraftPatchSerializer(serializers.Serializer):
+    # Version the patch was made against, and [[start, end, text], ...] ops
+    version = serializers.IntegerField()
+    patch   = serializers.ListField(child=serializers.ListField(), max_length=200)
+    title   = serializers.CharField(max_length=100, required=False, allow_blank=True)
+
+class StatsQuerySerializer(serializers.Serializer):
+    WINDOWS = {
+        '1h': timedelta(hours=1),
+        '24h': timedelta(hours=24),
+        '7d': timedelta(days=7),
+        '30d': timedelta(days=30),
+    }
+    # Points a series may have
+    MAX_POINTS = 1500
+
+    window     = serializers.ChoiceField(choices=list(WINDOWS), default='24h')
+    resolution = serializers.ChoiceField(choices=[c for c, _ in StatBucket.RESOLUTION_CHOICES], required=False)
+    limit      = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+    def validate(self, attrs):
+        attrs['span'] = self.WINDOWS[attrs['window']]
+        if 'resolution' not in attrs:
+            attrs['resolution'] = StatBucket.MINUTE if attrs['span'] <= timedelta(hours=1) else (
+                StatBucket.HOUR if attrs['span'] <= timedelta(days=7) else StatBucket.DAY
+            )
+        step = rollups.RESOLUTIONS[attrs['resolution']]
+        if attrs['span'] / step > self.MAX_POINTS:
+            raise serializers.ValidationError({'resolution': "Too fine for this window"})
+        return attrs
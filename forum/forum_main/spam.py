@@ -0,0 +1,146 @@
+import random
+import re
+from datetime import timedelta
+from hashlib import blake2b
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import events, moderation, readmodels
+from .models import ActivityEvent, ContentBand, ContentSignature, ForumPost, Reply
+
+#Near-duplicate detection for new posts and replies.
+#Every text long enough to judge gets a MinHash signature of its word set:
+#PERMUTATIONS hash functions, keeping the smallest value of each, so two
+#signatures agree in about as many positions as the word sets' Jaccard
+#similarity. Signatures are cut into BANDS bands of ROWS values and each band is
+#stored as one hashed key (LSH); texts at 0.7 similarity share some band ~96% of
+#the time, unrelated ones almost never. Candidates are therefore one indexed
+#IN lookup over the last SPAM_WINDOW seconds, then verified on the signature.
+#Content with SPAM_DUPLICATE_LIMIT or more near duplicates is created hidden and
+#held until a moderator approves or rejects it. prune() forgets signatures that
+#have left the window, check() never reads them again.
+
+BANDS = 12
+ROWS = 4
+PRIME = (1 << 61) - 1
+WORD = re.compile(r'\w+')
+
+# Fixed seed: stored signatures must stay comparable across processes and deploys
+_random = random.Random(0x5EED)
+PERMUTATIONS = [(_random.randrange(1, PRIME), _random.randrange(PRIME)) for _ in range(BANDS * ROWS)]
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+def _hash64(text, signed=False):
+    return int.from_bytes(blake2b(text.encode(), digest_size=8).digest(), 'big', signed=signed)
+
+def minhash(words):
+    hashes = [_hash64(word) for word in set(words)]
+    if not hashes:
+        return [0] * len(PERMUTATIONS)
+    return [min((a * x + b) % PRIME for x in hashes) for a, b in PERMUTATIONS]
+
+def band_keys(signature):
+    return [
+        _hash64(f"{band}:{signature[band * ROWS:(band + 1) * ROWS]}", signed=True)
+        for band in range(BANDS)
+    ]
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of the word sets behind two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+def check(author, text):
+    """
+    Unsaved ContentSignature for new content by `author`, with its near
+    duplicate count and whether to hold it, or None when the text is too short
+    to judge. Save it with remember() once the content exists.
+    """
+    words = WORD.findall(text.lower())
+    if len(words) < _setting('SPAM_MIN_WORDS', 8):
+        return None
+    value = minhash(words)
+    keys = band_keys(value)
+    since = timezone.now() - timedelta(seconds=_setting('SPAM_WINDOW', 86400))
+    candidates = set(
+        ContentBand.objects.filter(key__in=keys, created_at__gte=since)
+        .order_by('-created_at').values_list('signature_id', flat=True)[:_setting('SPAM_MAX_CANDIDATES', 200)]
+    )
+    threshold = _setting('SPAM_MIN_SIMILARITY', 0.7)
+    duplicates = sum(
+        1 for other in ContentSignature.objects.filter(pk__in=candidates).values_list('minhash', flat=True)
+        if similarity(other, value) >= threshold
+    )
+    signature = ContentSignature(
+        author=author, minhash=value, duplicates=duplicates,
+        held=duplicates >= _setting('SPAM_DUPLICATE_LIMIT', 1) and not author.is_moderator,
+    )
+    signature.band_keys = keys
+    return signature
+
+def remember(signature, post=None, reply=None):
+    if signature is None:
+        return None
+    signature.post = post
+    signature.reply = reply
+    signature.save()
+    ContentBand.objects.bulk_create([
+        ContentBand(signature=signature, key=key, created_at=signature.created_at) for key in signature.band_keys
+    ])
+    return signature
+
+def prune(now=None, batch_size=1000):
+    """
+    Delete bands and unheld signatures older than SPAM_WINDOW, `batch_size`
+    signatures per transaction. Held ones stay for the moderator queue.
+    Returns how many signatures were deleted.
+    """
+    cutoff = (now or timezone.now()) - timedelta(seconds=_setting('SPAM_WINDOW', 86400))
+    deleted, last = 0, 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                ContentSignature.objects.filter(created_at__lt=cutoff, pk__gt=last)
+                .order_by('pk').values_list('pk', 'held')[:batch_size]
+            )
+            if not rows:
+                break
+            ContentBand.objects.filter(signature_id__in=[pk for pk, _ in rows]).delete()
+            gone = [pk for pk, held in rows if not held]
+            ContentSignature.objects.filter(pk__in=gone).delete()
+        deleted += len(gone)
+        last = rows[-1][0]
+    return deleted
+
+def release(signature_id, actor, approve):
+    """
+    Decide on held content: approving makes it visible, rejecting soft deletes
+    it. Returns False when it was not (or no longer) held.
+    """
+    with transaction.atomic():
+        signature = ContentSignature.objects.select_for_update().filter(pk=signature_id, held=True).first()
+        if signature is None:
+            return False
+        signature.held = False
+        signature.save(update_fields=['held'])
+        if not approve:
+            if signature.reply_id:
+                moderation.delete_replies([signature.reply_id], actor)
+            else:
+                moderation.delete_posts([signature.post_id], actor)
+            return True
+        if signature.reply_id:
+            reply = Reply.objects.filter(pk=signature.reply_id).first()
+            if reply is not None:
+                Reply.objects.filter(pk=reply.pk).update(is_hidden=False)
+                events.record(ActivityEvent.REPLY_APPROVED, actor=actor, post=reply.post_id, reply=reply,
+                              users=[reply.author_id])
+                readmodels.schedule_refresh(reply.post_id)
+        elif ForumPost.objects.filter(pk=signature.post_id).update(is_hidden=False):
+            events.record(ActivityEvent.POST_APPROVED, actor=actor, post=signature.post_id,
+                          users=[signature.author_id])
+            readmodels.schedule_refresh(signature.post_id)
+    return True
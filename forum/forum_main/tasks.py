@@ -0,0 +1,105 @@
+from django.conf import settings
+
+from . import moderation, projections, readmodels, related, reputation, rollups, spam
+from .models import ActivityEvent, ProjectionState
+from .queue import enqueue, is_eager, task
+
+#Background tasks. Imported from ForumMainConfig.ready() so workers know every name.
+
+@task('projections.update', priority=-1)
+def update_projections():
+    if is_eager():
+        projections.run_projections(settle=0)
+        return
+    projections.run_projections()
+    # Events still inside the settle window were skipped, come back for them
+    if _has_unprojected_events():
+        projections.schedule_projections()
+
+@task('readmodels.refresh_post_document', priority=5)
+def refresh_post_document(post_id):
+    readmodels.refresh_post_document(post_id)
+
+@task('readmodels.invalidate_user_documents', priority=5)
+def invalidate_user_documents(user_id):
+    readmodels.invalidate_user_documents(user_id)
+
+@task('readmodels.refresh_post_documents', priority=5)
+def refresh_post_documents(post_ids):
+    for post_id in post_ids:
+        readmodels.refresh_post_document(post_id)
+
+@task('moderation.bulk', priority=1, max_attempts=1)
+def bulk_moderation(action, actor_id, posts=(), replies=(), user=None, ban=False):
+    moderation.run_bulk(action, actor_id, posts=posts, replies=replies, user=user, ban=ban)
+
+@task('moderation.purge_deleted', priority=-5)
+def purge_deleted():
+    _, _, finished = moderation.purge_deleted(max_batches=settings.PURGE_MAX_BATCHES_PER_RUN)
+    if not finished and not is_eager():
+        # Busy, or more left than one run may take: try again soon
+        moderation.schedule_purge(delay=settings.PURGE_RETRY_SECONDS)
+
+@task('reputation.reconcile', priority=-5)
+def reconcile_reputation(repeat=True):
+    reputation.reconcile()
+    # Eager tasks run right away, repeating would never end
+    if repeat and not is_eager():
+        schedule_reputation_reconcile()
+
+def schedule_reputation_reconcile():
+    # Periodic, each run queues the next one
+    enqueue(
+        'reputation.reconcile',
+        key='reputation.reconcile',
+        delay=settings.REPUTATION_RECONCILE_INTERVAL,
+    )
+
+@task('stats.compact', priority=-5)
+def compact_stats(repeat=True):
+    rollups.compact()
+    if repeat and not is_eager():
+        schedule_stats_compaction()
+
+def schedule_stats_compaction():
+    enqueue(
+        'stats.compact',
+        key='stats.compact',
+        delay=settings.STATS_COMPACT_INTERVAL,
+    )
+
+@task('spam.prune', priority=-5)
+def prune_spam_signatures(repeat=True):
+    spam.prune()
+    if repeat and not is_eager():
+        schedule_spam_prune()
+
+def schedule_spam_prune():
+    enqueue(
+        'spam.prune',
+        key='spam.prune',
+        delay=settings.SPAM_PRUNE_INTERVAL,
+    )
+
+@task('related.refresh', priority=-5)
+def refresh_related_posts(repeat=True):
+    related.refresh()
+    if repeat and not is_eager():
+        schedule_related_refresh()
+
+def schedule_related_refresh():
+    enqueue(
+        'related.refresh',
+        key='related.refresh',
+        delay=settings.RELATED_POSTS_INTERVAL,
+    )
+
+def _has_unprojected_events():
+    last = ActivityEvent.objects.order_by('-pk').values_list('pk', flat=True).first()
+    if last is None:
+        return False
+    # Other jobs keep their log position in the same table
+    positions = ProjectionState.objects.filter(
+        name__in=[p.name for p in projections.PROJECTIONS]
+    ).values_list('position', flat=True)
+    return len(positions) < len(projections.PROJECTIONS) or min(positions) < last
@@ -1,3 +1,1220 @@
-from django.test import TestCase
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Sum
+from django.utils import timezone
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+from django.contrib.auth import get_user_model
+from .models import (
+    ActivityEvent, ContentBand, ContentSignature, Draft, ForumPost, Notification, PostStats, RelatedBacklink, RelatedPosting, RelatedPosts, Reply, Revision, StatBucket, Task, TimelineEntry, UserStats,
+)
+from .projections import replay_projections, run_projections
+from .queue import Worker, enqueue, task
+from . import events, feeds, moderation, notifications, queue, readmodels, related, reputation, revisions, rollups, spam, tasks
+from forum import mongo, routers
+from .management.commands.index_advisor import IndexAdvisor, QueryCollector, parse_showplan
+from .management.commands.profile_startup import by_package, parse_importtime
 
-# Create your tests here.
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+User = get_user_model()
+
+class ForumAPITestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='alice',
+            password='Secret123!',
+            nickname='alice'
+        )
+        self.login(self.user)
+
+    def login(self, user, password='Secret123!'):
+        resp = self.client.post(
+            reverse('token_obtain_pair'),
+            {'username': user.username, 'password': password},
+            format='json'
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {resp.data['access']}")
+
+    def create_post(self, title='hello', content='whatever man'):
+        resp = self.client.post(
+            reverse('post-create'),
+            {'title': title, 'content': content},
+            format='json'
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        return resp.data['id']
+
+    def create_reply(self, post_id, content='me too', parent_id=None):
+        if parent_id:
+            url = reverse('reply-to-reply', args=[post_id, parent_id])
+        else:
+            url = reverse('reply-create', args=[post_id])
+        resp = self.client.post(url, {'content': content}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        return resp.data['id']
+
+
+class ActivityLogTests(ForumAPITestCase):
+    def test_writes_record_events(self):
+        post_id = self.create_post()
+        reply_id = self.create_reply(post_id)
+        self.client.post(reverse('post-upvote', args=[post_id]))
+
+        kinds = list(ActivityEvent.objects.values_list('kind', flat=True))
+        self.assertEqual(kinds, [
+            ActivityEvent.POST_CREATED,
+            ActivityEvent.REPLY_CREATED,
+            ActivityEvent.POST_VOTED,
+        ])
+        self.assertEqual(ActivityEvent.objects.get(kind=ActivityEvent.REPLY_CREATED).reply_id, reply_id)
+
+    def test_projections_consume_incrementally(self):
+        post_id = self.create_post()
+        self.create_reply(post_id)
+        self.assertEqual(run_projections(settle=0), {'post_stats': 2, 'user_stats': 2, 'timelines': 2, 'notifications': 2, 'rollups': 2})
+
+        stats = PostStats.objects.get(post_id=post_id)
+        self.assertEqual(stats.reply_count, 1)
+        self.assertEqual(UserStats.objects.get(user=self.user).post_count, 1)
+
+        self.client.post(reverse('post-upvote', args=[post_id]))
+        self.assertEqual(run_projections(settle=0), {'post_stats': 1, 'user_stats': 1, 'timelines': 1, 'notifications': 1, 'rollups': 1})
+        self.assertEqual(PostStats.objects.get(post_id=post_id).upvotes, 1)
+
+    @override_settings(PURGE_GRACE_SECONDS=0)
+    def test_delete_cascades_into_read_models(self):
+        post_id = self.create_post()
+        parent_id = self.create_reply(post_id)
+        self.create_reply(post_id, parent_id=parent_id)
+        run_projections(settle=0)
+        self.assertEqual(UserStats.objects.get(user=self.user).reply_count, 2)
+
+        resp = self.client.delete(reverse('reply-delete', args=[parent_id]))
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        run_projections(settle=0)
+        # The child goes with its parent straight away
+        self.assertEqual(PostStats.objects.get(post_id=post_id).reply_count, 0)
+        self.assertEqual(UserStats.objects.get(user=self.user).reply_count, 0)
+        resp = self.client.get(reverse('reply-list-by-post', args=[post_id]))
+        self.assertEqual(resp.data['count'], 0)
+
+        moderation.purge_deleted(force=True)
+        run_projections(settle=0)
+        self.assertEqual(PostStats.objects.get(post_id=post_id).reply_count, 0)
+        self.assertEqual(UserStats.objects.get(user=self.user).reply_count, 0)
+
+    def test_delete_stamps_only_the_reply(self):
+        post_id = self.create_post()
+        parent_id = self.create_reply(post_id)
+        child_id = self.create_reply(post_id, parent_id=parent_id)
+        grandchild_id = self.create_reply(post_id, parent_id=child_id)
+        sibling_id = self.create_reply(post_id)
+        self.assertEqual(Reply.objects.get(pk=grandchild_id).path, f'{parent_id}/{child_id}/')
+
+        with CaptureQueriesContext(connection) as ctx:
+            moderation.delete_replies([parent_id], self.user)
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(ActivityEvent.objects.filter(kind=ActivityEvent.REPLY_DELETED).count(), 1)
+        self.assertIsNone(Reply.all_objects.get(pk=child_id).deleted_at)
+
+        # Still hidden while the reply above it is deleted
+        self.assertEqual(list(Reply.objects.values_list('pk', flat=True)), [sibling_id])
+        resp = self.client.post(reverse('reply-upvote', args=[grandchild_id]))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_replies_under_deleted_post_are_gone(self):
+        post_id = self.create_post()
+        reply_id = self.create_reply(post_id)
+        run_projections(settle=0)
+        self.assertEqual(UserStats.objects.get(user=self.user).reply_count, 1)
+
+        resp = self.client.delete(reverse('post-delete', args=[post_id]))
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertIsNone(Reply.all_objects.get(pk=reply_id).deleted_at)
+        resp = self.client.post(reverse('reply-upvote', args=[reply_id]))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.patch(reverse('reply-edit', args=[reply_id]), {'content': 'edited'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.get(reverse('reply-revisions', args=[reply_id]))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        run_projections(settle=0)
+        self.assertEqual(UserStats.objects.get(user=self.user).reply_count, 0)
+
+    def test_delete_is_soft(self):
+        post_id = self.create_post()
+        parent_id = self.create_reply(post_id)
+        self.create_reply(post_id, parent_id=parent_id)
+
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.delete(reverse('post-delete', args=[post_id]))
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('DELETE')])
+        self.assertEqual(Reply.all_objects.filter(post_id=post_id).count(), 2)
+        self.assertIsNotNone(ForumPost.all_objects.get(pk=post_id).deleted_at)
+        resp = self.client.get(reverse('post-get', args=[post_id]))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.get(reverse('reply-list-by-post', args=[post_id]))
+        self.assertEqual(resp.data['count'], 0)
+
+        with override_settings(PURGE_GRACE_SECONDS=3600):
+            self.assertEqual(moderation.purge_deleted(force=True), (0, 0, True))
+        with override_settings(PURGE_GRACE_SECONDS=0, PURGE_QUIET_EVENTS_PER_MINUTE=1):
+            self.assertEqual(moderation.purge_deleted(), (0, 0, False))
+            self.assertEqual(moderation.purge_deleted(force=True), (1, 0, True))
+        self.assertFalse(Reply.all_objects.exists())
+
+    @override_settings(PURGE_GRACE_SECONDS=0, PURGE_BATCH_SIZE=10, PURGE_QUIET_EVENTS_PER_MINUTE=5)
+    def test_purge_runs_past_its_own_events(self):
+        post_ids = [self.create_post(title=f'post {i}') for i in range(25)]
+        moderation.delete_posts(post_ids, self.user)
+        ActivityEvent.objects.update(created_at=timezone.now() - timedelta(hours=1))
+
+        # Each batch logs ten purge events, more than the quiet limit
+        self.assertEqual(moderation.purge_deleted(max_batches=50), (25, 0, True))
+        self.assertFalse(ForumPost.all_objects.exists())
+
+    @override_settings(PURGE_GRACE_SECONDS=0, PURGE_QUIET_EVENTS_PER_MINUTE=1, PURGE_RETRY_SECONDS=30,
+                       TASK_QUEUE_EAGER=False)
+    def test_busy_purge_retries_soon(self):
+        post_id = self.create_post()
+        moderation.delete_posts([post_id], self.user)
+        Task.objects.all().delete()
+
+        tasks.purge_deleted()
+        task = Task.objects.get(name='moderation.purge_deleted')
+        self.assertLess(task.run_after, timezone.now() + timedelta(seconds=31))
+        self.assertTrue(ForumPost.all_objects.filter(pk=post_id).exists())
+
+    def test_replay_rebuilds_from_zero(self):
+        post_id = self.create_post()
+        self.create_reply(post_id)
+        run_projections(settle=0)
+        PostStats.objects.all().delete()
+
+        replay_projections()
+        self.assertEqual(PostStats.objects.get(post_id=post_id).reply_count, 1)
+
+    def test_sorted_list_reads_projection(self):
+        quiet = self.create_post(title='quiet')
+        busy = self.create_post(title='busy')
+        self.create_reply(busy)
+        run_projections(settle=0)
+
+        resp = self.client.get(reverse('post-list-sorted'), {'ordering': '-reply_count'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['id'] for p in resp.data['results']], [busy, quiet])
+
+
+@skipUnless(mongomock, "mongomock is not installed")
+@override_settings(MONGODB_URI='mongomock://localhost', MONGODB_DB='forum_test', MONGODB_READ_MODELS=True,
+                   TASK_QUEUE_EAGER=True)
+class PostDocumentTests(ForumAPITestCase):
+    def setUp(self):
+        mongo.reset_client()
+        super().setUp()
+
+    def tearDown(self):
+        mongo.reset_client()
+
+    def test_writes_refresh_document(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post_id = self.create_post()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_reply(post_id)
+
+        doc = readmodels.collection().find_one({'_id': post_id})
+        self.assertEqual(doc['reply_count'], 1)
+        self.assertEqual(doc['replies'][0]['content'], 'me too')
+
+    def test_get_views_serve_document(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post_id = self.create_post()
+            self.create_reply(post_id)
+        # Prove the views read Mongo, not SQL
+        readmodels.collection().update_one({'_id': post_id}, {'$set': {'post.title': 'from mongo'}})
+
+        resp = self.client.get(reverse('post-get', args=[post_id]))
+        self.assertEqual(resp.data['title'], 'from mongo')
+        self.assertTrue(resp.data['author']['avatar'].startswith('http://testserver/'))
+
+        resp = self.client.get(reverse('reply-list-by-post', args=[post_id]))
+        self.assertEqual(resp.data['count'], 1)
+
+    def test_missing_document_is_built_on_read(self):
+        post_id = self.create_post()
+        resp = self.client.get(reverse('post-get', args=[post_id]))
+        self.assertEqual(resp.data['title'], 'hello')
+        self.assertIsNotNone(readmodels.collection().find_one({'_id': post_id}))
+
+        ForumPost.objects.filter(pk=post_id).delete()
+        readmodels.refresh_post_document(post_id)
+        resp = self.client.get(reverse('post-get', args=[post_id]))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_views_fall_back_to_sql_when_mongo_is_down(self):
+        from pymongo.errors import ServerSelectionTimeoutError
+
+        post_id = self.create_post()
+        self.create_reply(post_id)
+        down = mock.Mock()
+        down.find_one.side_effect = ServerSelectionTimeoutError('no servers')
+        with mock.patch.object(readmodels, 'collection', return_value=down):
+            resp = self.client.get(reverse('post-get', args=[post_id]))
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.data['title'], 'hello')
+
+            resp = self.client.get(reverse('reply-list-by-post', args=[post_id]))
+            self.assertEqual(resp.data['count'], 1)
+
+            resp = self.client.get(reverse('post-get', args=[post_id + 1]))
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rebuild_all_uses_bulk_batches(self):
+        ids = [self.create_post(title=f'post {i}') for i in range(5)]
+        flush_impl = mongo.BulkWriter.flush
+        with mock.patch.object(mongo.BulkWriter, 'flush', autospec=True, side_effect=flush_impl) as flush:
+            self.assertEqual(readmodels.rebuild_all(batch_size=2), 5)
+        # 2 + 2 on the way, 1 left over on exit
+        self.assertEqual(flush.call_count, 3)
+        self.assertEqual(readmodels.collection().count_documents({}), len(ids))
+
+
+class MongoClientTests(TestCase):
+    @override_settings(MONGODB_URI='mongodb://localhost:27017', MONGODB_MAX_POOL_SIZE=7)
+    def test_client_is_recreated_in_forked_process(self):
+        mongo.reset_client()
+        try:
+            client = mongo.get_client()
+            self.assertEqual(client.options.pool_options.max_pool_size, 7)
+            self.assertIs(mongo.get_client(), client)
+            with mock.patch('forum.mongo.os.getpid', return_value=-1):
+                self.assertIsNot(mongo.get_client(), client)
+        finally:
+            mongo.reset_client()
+
+
+@override_settings(TASK_QUEUE_EAGER=False)
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        # Test tasks only exist for the duration of each test
+        registry = mock.patch.dict(queue._registry)
+        registry.start()
+        self.addCleanup(registry.stop)
+        self.ran = ran = []
+
+        @task('tests.record')
+        def record_task(value):
+            ran.append(value)
+
+        @task('tests.flaky', max_attempts=2, retry_delay=0)
+        def flaky_task():
+            raise RuntimeError('nope')
+
+    def test_priority_order_and_cleanup(self):
+        enqueue('tests.record', args=['low'], priority=0)
+        enqueue('tests.record', args=['high'], priority=10)
+        Worker(concurrency=1).run_once()
+        self.assertEqual(self.ran, ['high'])
+        Worker(concurrency=1).run_once()
+        self.assertEqual(self.ran, ['high', 'low'])
+        self.assertFalse(Task.objects.exists())
+
+    def test_keyed_tasks_coalesce(self):
+        enqueue('tests.record', args=[1], key='same')
+        enqueue('tests.record', args=[2], key='same')
+        self.assertEqual(Task.objects.count(), 1)
+
+    def test_failures_retry_then_fail(self):
+        enqueue('tests.flaky')
+        worker = Worker(concurrency=1)
+        self.assertEqual(worker.run_once(), [False])
+        self.assertEqual(Task.objects.get().status, Task.QUEUED)
+        worker.run_once()
+        failed = Task.objects.get()
+        self.assertEqual((failed.status, failed.attempts), (Task.FAILED, 2))
+        self.assertIn('RuntimeError', failed.last_error)
+
+    def test_writes_queue_projection_update(self):
+        user = User.objects.create_user(username='bob', password='Secret123!', nickname='bob')
+        post = ForumPost.objects.create(title='t', content='c', author=user)
+        events.record(ActivityEvent.POST_CREATED, actor=user, post=post)
+        queued = Task.objects.get()
+        self.assertEqual(queued.name, 'projections.update')
+
+        Task.objects.update(run_after=queued.created_at)
+        with override_settings(FORUM_PROJECTION_SETTLE_SECONDS=0):
+            Worker(concurrency=1).run_once()
+        self.assertEqual(PostStats.objects.get(post=post).reply_count, 0)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_MAX_LAG_SECONDS=5)
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+        lag = mock.patch('forum.routers.replica_lag', return_value=0)
+        self.lag = lag.start()
+        self.addCleanup(lag.stop)
+
+    def route_read(self):
+        # TestCase wraps each test in a transaction, step outside it for routing
+        with mock.patch.object(routers.connections['default'], 'in_atomic_block', False):
+            return self.router.db_for_read(ForumPost)
+
+    def test_reads_go_to_replica_writes_to_primary(self):
+        self.assertEqual(self.route_read(), 'replica')
+        self.assertEqual(self.router.db_for_write(ForumPost), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'forum_main'))
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        self.lag.return_value = 30
+        self.assertEqual(self.route_read(), 'default')
+
+    def test_write_pins_following_reads(self):
+        seen = []
+        middleware = routers.ReadYourWritesMiddleware(lambda request: seen.append(self.route_read()) or HttpResponse())
+
+        response = middleware(self.factory.post('/api/main/post/create/'))
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+
+        request = self.factory.get('/api/main/post/')
+        request.COOKIES[routers.PIN_COOKIE] = response[routers.PIN_HEADER]
+        middleware(request)
+        middleware(self.factory.get('/api/main/post/'))
+        self.assertEqual(seen, ['default', 'default', 'replica'])
+
+    def test_lag_probe_uses_activity_log(self):
+        self.assertEqual(routers.measure_lag('default'), 0)
+
+
+@skipUnless('replica' in settings.DATABASES, "needs the replica alias of forum.settings_test")
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_MAX_LAG_SECONDS=5)
+class ReplicaEndToEndTests(TransactionTestCase):
+    # Committed writes, so the replica's own connection can see them. The runner
+    # reads this even for skipped classes, only name the alias where it exists
+    databases = {'default', 'replica'} & set(settings.DATABASES)
+
+    def setUp(self):
+        routers._lag_cache.clear()
+        self.user = User.objects.create_user(username='alice', password='Secret123!', nickname='alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def read_post(self, client, post_id, **extra):
+        """(status, alias the post row was read from)."""
+        aliases = []
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            resp = client.get(reverse('post-get', args=[post_id]), **extra)
+        for alias, ctx in (('default', primary), ('replica', replica)):
+            if any(ForumPost._meta.db_table in q['sql'] for q in ctx.captured_queries):
+                aliases.append(alias)
+        return resp.status_code, aliases
+
+    def test_read_your_writes_across_two_databases(self):
+        resp = self.client.post(reverse('post-create'), {'title': 'hello', 'content': 'world'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        post_id, stamp = resp.data['id'], resp[routers.PIN_HEADER]
+
+        # Same client, pinned by the cookie it was just given
+        self.assertEqual(self.read_post(self.client, post_id), (200, ['default']))
+
+        # Another client without cookies, pinned by the header
+        other = APIClient()
+        self.assertEqual(self.read_post(other, post_id, HTTP_X_FORUM_PIN=stamp), (200, ['default']))
+
+        # Unpinned reads are served by the replica
+        self.assertEqual(self.read_post(other, post_id), (200, ['replica']))
+
+
+@skipUnless(connection.vendor == 'sqlite', "plan parsing checked on SQLite")
+class IndexAdvisorTests(TestCase):
+    def test_reports_scans_and_used_indexes(self):
+        user = User.objects.create_user(username='bob', password='Secret123!', nickname='bob')
+        tables = {ForumPost._meta.db_table, Reply._meta.db_table}
+        collector = QueryCollector(tables)
+        with connection.execute_wrapper(collector):
+            list(ForumPost.objects.filter(author=user).order_by('-created_at'))
+            list(Reply.objects.filter(post_id=1).order_by('created_at'))
+            list(ForumPost.objects.filter(content__contains='spam'))
+
+        report = IndexAdvisor(connection, tables).analyze(collector.queries, collector.counts)
+        unused = {name for _, name in report['unused']}
+        self.assertNotIn('post_author_created_idx', unused)
+        self.assertNotIn('reply_post_created_idx', unused)
+        self.assertEqual(list(report['scans']), [ForumPost._meta.db_table])
+        self.assertEqual(report['sorts'], [])
+
+    def test_parses_sql_server_showplan(self):
+        raw = (
+            '<ShowPlanXML xmlns="http://schemas.microsoft.com/sqlserver/2004/07/showplan"><BatchSequence><Batch>'
+            '<Statements><StmtSimple><QueryPlan>'
+            '<RelOp PhysicalOp="Sort"><Sort><RelOp PhysicalOp="Nested Loops"><NestedLoops>'
+            '<RelOp PhysicalOp="Index Seek"><IndexScan>'
+            '<Object Database="[forum]" Schema="[dbo]" Table="[forum_main_reply]" Index="[reply_post_created_idx]"/>'
+            '</IndexScan></RelOp>'
+            '<RelOp PhysicalOp="Clustered Index Scan"><IndexScan>'
+            '<Object Database="[forum]" Schema="[dbo]" Table="[forum_main_forumpost]" Index="[PK_forum_main_forumpost]"/>'
+            '</IndexScan></RelOp>'
+            '</NestedLoops></RelOp></Sort></RelOp>'
+            '</QueryPlan></StmtSimple></Statements></Batch></BatchSequence></ShowPlanXML>'
+        )
+        self.assertEqual(parse_showplan(raw), {
+            'scans': {'forum_main_forumpost'},
+            'indexes': {'reply_post_created_idx', 'PK_forum_main_forumpost'},
+            'temp_sort': True,
+        })
+
+    def test_unsupported_backend_fails_before_running_tests(self):
+        self.assertIn('microsoft', IndexAdvisor.supported())
+        with mock.patch.object(connection, 'vendor', 'oracle'), \
+                mock.patch('forum_main.management.commands.index_advisor.get_runner') as runner:
+            with self.assertRaisesMessage(CommandError, 'only for microsoft, postgresql, sqlite'):
+                call_command('index_advisor')
+        runner.assert_not_called()
+
+
+class BulkModerationTests(ForumAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.mod = User.objects.create_user(
+            username='mod', password='Secret123!', nickname='mod', is_moderator=True
+        )
+
+    def test_requires_moderator(self):
+        resp = self.client.post(reverse('mod-bulk'), {'action': 'delete', 'posts': [1]}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_bulk_delete_cascades_set_based(self):
+        post_id = self.create_post()
+        parent = self.create_reply(post_id)
+        self.create_reply(post_id, parent_id=parent)
+        self.client.post(reverse('post-upvote', args=[post_id]))
+        self.client.post(reverse('reply-upvote', args=[parent]))
+        other = self.create_post(title='other')
+        doomed = self.create_reply(other)
+        self.create_reply(other, parent_id=doomed)
+        kept = self.create_reply(other)
+
+        self.login(self.mod)
+        resp = self.client.post(reverse('mod-bulk'), {
+            'action': 'delete', 'posts': [post_id], 'replies': [doomed],
+        }, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data, {'posts': 1, 'replies': 1})
+        self.assertFalse(ForumPost.objects.filter(pk=post_id).exists())
+        self.assertTrue(ForumPost.all_objects.filter(pk=post_id).exists())
+
+        with override_settings(PURGE_GRACE_SECONDS=0):
+            self.assertEqual(moderation.purge_deleted(force=True), (1, 2, True))
+        self.assertFalse(ForumPost.all_objects.filter(pk=post_id).exists())
+        self.assertEqual(list(Reply.all_objects.values_list('pk', flat=True)), [kept])
+        self.assertFalse(ForumPost.upvoted_by.through.objects.exists())
+        self.assertFalse(Reply.upvoted_by.through.objects.exists())
+        self.assertEqual(ActivityEvent.objects.filter(kind=ActivityEvent.REPLY_PURGED).count(), 2)
+
+    def test_bulk_hide_removes_from_lists(self):
+        post_id = self.create_post()
+        self.login(self.mod)
+        resp = self.client.post(reverse('mod-bulk'), {'action': 'hide', 'posts': [post_id]}, format='json')
+        self.assertEqual(resp.data['posts'], 1)
+
+        self.assertEqual(self.client.get(reverse('post-list')).data['count'], 0)
+        resp = self.client.get(reverse('post-get', args=[post_id]))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_hidden_content_is_out_of_reach(self):
+        post_id = self.create_post()
+        parent = self.create_reply(post_id, content='spam link')
+        self.create_reply(post_id, parent_id=parent)
+        moderation.hide_posts([post_id], self.mod)
+        moderation.hide_replies([parent], self.mod)
+
+        resp = self.client.post(reverse('post-upvote', args=[post_id]))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.patch(reverse('post-edit', args=[post_id]), {'title': 'back'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.post(reverse('reply-upvote', args=[parent]))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        # A reply under a hidden one doesn't quote it
+        ForumPost.objects.filter(pk=post_id).update(is_hidden=False)
+        resp = self.client.get(reverse('reply-list-by-post', args=[post_id]))
+        self.assertEqual([(r['parent_author'], r['parent_content']) for r in resp.data['results']], [(None, None)])
+
+        self.login(self.mod)
+        resp = self.client.post(reverse('reply-upvote', args=[parent]))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    @override_settings(TASK_QUEUE_EAGER=False)
+    def test_banned_user_cleanup_runs_in_background(self):
+        self.create_post()
+        self.create_post()
+        self.login(self.mod)
+        resp = self.client.post(reverse('mod-bulk'), {
+            'action': 'delete', 'user': self.user.pk, 'ban': True,
+        }, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED)
+
+        Worker(concurrency=1).run_once()
+        self.assertFalse(ForumPost.objects.exists())
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+
+
+class FeedTests(ForumAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.bob = User.objects.create_user(username='bob', password='Secret123!', nickname='bob')
+
+    def follow_alice(self):
+        self.login(self.bob)
+        resp = self.client.post(reverse('follow-user', args=[self.user.pk]))
+        self.assertEqual(resp.data, {'following': True})
+        self.login(self.user)
+
+    def feed(self, user, **params):
+        self.login(user)
+        resp = self.client.get(reverse('feed'), params)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        return resp.data
+
+    def test_fan_out_on_write(self):
+        self.follow_alice()
+        post_id = self.create_post()
+        reply_id = self.create_reply(post_id)
+        run_projections(settle=0)
+
+        self.assertEqual(TimelineEntry.objects.filter(user=self.bob).count(), 2)
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+        data = self.feed(self.bob)
+        self.assertEqual([item['kind'] for item in data['results']], [ActivityEvent.REPLY_CREATED, ActivityEvent.POST_CREATED])
+        self.assertEqual(data['results'][0]['reply']['id'], reply_id)
+        self.assertIsNone(data['next'])
+
+    def test_followed_post_gets_replies(self):
+        post_id = self.create_post()
+        self.login(self.bob)
+        self.assertEqual(self.client.post(reverse('follow-post', args=[post_id])).data, {'following': True})
+        self.login(self.user)
+        self.create_reply(post_id)
+        self.create_post(title='unrelated')
+        run_projections(settle=0)
+
+        data = self.feed(self.bob)
+        self.assertEqual([item['post']['id'] for item in data['results']], [post_id])
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=0)
+    def test_popular_author_is_merged_on_read(self):
+        self.follow_alice()
+        run_projections(settle=0)
+        post_id = self.create_post()
+        run_projections(settle=0)
+
+        self.assertFalse(TimelineEntry.objects.exists())
+        data = self.feed(self.bob)
+        self.assertEqual([item['post']['id'] for item in data['results']], [post_id])
+
+    @override_settings(FEED_MAX_LENGTH=2)
+    def test_timeline_is_trimmed_and_paged(self):
+        self.follow_alice()
+        ids = [self.create_post(title=f'p{n}') for n in range(3)]
+        run_projections(settle=0)
+        self.assertEqual(TimelineEntry.objects.filter(user=self.bob).count(), 2)
+
+        first = self.feed(self.bob, limit=1)
+        self.assertEqual(first['results'][0]['post']['id'], ids[2])
+        second = self.feed(self.bob, limit=1, before=first['next'])
+        self.assertEqual(second['results'][0]['post']['id'], ids[1])
+
+    @override_settings(FEED_MAX_LENGTH=2)
+    def test_trim_is_one_delete_for_many_followers(self):
+        post_id = self.create_post()
+        carol = User.objects.create_user(username='carol', password='Secret123!', nickname='carol')
+        for user in (self.bob, carol):
+            TimelineEntry.objects.bulk_create([
+                TimelineEntry(user=user, event_id=n, kind=ActivityEvent.POST_CREATED, post_id=post_id, created_at=timezone.now())
+                for n in range(1, 6)
+            ])
+
+        with CaptureQueriesContext(connection) as ctx:
+            feeds.trim([self.bob.pk, carol.pk])
+        self.assertEqual(len(ctx.captured_queries), 1)
+        for user in (self.bob, carol):
+            self.assertEqual(list(TimelineEntry.objects.filter(user=user).order_by('event_id').values_list('event_id', flat=True)), [4, 5])
+
+    def test_deleted_posts_drop_out(self):
+        self.follow_alice()
+        post_id = self.create_post()
+        run_projections(settle=0)
+        self.client.delete(reverse('post-delete', args=[post_id]))
+        self.assertEqual(self.feed(self.bob)['results'], [])
+
+
+class NotificationTests(ForumAPITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.bob = User.objects.create_user(username='bob', password='Secret123!', nickname='bob')
+
+    def unread(self):
+        return self.client.get(reverse('notification-unread')).data['unread']
+
+    def test_replies_coalesce_into_one_notification(self):
+        post_id = self.create_post()
+        self.create_reply(post_id, content='my own')
+        self.login(self.bob)
+        self.create_reply(post_id)
+        latest = self.create_reply(post_id)
+        run_projections(settle=0)
+
+        note = Notification.objects.get()
+        self.assertEqual((note.recipient, note.kind, note.count), (self.user, Notification.REPLY_ON_POST, 2))
+        self.assertEqual(note.latest_reply_id, latest)
+        self.assertFalse(Notification.objects.filter(recipient=self.bob).exists())
+
+    def test_reply_to_reply_notifies_parent_author(self):
+        post_id = self.create_post()
+        self.login(self.bob)
+        parent = self.create_reply(post_id)
+        self.login(self.user)
+        self.create_reply(post_id, parent_id=parent)
+        run_projections(settle=0)
+
+        note = Notification.objects.get(recipient=self.bob)
+        self.assertEqual((note.kind, note.parent_id), (Notification.REPLY_ON_REPLY, parent))
+
+    def test_unread_count_is_cached_and_marked_in_bulk(self):
+        post_id = self.create_post()
+        other = self.create_post(title='other')
+        self.login(self.bob)
+        self.create_reply(post_id)
+        self.create_reply(other)
+        run_projections(settle=0)
+
+        self.login(self.user)
+        self.assertEqual(self.unread(), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(notifications.unread_count(self.user.pk), 2)
+
+        first = Notification.objects.order_by('pk').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(reverse('notification-read'), {'ids': [first.pk]}, format='json')
+        self.assertEqual(resp.data, {'marked': 1})
+        self.assertEqual(self.unread(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('notification-read'), {}, format='json')
+        self.assertEqual(self.unread(), 0)
+
+        # A new reply after reading starts a fresh notification and bumps the counter
+        self.login(self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_reply(post_id)
+            run_projections(settle=0)
+        self.login(self.user)
+        self.assertEqual(self.unread(), 1)
+        self.assertEqual(Notification.objects.count(), 3)
+        self.assertEqual(self.client.get(reverse('notification-list')).data['count'], 3)
+
+    def test_replay_resets_unread_counters(self):
+        post_id = self.create_post()
+        self.login(self.bob)
+        self.create_reply(post_id)
+        self.create_reply(post_id, content='again')
+        self.login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            run_projections(settle=0)
+        self.assertEqual(self.unread(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            replay_projections(['notifications'])
+        self.assertEqual(Notification.objects.filter(recipient=self.user, read_at__isnull=True).count(), 1)
+        self.assertEqual(self.unread(), 1)
+
+
+class ReputationTests(ForumAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.bob = User.objects.create_user(username='bob', password='Secret123!', nickname='bob')
+
+    def test_votes_update_reputation_atomically(self):
+        post_id = self.create_post()
+        reply_id = self.create_reply(post_id)
+        self.client.post(reverse('post-upvote', args=[post_id]))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.reputation, 0)
+
+        self.login(self.bob)
+        self.client.post(reverse('post-upvote', args=[post_id]))
+        self.client.post(reverse('reply-upvote', args=[reply_id]))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.reputation, 2)
+
+        self.client.post(reverse('reply-upvote', args=[reply_id]))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.reputation, 1)
+
+    def test_reconcile_fixes_drift(self):
+        post_id = self.create_post()
+        self.login(self.bob)
+        self.client.post(reverse('post-upvote', args=[post_id]))
+        User.objects.filter(pk=self.user.pk).update(reputation=40)
+        User.objects.filter(pk=self.bob.pk).update(reputation=-3)
+
+        self.assertEqual(reputation.reconcile(batch_size=1), 2)
+        self.assertEqual(reputation.reconcile(batch_size=1), 0)
+        self.assertEqual(
+            dict(User.objects.values_list('username', 'reputation')),
+            {'alice': 1, 'bob': 0},
+        )
+
+    def test_leaderboard_orders_by_reputation(self):
+        User.objects.filter(pk=self.bob.pk).update(reputation=7)
+        resp = self.client.get(reverse('user-leaderboard'))
+        self.assertEqual([u['username'] for u in resp.data['results']], ['bob', 'alice'])
+        self.assertEqual(resp.data['results'][0]['reputation'], 7)
+
+
+class RevisionTests(ForumAPITestCase):
+    def edit(self, post_id, content, title='hello'):
+        resp = self.client.put(reverse('post-edit', args=[post_id]), {'title': title, 'content': content}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_delta_roundtrip(self):
+        old = 'one\ntwo\nthree\n' * 50
+        new = old.replace('two\nthree\none', 'two\n3\none', 1) + 'tail'
+        delta = revisions.make_delta(old, new)
+        self.assertEqual(revisions.apply_delta(old, delta), new)
+        self.assertLess(sum(len(text) for _, _, text in delta), 20)
+        with self.assertRaises(ValueError):
+            revisions.apply_delta('short', [[3, 1, 'x']])
+
+    @override_settings(REVISION_SNAPSHOT_EVERY=3)
+    def test_edits_store_deltas_and_snapshots(self):
+        post_id = self.create_post(content='v1')
+        texts = ['v1']
+        for n in range(2, 8):
+            texts.append(texts[-1] + f'\nline {n}')
+            self.edit(post_id, texts[-1], title=f't{n}')
+
+        stored = list(Revision.objects.filter(post_id=post_id).order_by('number').values_list('number', 'snapshot'))
+        self.assertEqual([n for n, snap in stored if snap is not None], [1, 4, 7])
+
+        for number in range(1, 8):
+            resp = self.client.get(reverse('post-revision', args=[post_id, number]))
+            self.assertEqual(resp.data['content'], texts[number - 1])
+            self.assertLess(resp.data['applied_deltas'], 3)
+        self.assertEqual(resp.data['title'], 't7')
+        self.assertEqual(self.client.get(reverse('post-revisions', args=[post_id])).data['count'], 7)
+        resp = self.client.get(reverse('post-revision', args=[post_id, 8]))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_reply_history(self):
+        post_id = self.create_post()
+        reply_id = self.create_reply(post_id, content='first')
+        self.client.put(reverse('reply-edit', args=[reply_id]), {'content': 'second'}, format='json')
+        resp = self.client.get(reverse('reply-revision', args=[reply_id, 1]))
+        self.assertEqual(resp.data['content'], 'first')
+
+    def test_history_is_for_author_and_moderators(self):
+        post_id = self.create_post(content='v1')
+        self.edit(post_id, 'v2')
+        urls = [reverse('post-revisions', args=[post_id]), reverse('post-revision', args=[post_id, 1])]
+        bob = User.objects.create_user(username='bob', password='Secret123!', nickname='bob')
+        mod = User.objects.create_user(username='mod', password='Secret123!', nickname='mod', is_moderator=True)
+
+        self.login(bob)
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.credentials()
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.login(mod)
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+    def test_draft_autosave_with_patches(self):
+        resp = self.client.post(reverse('draft-list'), {'title': 'wip', 'content': 'hello world'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        url = reverse('draft-detail', args=[resp.data['id']])
+
+        resp = self.client.patch(url, {'version': 1, 'patch': [[6, 11, 'there'], [11, 11, '!']]}, format='json')
+        self.assertEqual(resp.data, {'version': 2})
+        self.assertEqual(Draft.objects.get().content, 'hello there!')
+
+        # Stale base version
+        resp = self.client.patch(url, {'version': 1, 'patch': [[0, 0, 'x']]}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(resp.data['content'], 'hello there!')
+        resp = self.client.patch(url, {'version': 2, 'patch': [[0, 99, 'x']]}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_draft_of_someone_elses_post_is_refused(self):
+        post_id = self.create_post()
+        bob = User.objects.create_user(username='bob', password='Secret123!', nickname='bob')
+        self.login(bob)
+        resp = self.client.post(reverse('draft-list'), {'post': post_id, 'content': 'x'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TransferTests(ForumAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.post_id = self.create_post()
+        self.parent_id = self.create_reply(self.post_id)
+        self.create_reply(self.post_id, parent_id=self.parent_id)
+        self.client.post(reverse('post-upvote', args=[self.post_id]))
+        self.client.post(reverse('reply-upvote', args=[self.parent_id]))
+        fd, self.path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def export(self):
+        call_command('export_forum', self.path, stderr=StringIO())
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_export_streams_every_kind(self):
+        rows = self.export()
+        self.assertEqual(
+            [r['type'] for r in rows],
+            ['user', 'post', 'reply', 'reply', 'post_vote', 'reply_vote'],
+        )
+        self.assertEqual(rows[3]['parent'], self.parent_id)
+
+    def test_import_remaps_ids(self):
+        self.export()
+        call_command('import_forum', self.path, source='copy', batch_size=1, merge_users=True, stdout=StringIO())
+
+        self.assertEqual(User.objects.count(), 1)
+        copy = ForumPost.objects.exclude(pk=self.post_id).get()
+        self.assertEqual(Reply.objects.filter(post=copy).count(), 2)
+        child = Reply.objects.filter(post=copy, parent__isnull=False).get()
+        self.assertEqual(child.parent.post_id, copy.pk)
+        self.assertEqual(child.path, f'{child.parent_id}/')
+        self.assertEqual(copy.upvoted_by.count(), 1)
+        self.assertEqual(child.parent.upvoted_by.count(), 1)
+        run_projections(settle=0)
+        self.assertEqual(PostStats.objects.get(post=copy).reply_count, 2)
+        self.assertEqual(PostStats.objects.get(post=copy).upvotes, 1)
+
+    def test_import_keeps_clashing_usernames_apart(self):
+        rows = self.export()
+        call_command('import_forum', self.path, source='copy', stdout=StringIO())
+
+        other = User.objects.exclude(pk=self.user.pk).get()
+        self.assertEqual(other.username, f'alice_{rows[0]["id"]}')
+        self.assertFalse(ForumPost.objects.filter(author=self.user).exclude(pk=self.post_id).exists())
+
+        # Creation events are backdated to the imported rows and survive a replay
+        copy = ForumPost.objects.get(author=other)
+        event = ActivityEvent.objects.get(kind=ActivityEvent.POST_CREATED, post_id=copy.pk)
+        self.assertEqual((event.actor_id, event.created_at), (other.pk, copy.created_at))
+        replay_projections(['post_stats', 'user_stats'])
+        self.assertEqual(PostStats.objects.get(post=copy).reply_count, 2)
+        self.assertEqual((other.stats.post_count, other.stats.reply_count), (1, 2))
+
+    def test_import_resumes_from_checkpoint(self):
+        rows = self.export()
+        rows[0].update(username='carol', id=999)
+        for r in rows[1:]:
+            for key in ('author', 'user'):
+                if r.get(key) == self.user.pk:
+                    r[key] = 999
+        lines = [json.dumps(r) for r in rows]
+        broken = lines[:3] + ['{"type": "reply", "broken": true}'] + lines[4:]
+        with open(self.path, 'w') as f:
+            f.write('\n'.join(broken))
+        with self.assertRaises(CommandError):
+            call_command('import_forum', self.path, source='resume', batch_size=1, stdout=StringIO())
+        self.assertEqual(ForumPost.objects.count(), 2)
+
+        with open(self.path, 'w') as f:
+            f.write('\n'.join(lines))
+        out = StringIO()
+        call_command('import_forum', self.path, source='resume', batch_size=1, stdout=out)
+        self.assertIn('Resuming resume after line 3', out.getvalue())
+
+        carol = User.objects.get(username='carol')
+        self.assertEqual(carol.nickname, 'alice_999')
+        self.assertEqual(carol.username_folded, 'carol')
+        self.assertEqual(ForumPost.objects.filter(author=carol).count(), 1)
+        self.assertEqual(Reply.objects.filter(author=carol).count(), 2)
+        self.assertEqual(Reply.objects.filter(author=carol, parent__author=carol).count(), 1)
+
+
+class StatsTests(ForumAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.bob = User.objects.create_user(username='bob', password='Secret123!', nickname='bob')
+
+    def test_stats_from_rollups(self):
+        busy = self.create_post()
+        quiet = self.create_post(title='quiet')
+        self.create_reply(busy)
+        self.login(self.bob)
+        self.client.post(reverse('post-upvote', args=[busy]))
+        run_projections(settle=0)
+
+        resp = self.client.get(reverse('stats'), {'window': '1h'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data['resolution'], StatBucket.MINUTE)
+        self.assertEqual(resp.data['totals'], {'posts': 2, 'replies': 1, 'votes': 1, 'active_users': 2})
+        self.assertEqual(sum(point['posts'] for point in resp.data['series']), 2)
+
+        resp = self.client.get(reverse('stats-trending'), {'window': '24h'})
+        self.assertEqual([(r['post']['id'], r['score']) for r in resp.data['results']], [(busy, 2)])
+        self.assertNotIn(quiet, [r['post']['id'] for r in resp.data['results']])
+
+        self.assertEqual(self.client.get(reverse('stats'), {'window': '30d', 'resolution': 'minute'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_taking_a_vote_back_uncounts_it(self):
+        post_id = self.create_post()
+        self.login(self.bob)
+        self.client.post(reverse('post-upvote', args=[post_id]))
+        run_projections(settle=0)
+        self.client.post(reverse('post-upvote', args=[post_id]))
+        run_projections(settle=0)
+
+        self.assertEqual(self.client.get(reverse('stats'), {'window': '1h'}).data['totals']['votes'], 0)
+        resp = self.client.get(reverse('stats-trending'), {'window': '24h'})
+        self.assertEqual(resp.data['results'], [])
+
+    def test_compaction_keeps_totals(self):
+        now = timezone.now()
+        post = ForumPost.objects.create(author=self.user, title='old', content='x')
+        for age in (timedelta(minutes=5), timedelta(hours=3), timedelta(hours=3, minutes=1), timedelta(days=9)):
+            ActivityEvent.objects.create(kind=ActivityEvent.POST_CREATED, actor_id=self.user.pk,
+                                         post_id=post.pk, created_at=now - age)
+        run_projections(settle=0)
+        before = rollups.totals(now - timedelta(days=30))
+        self.assertEqual(StatBucket.objects.filter(metric=rollups.POSTS, resolution=StatBucket.MINUTE).count(), 4)
+
+        self.assertGreater(rollups.compact(now=now), 0)
+        self.assertEqual(rollups.totals(now - timedelta(days=30)), before)
+        resolutions = dict(
+            StatBucket.objects.filter(metric=rollups.POSTS).values('resolution')
+            .annotate(n=Sum('value')).values_list('resolution', 'n')
+        )
+        self.assertEqual(resolutions, {StatBucket.MINUTE: 1, StatBucket.HOUR: 2, StatBucket.DAY: 1})
+        # Nothing left to fold
+        self.assertEqual(rollups.compact(now=now), 0)
+
+        series = rollups.series(now - timedelta(days=30), StatBucket.DAY)
+        self.assertEqual(sum(point['posts'] for point in series), 4)
+        self.assertEqual(len(series), 31)
+
+
+class SpamTests(ForumAPITestCase):
+    TEXT = "Buy cheap watches today at the best price, visit our shop for amazing discounts"
+
+    def setUp(self):
+        super().setUp()
+        self.bot = User.objects.create_user(username='bot', password='Secret123!', nickname='bot')
+        self.mod = User.objects.create_user(username='mod', password='Secret123!', nickname='mod', is_moderator=True)
+
+    def post_as(self, user, content, title='deal'):
+        self.login(user)
+        resp = self.client.post(reverse('post-create'), {'title': title, 'content': content}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        return resp.data
+
+    def test_minhash_similarity(self):
+        words = spam.WORD.findall(self.TEXT.lower())
+        value = spam.minhash(words)
+        self.assertEqual(value, spam.minhash(reversed(words)))
+        self.assertGreaterEqual(spam.similarity(value, spam.minhash(words + ['now'])), 0.7)
+        other = spam.minhash("completely unrelated thoughts about the weather in spring and rain".split())
+        self.assertLess(spam.similarity(value, other), 0.3)
+        self.assertEqual(len(spam.band_keys(value)), spam.BANDS)
+
+    def test_near_duplicates_are_held(self):
+        first = self.post_as(self.bot, self.TEXT)
+        self.assertFalse(first['held'])
+        second = self.post_as(self.bot, self.TEXT.upper() + "!!")
+        self.assertTrue(second['held'])
+        self.assertTrue(ForumPost.objects.get(pk=second['id']).is_hidden)
+        # Short replies like "me too" are never judged
+        self.create_reply(first['id'])
+        self.create_reply(first['id'])
+        self.assertEqual(ContentSignature.objects.count(), 2)
+
+        self.login(self.mod)
+        queue = self.client.get(reverse('mod-held')).data['results']
+        self.assertEqual([item['post'] for item in queue], [second['id']])
+        resp = self.client.post(reverse('mod-held-decision', args=[queue[0]['id']]), {'action': 'approve'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertFalse(ForumPost.objects.get(pk=second['id']).is_hidden)
+        self.assertTrue(ActivityEvent.objects.filter(kind=ActivityEvent.POST_APPROVED, post_id=second['id']).exists())
+        # Already decided
+        resp = self.client.post(reverse('mod-held-decision', args=[queue[0]['id']]), {'action': 'reject'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rejected_reply_is_deleted(self):
+        post_id = self.create_post()
+        self.create_reply(post_id, content=self.TEXT)
+        self.login(self.bot)
+        resp = self.client.post(reverse('reply-create', args=[post_id]), {'content': self.TEXT}, format='json')
+        self.assertTrue(resp.data['held'])
+        signature = ContentSignature.objects.get(held=True)
+        self.assertEqual(signature.reply_id, resp.data['id'])
+
+        self.login(self.mod)
+        self.client.post(reverse('mod-held-decision', args=[signature.pk]), {'action': 'reject'}, format='json')
+        self.assertFalse(Reply.objects.filter(pk=resp.data['id']).exists())
+        self.assertTrue(Reply.all_objects.filter(pk=resp.data['id'], deleted_at__isnull=False).exists())
+
+    def test_users_cannot_moderate(self):
+        self.assertEqual(self.client.get(reverse('mod-held')).status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(SPAM_WINDOW=3600)
+    def test_prune_forgets_signatures_outside_the_window(self):
+        self.post_as(self.bot, self.TEXT)
+        held = self.post_as(self.bot, self.TEXT)
+        recent = self.post_as(self.bot, "An entirely different message about gardening, tomatoes and summer rain")
+        self.assertTrue(held['held'])
+        ContentSignature.objects.exclude(post_id=recent['id']).update(created_at=timezone.now() - timedelta(hours=2))
+
+        self.assertEqual(spam.prune(batch_size=1), 1)
+        # The held one waits for a moderator, without its bands
+        self.assertEqual(
+            sorted(ContentSignature.objects.values_list('post_id', 'held')),
+            sorted([(held['id'], True), (recent['id'], False)]),
+        )
+        self.assertEqual(set(ContentBand.objects.values_list('signature__post_id', flat=True)), {recent['id']})
+        self.assertEqual(spam.prune(), 0)
+
+
+class RelatedPostsTests(ForumAPITestCase):
+    def test_post_page_reads_stored_list(self):
+        post_id = self.create_post()
+        other = self.create_post(title='other')
+        hidden = ForumPost.objects.create(author=self.user, title='hidden', content='x', is_hidden=True)
+        RelatedPosts.objects.create(post_id=post_id, related=[[hidden.pk, 0.9], [other, 0.5]])
+
+        resp = self.client.get(reverse('post-get', args=[post_id]))
+        self.assertEqual(resp.data['related'], [{'id': other, 'title': 'other', 'score': 0.5}])
+        self.assertEqual(self.client.get(reverse('post-get', args=[other])).data['related'], [])
+
+    @skipUnless(related.available(), "numpy/scipy are not installed")
+    def test_build_and_refresh(self):
+        migrations = self.create_post('Django migrations fail', 'My django migrations fail on the users table after renaming a model')
+        similar = self.create_post('Renaming a django model', 'Renaming a model breaks django migrations, the table rename fails')
+        cooking = self.create_post('Pasta recipe', 'Boil salted water and cook the pasta for eight minutes')
+        self.assertEqual(related.build(), 3)
+        self.assertEqual(RelatedPosts.objects.get(post_id=migrations).related[0][0], similar)
+        self.assertNotIn(cooking, [pk for pk, _ in RelatedPosts.objects.get(post_id=migrations).related])
+
+        newer = self.create_post('Django migrations and renamed models', 'Django migrations fail when a model is renamed, the table rename fails')
+        # Works from the stored index, the corpus is not read again
+        with mock.patch.object(related, 'matrix', side_effect=AssertionError):
+            self.assertEqual(related.refresh(), 1)
+            self.assertEqual(related.refresh(), 0)
+        self.assertIn(migrations, [pk for pk, _ in RelatedPosts.objects.get(post_id=newer).related])
+        self.assertIn(newer, [pk for pk, _ in RelatedPosts.objects.get(post_id=similar).related])
+        scores = [score for _, score in RelatedPosts.objects.get(post_id=similar).related]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+        # Edited into something unrelated, it has to leave everyone else's list
+        resp = self.client.put(reverse('post-edit', args=[similar]), {
+            'title': 'Pasta recipe', 'content': 'Boil salted water, cook pasta with garlic',
+        }, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        related.refresh()
+        for pk in (migrations, newer):
+            self.assertNotIn(similar, [other for other, _ in RelatedPosts.objects.get(post_id=pk).related])
+        self.assertEqual(RelatedPosts.objects.get(post_id=similar).related[0][0], cooking)
+        self.assertIn(similar, [other for other, _ in RelatedPosts.objects.get(post_id=cooking).related])
+        self.assertEqual(
+            set(RelatedBacklink.objects.filter(post_id=similar).values_list('holder_id', flat=True)),
+            {pk for pk, items in RelatedPosts.objects.values_list('post_id', 'related') if similar in [p for p, _ in items]},
+        )
+
+        moderation.hide_posts([cooking], self.user)
+        related.refresh()
+        self.assertFalse(RelatedPosts.objects.filter(post_id=cooking).exists())
+        self.assertNotIn(cooking, [other for other, _ in RelatedPosts.objects.get(post_id=similar).related])
+        self.assertFalse(RelatedPosting.objects.filter(post_id=cooking).exists())
+
+
+class StartupTests(TestCase):
+    def test_parse_importtime(self):
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |     django.utils.version\n"
+            "import time:       300 |        420 |   django\n"
+            "import time:        50 |        470 | forum.settings\n"
+        )
+        rows = parse_importtime(output)
+        self.assertEqual(rows[0], ('django.utils.version', 120, 120, 2))
+        self.assertEqual(by_package(rows), [('django', 420), ('forum', 50)])
+
+    def test_mongo_is_imported_lazily(self):
+        proc = subprocess.run(
+            [sys.executable, '-c', "import sys, django; django.setup(); import forum_main.views; print('pymongo' in sys.modules)"],
+            capture_output=True, text=True, env=dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p)),
+        )
+        self.assertEqual(proc.stdout.strip(), 'False', proc.stderr)
+
+    def production_settings(self, **environ):
+        environ = {'SECRET_KEY': 'prod-secret', 'ALLOWED_HOSTS': 'forum.example.com', **environ}
+        # settings.py's CACHES is already built, stand in a shared backend
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache:6379/0'}}
+        caches = environ.pop('caches', shared)
+        sys.modules.pop('forum.settings_production', None)
+        with mock.patch.dict(os.environ, {k: v for k, v in environ.items() if v is not None}):
+            for name in [k for k, v in environ.items() if v is None]:
+                os.environ.pop(name, None)
+            with mock.patch('forum.settings.CACHES', caches):
+                return importlib.import_module('forum.settings_production')
+
+    def test_production_profile_drops_unused_apps(self):
+        prod = self.production_settings()
+        self.assertNotIn('django.contrib.admin', prod.INSTALLED_APPS)
+        self.assertIn('forum_main', prod.INSTALLED_APPS)
+        self.assertEqual(prod.REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'], ('rest_framework.renderers.JSONRenderer',))
+        self.assertFalse(prod.DEBUG)
+        self.assertEqual(prod.SECRET_KEY, 'prod-secret')
+        self.assertEqual(prod.ALLOWED_HOSTS, ['forum.example.com'])
+
+    def test_production_profile_requires_secrets(self):
+        for missing in ('SECRET_KEY', 'ALLOWED_HOSTS'):
+            with self.subTest(missing=missing), self.assertRaises(ImproperlyConfigured):
+                self.production_settings(**{missing: None})
+
+    def test_production_profile_refuses_local_blacklist_cache(self):
+        local = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with self.assertRaisesMessage(ImproperlyConfigured, 'JWT_BLACKLIST_CACHE'):
+            self.production_settings(caches=local)
+        self.assertTrue(self.production_settings(caches=local, DEBUG='true').DEBUG)
+
+    def test_production_profile_refuses_local_default_cache(self):
+        # Blacklist on its own shared cache, notification counters still need the default one shared
+        redis = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache:6379/1'}
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}, 'tokens': redis}
+        with mock.patch('forum.settings.JWT_BLACKLIST_CACHE', 'tokens'):
+            with self.assertRaisesMessage(ImproperlyConfigured, "The 'default' cache must be a shared cache"):
+                self.production_settings(caches=caches)
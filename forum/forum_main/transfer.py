@@ -0,0 +1,220 @@
+import json
+from itertools import groupby
+
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from . import events
+from .models import ActivityEvent, ForumPost, ImportCheckpoint, ImportMapping, Reply, reply_path
+
+User = get_user_model()
+
+#JSONL export/import of users, posts, replies and upvotes.
+#One object per line with a "type" key, in dependency order (users, posts,
+#replies by id so parents come first, then votes). Export streams rows with
+#chunked server-side iteration. Import bulk_creates batches of consecutive
+#lines; each batch commits together with its old->new id mappings and the
+#checkpoint, so an interrupted import resumes at the first uncommitted line.
+
+USER_FIELDS = (
+    'id', 'username', 'password', 'nickname', 'email', 'first_name', 'last_name',
+    'bio', 'avatar', 'reputation', 'is_active', 'is_moderator', 'date_joined',
+)
+POST_FIELDS = ('id', 'author_id', 'title', 'content', 'created_at', 'is_hidden')
+REPLY_FIELDS = ('id', 'post_id', 'author_id', 'parent_id', 'content', 'created_at', 'is_hidden')
+
+def _rows(queryset, fields, kind, chunk_size, rename=None):
+    rename = rename or {}
+    for row in queryset.order_by('pk').values(*fields).iterator(chunk_size=chunk_size):
+        row = {rename.get(k, k.removesuffix('_id') if k != 'id' else k): v for k, v in row.items()}
+        row['type'] = kind
+        yield row
+
+def export_rows(chunk_size=2000):
+    """Every exported object, in import order. Soft deleted content is left out."""
+    yield from _rows(User.objects.all(), USER_FIELDS, 'user', chunk_size)
+    yield from _rows(ForumPost.objects.all(), POST_FIELDS, 'post', chunk_size)
+    yield from _rows(Reply.objects.all(), REPLY_FIELDS, 'reply', chunk_size)
+    yield from _rows(
+        ForumPost.upvoted_by.through.objects.filter(forumpost__deleted_at__isnull=True),
+        ('forumpost_id', 'user_id'), 'post_vote', chunk_size, rename={'forumpost_id': 'post'},
+    )
+    yield from _rows(
+        Reply.upvoted_by.through.objects.filter(reply__in=Reply.objects.values('pk')),
+        ('reply_id', 'user_id'), 'reply_vote', chunk_size,
+    )
+
+def export_jsonl(stream, chunk_size=2000):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    count = 0
+    for row in export_rows(chunk_size):
+        stream.write(encoder.encode(row))
+        stream.write('\n')
+        count += 1
+    return count
+
+
+class Importer:
+    def __init__(self, source, batch_size=1000, merge_users=False):
+        if not connection.features.can_return_rows_from_bulk_insert:
+            raise RuntimeError(f"The {connection.vendor} backend can't return ids from bulk inserts")
+        self.source = source
+        self.batch_size = batch_size
+        self.merge_users = merge_users
+        self.counts = {}
+
+    def position(self):
+        return ImportCheckpoint.objects.filter(source=self.source).values_list('position', flat=True).first() or 0
+
+    def run(self, lines):
+        """Import an iterable of JSONL lines, skipping the ones a previous run committed."""
+        start = self.position()
+        numbered = ((n, line) for n, line in enumerate(lines, 1) if n > start and line.strip())
+        for kind, group in groupby(((n, json.loads(line)) for n, line in numbered), key=lambda item: item[1]['type']):
+            handler = getattr(self, f'import_{kind}', None)
+            if handler is None:
+                raise ValueError(f"Unknown object type {kind!r}")
+            batch = []
+            for item in group:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    self.commit(kind, handler, batch)
+                    batch = []
+            if batch:
+                self.commit(kind, handler, batch)
+        return self.counts
+
+    def commit(self, kind, handler, batch):
+        with transaction.atomic():
+            done = handler([row for _, row in batch])
+            ImportCheckpoint.objects.update_or_create(source=self.source, defaults={'position': batch[-1][0]})
+        self.counts[kind] = self.counts.get(kind, 0) + done
+
+    def lookup(self, kind, old_ids):
+        old_ids = {i for i in old_ids if i is not None}
+        if not old_ids:
+            return {}
+        return dict(
+            ImportMapping.objects.filter(source=self.source, kind=kind, old_id__in=old_ids)
+            .values_list('old_id', 'new_id')
+        )
+
+    def remember(self, kind, pairs):
+        # One row per imported object, plain executemany skips model and SQL compiler overhead
+        qn = connection.ops.quote_name
+        sql = 'INSERT INTO {} ({}, {}, {}, {}) VALUES (%s, %s, %s, %s)'.format(
+            qn(ImportMapping._meta.db_table), qn('source'), qn('kind'), qn('old_id'), qn('new_id'),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [(self.source, kind, old, new) for old, new in pairs])
+
+    def import_user(self, rows):
+        # A username that already exists is someone else unless merge_users says
+        # otherwise, clashing usernames and nicknames get the old id appended
+        existing = dict(
+            User.objects.filter(username__in=[r['username'] for r in rows]).values_list('username', 'pk')
+        )
+        taken = set(
+            User.objects.filter(nickname__in=[r['nickname'] for r in rows]).values_list('nickname', flat=True)
+        )
+        fresh, pairs = [], []
+        for r in rows:
+            if r['username'] in existing and self.merge_users:
+                pairs.append((r['id'], existing[r['username']]))
+                continue
+            username = r['username'] if r['username'] not in existing else f"{r['username'][:130]}_{r['id']}"
+            nickname = r['nickname'] if r['nickname'] not in taken else f"{r['nickname'][:20]}_{r['id']}"
+            user = User(
+                username=username, password=r['password'], nickname=nickname,
+                email=r.get('email') or '', first_name=r.get('first_name') or '',
+                last_name=r.get('last_name') or '', bio=r.get('bio') or '',
+                avatar=r.get('avatar') or 'avatar/default.png', reputation=r.get('reputation') or 0,
+                is_active=r.get('is_active', True), is_moderator=r.get('is_moderator', False),
+                date_joined=parse_datetime(r['date_joined']),
+            )
+            # bulk_create skips save()
+            user.fold_names()
+            fresh.append((r['id'], user))
+        User.objects.bulk_create([user for _, user in fresh], batch_size=self.batch_size)
+        pairs += [(old, user.pk) for old, user in fresh]
+        self.remember('user', pairs)
+        return len(fresh)
+
+    def import_post(self, rows):
+        authors = self.lookup('user', [r['author'] for r in rows])
+        fresh = [
+            (r['id'], ForumPost(
+                author_id=authors[r['author']], title=r['title'], content=r['content'],
+                created_at=parse_datetime(r['created_at']), is_hidden=r.get('is_hidden', False),
+            ))
+            for r in rows if r['author'] in authors
+        ]
+        ForumPost.objects.bulk_create([post for _, post in fresh], batch_size=self.batch_size)
+        events.record_many(ActivityEvent.POST_CREATED, None, [
+            (post.pk, None, {}, post.author_id, post.created_at) for _, post in fresh
+        ], batch_size=self.batch_size)
+        self.remember('post', [(old, post.pk) for old, post in fresh])
+        return len(fresh)
+
+    def import_reply(self, rows):
+        authors = self.lookup('user', [r['author'] for r in rows])
+        posts = self.lookup('post', [r['post'] for r in rows])
+        parents = self.lookup('reply', [r['parent'] for r in rows])
+        # bulk_create skips Reply.save(), which is what fills in `path`
+        paths = dict(Reply.all_objects.filter(pk__in=parents.values()).values_list('pk', 'path'))
+        fresh = []
+        for r in rows:
+            if r['author'] not in authors or r['post'] not in posts:
+                continue
+            reply = Reply(
+                post_id=posts[r['post']], author_id=authors[r['author']], content=r['content'],
+                parent_id=parents.get(r['parent']),
+                created_at=parse_datetime(r['created_at']), is_hidden=r.get('is_hidden', False),
+            )
+            if reply.parent_id in paths:
+                reply.path = f'{paths[reply.parent_id]}{reply.parent_id}/'
+            fresh.append((r['id'], r['parent'], reply))
+        Reply.objects.bulk_create([reply for _, _, reply in fresh], batch_size=self.batch_size)
+
+        # Parents inside this same batch only got their ids just now, rows come
+        # in id order so a parent is always handled before its replies
+        local = {old: reply for old, _, reply in fresh}
+        late = []
+        for _, parent, reply in fresh:
+            if parent is not None and reply.parent_id is None and parent in local:
+                reply.parent_id = local[parent].pk
+                reply.path = reply_path(local[parent])
+                late.append(reply)
+        Reply.objects.bulk_update(late, ['parent', 'path'], batch_size=self.batch_size)
+        events.record_many(ActivityEvent.REPLY_CREATED, None, [
+            (reply.post_id, reply.pk, {'parent': reply.parent_id}, reply.author_id, reply.created_at)
+            for reply in local.values()
+        ], batch_size=self.batch_size)
+        self.remember('reply', [(old, reply.pk) for old, reply in local.items()])
+        return len(fresh)
+
+    def _import_votes(self, rows, through, kind, column):
+        users = self.lookup('user', [r['user'] for r in rows])
+        targets = self.lookup(kind, [r[kind] for r in rows])
+        edges = [
+            through(**{column: targets[r[kind]], 'user_id': users[r['user']]})
+            for r in rows if r[kind] in targets and r['user'] in users
+        ]
+        through.objects.bulk_create(edges, batch_size=self.batch_size, ignore_conflicts=True)
+        return edges
+
+    def import_post_vote(self, rows):
+        edges = self._import_votes(rows, ForumPost.upvoted_by.through, 'post', 'forumpost_id')
+        # One event per post brings its upvote count up to date. Without an
+        # `upvoted` flag the rollups don't count them as votes cast now
+        events.record_many(ActivityEvent.POST_VOTED, None, [
+            (post_id, None, {}) for post_id in sorted({edge.forumpost_id for edge in edges})
+        ], batch_size=self.batch_size)
+        return len(edges)
+
+    def import_reply_vote(self, rows):
+        # No read model counts reply votes, the imported reputation already has them
+        return len(self._import_votes(rows, Reply.upvoted_by.through, 'reply', 'reply_id'))
+
@@ -14,7 +14,24 @@ from .views import (
     SortedPostListView,
     PostSearchView,
     CurrentUserPostView,
-    PostByUserView
+    PostByUserView,
+    BulkModerationView,
+    FollowAuthorView,
+    FollowPostView,
+    FeedView,
+    NotificationListView,
+    NotificationUnreadCountView,
+    NotificationMarkReadView,
+    PostRevisionListView,
+    ReplyRevisionListView,
+    PostRevisionView,
+    ReplyRevisionView,
+    DraftListCreateView,
+    DraftDetailView,
+    StatsView,
+    TrendingView,
+    HeldContentListView,
+    HeldContentDecisionView
 )
 
 urlpatterns = [
@@ -33,5 +50,22 @@ urlpatterns = [
     path('post/sorted/', SortedPostListView.as_view(), name='post-list-sorted'),
     path('post/search/', PostSearchView.as_view(), name='post-search'),
     path('post/user/current/', CurrentUserPostView.as_view(), name='get-current-user-post'),
-    path('post/user/<int:user_id>/', PostByUserView.as_view(), name='get-user-post')
+    path('post/user/<int:user_id>/', PostByUserView.as_view(), name='get-user-post'),
+    path('mod/bulk/', BulkModerationView.as_view(), name='mod-bulk'),
+    path('follow/user/<int:user_id>/', FollowAuthorView.as_view(), name='follow-user'),
+    path('follow/post/<int:pk>/', FollowPostView.as_view(), name='follow-post'),
+    path('feed/', FeedView.as_view(), name='feed'),
+    path('notifications/', NotificationListView.as_view(), name='notification-list'),
+    path('notifications/unread/', NotificationUnreadCountView.as_view(), name='notification-unread'),
+    path('notifications/read/', NotificationMarkReadView.as_view(), name='notification-read'),
+    path('post/<int:pk>/revisions/', PostRevisionListView.as_view(), name='post-revisions'),
+    path('post/<int:pk>/revisions/<int:number>/', PostRevisionView.as_view(), name='post-revision'),
+    path('post/reply/<int:pk>/revisions/', ReplyRevisionListView.as_view(), name='reply-revisions'),
+    path('post/reply/<int:pk>/revisions/<int:number>/', ReplyRevisionView.as_view(), name='reply-revision'),
+    path('drafts/', DraftListCreateView.as_view(), name='draft-list'),
+    path('drafts/<int:pk>/', DraftDetailView.as_view(), name='draft-detail'),
+    path('stats/', StatsView.as_view(), name='stats'),
+    path('stats/trending/', TrendingView.as_view(), name='stats-trending'),
+    path('mod/held/', HeldContentListView.as_view(), name='mod-held'),
+    path('mod/held/<int:pk>/', HeldContentDecisionView.as_view(), name='mod-held-decision')
 ]
\ No newline at end of file
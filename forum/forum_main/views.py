@@ -1,24 +1,54 @@
-from django.db.models import Count, Max
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Count, F, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 from rest_framework import generics, permissions, status, filters
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from .models import ForumPost, Reply
-from .serializers import PostSerializer, ReplySerializer
-from .permissions import IsAuthorOrMod, IsAuthenticatedAndActive
+from .models import ActivityEvent, ContentSignature, Draft, ForumPost, Notification, Reply, StatBucket
+from . import events, feeds, moderation, notifications, readmodels, related, reputation, revisions, rollups, spam
+from .queue import enqueue
+from .serializers import (
+    BulkModerationSerializer, DraftPatchSerializer, DraftSerializer, FeedItemSerializer,
+    HeldContentSerializer, HeldDecisionSerializer, MarkReadSerializer, NotificationSerializer, PostSerializer, ReplySerializer, RevisionSerializer,
+    StatsQuerySerializer,
+)
+from .permissions import IsAuthorOrMod, IsAuthorOrModToRead, IsAuthenticatedAndActive, IsModerator
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from django.shortcuts    import get_object_or_404
+from django.http import Http404
 
 User = get_user_model()
 
+def visible_to(queryset, user):
+    # Hidden posts and replies can only be reached by moderators
+    if getattr(user, 'is_moderator', False):
+        return queryset
+    return queryset.filter(is_hidden=False)
+
 class PostCreateView(generics.CreateAPIView):
     queryset = ForumPost.objects.all()
     serializer_class = PostSerializer
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticatedAndActive]
 
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.data['held'] = self.held
+        return response
+
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        data = serializer.validated_data
+        # Near duplicates of recent content are created hidden, for a moderator to review
+        signature = spam.check(self.request.user, f"{data['title']}\n{data['content']}")
+        self.held = bool(signature and signature.held)
+        post = serializer.save(author=self.request.user, is_hidden=self.held)
+        spam.remember(signature, post=post)
+        events.record(ActivityEvent.POST_CREATED, actor=self.request.user, post=post)
+        readmodels.schedule_refresh(post.pk)
 
 class PostDeleteView(generics.RetrieveDestroyAPIView):
     queryset = ForumPost.objects.all()
@@ -26,32 +56,69 @@ class PostDeleteView(generics.RetrieveDestroyAPIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthorOrMod]
 
+    def perform_destroy(self, instance):
+        # Soft delete, the purger removes the row and its replies later
+        moderation.delete_posts([instance.pk], self.request.user)
+
 class PostEditView(generics.RetrieveUpdateAPIView):
-    queryset = ForumPost.objects.all()
     serializer_class = PostSerializer
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthorOrMod]
 
+    def get_queryset(self):
+        return visible_to(ForumPost.objects.all(), self.request.user)
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        # Locked, so concurrent edits number their revisions one after the other
+        old_title, old_content = (
+            ForumPost.objects.select_for_update().filter(pk=serializer.instance.pk)
+            .values_list('title', 'content').get()
+        )
+        post = serializer.save()
+        if (post.title, post.content) != (old_title, old_content):
+            revisions.record_edit(post, old_title, old_content, self.request.user)
+        events.record(ActivityEvent.POST_EDITED, actor=self.request.user, post=post)
+        readmodels.schedule_refresh(post.pk)
+
 class PostListView(generics.ListAPIView):
-    queryset = ForumPost.objects.all().order_by('-created_at')
+    queryset = ForumPost.objects.filter(is_hidden=False).order_by('-created_at')
     serializer_class = PostSerializer
     authentication_classes = [JWTAuthentication]
     permission_classes = [permissions.AllowAny]
 
     
 class PostGetView(generics.RetrieveAPIView):
-    queryset = ForumPost.objects.all()
+    queryset = ForumPost.objects.filter(is_hidden=False)
     serializer_class = PostSerializer
     authentication_classes = [JWTAuthentication]
     permission_classes = [permissions.AllowAny]
 
+    def retrieve(self, request, *args, **kwargs):
+        response = None
+        if readmodels.enabled():
+            try:
+                doc = readmodels.get_post_document(self.kwargs['pk'])
+            except readmodels.Unavailable:
+                pass  # Mongo is down, SQL serves the post
+            else:
+                if doc is None:
+                    raise Http404
+                response = Response(readmodels.absolutize(doc['post'], request))
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+        # Precomputed offline, a primary key lookup
+        response.data = dict(response.data, related=related.lookup(self.kwargs['pk']))
+        return response
+
 class PostUpvoteView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticatedAndActive]
     
+    @transaction.atomic
     def post(self, request, pk):
-        post = get_object_or_404(ForumPost, pk=pk)
         user = request.user
+        post = get_object_or_404(visible_to(ForumPost.objects.all(), user), pk=pk)
 
         if post.upvoted_by.filter(pk=user.pk).exists():
             post.upvoted_by.remove(user)
@@ -59,6 +126,9 @@ class PostUpvoteView(APIView):
         else:
             post.upvoted_by.add(user)
             upvoted = True
+        reputation.apply_vote(post.author_id, user.pk, upvoted, reputation.POST_VOTE_POINTS)
+        events.record(ActivityEvent.POST_VOTED, actor=user, post=post, upvoted=upvoted)
+        readmodels.schedule_refresh(post.pk)
 
         return Response({
             'upvotes_count': post.upvotes_count,
@@ -70,16 +140,32 @@ class ReplyCreateView(generics.CreateAPIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticatedAndActive]
 
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.data['held'] = self.held
+        return response
+
+    @transaction.atomic
     def perform_create(self, serializer):
-        post = get_object_or_404(ForumPost, pk=self.kwargs['post_pk'])
+        post = get_object_or_404(ForumPost, pk=self.kwargs['post_pk'], is_hidden=False)
         parent = None
         if 'parent_pk' in self.kwargs:
-            parent = get_object_or_404(Reply, pk=self.kwargs['parent_pk'])
-        serializer.save(
+            parent = get_object_or_404(Reply, pk=self.kwargs['parent_pk'], is_hidden=False)
+        signature = spam.check(self.request.user, serializer.validated_data['content'])
+        self.held = bool(signature and signature.held)
+        reply = serializer.save(
             author=self.request.user,
             post=post,
-            parent=parent
+            parent=parent,
+            is_hidden=self.held
+        )
+        spam.remember(signature, reply=reply)
+        events.record(
+            ActivityEvent.REPLY_CREATED,
+            actor=self.request.user, post=post, reply=reply,
+            parent=parent.pk if parent else None
         )
+        readmodels.schedule_refresh(post.pk)
 
 class ReplyListByPostView(generics.ListAPIView):
     serializer_class = ReplySerializer
@@ -88,7 +174,20 @@ class ReplyListByPostView(generics.ListAPIView):
 
     def get_queryset(self):
         post_id = self.kwargs['post_pk']
-        return Reply.objects.filter(post_id=post_id).order_by('created_at')
+        return Reply.objects.filter(post_id=post_id, is_hidden=False).order_by('created_at')
+
+    def list(self, request, *args, **kwargs):
+        if readmodels.enabled():
+            try:
+                doc = readmodels.get_post_document(self.kwargs['post_pk'])
+            except readmodels.Unavailable:
+                return super().list(request, *args, **kwargs)
+            replies = [readmodels.absolutize(r, request) for r in (doc or {}).get('replies', [])]
+            page = self.paginate_queryset(replies)
+            if page is not None:
+                return self.get_paginated_response(page)
+            return Response(replies)
+        return super().list(request, *args, **kwargs)
 
 class ReplyDeleteView(generics.RetrieveDestroyAPIView):
     queryset = Reply.objects.all()
@@ -96,19 +195,37 @@ class ReplyDeleteView(generics.RetrieveDestroyAPIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthorOrMod]
 
+    def perform_destroy(self, instance):
+        moderation.delete_replies([instance.pk], self.request.user)
+
 class ReplyEditView(generics.RetrieveUpdateAPIView):
-    queryset = Reply.objects.all()
     serializer_class = ReplySerializer
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthorOrMod]
 
+    def get_queryset(self):
+        return visible_to(Reply.objects.all(), self.request.user)
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        old_content = (
+            Reply.objects.select_for_update().filter(pk=serializer.instance.pk)
+            .values_list('content', flat=True).get()
+        )
+        reply = serializer.save()
+        if reply.content != old_content:
+            revisions.record_edit(reply, '', old_content, self.request.user)
+        events.record(ActivityEvent.REPLY_EDITED, actor=self.request.user, post=reply.post_id, reply=reply)
+        readmodels.schedule_refresh(reply.post_id)
+
 class ReplyUpvoteView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticatedAndActive]
     
+    @transaction.atomic
     def post(self, request, pk):
-        reply = get_object_or_404(Reply, pk=pk)
         user = request.user
+        reply = get_object_or_404(visible_to(Reply.objects.all(), user), pk=pk)
 
         if reply.upvoted_by.filter(pk=user.pk).exists():
             reply.upvoted_by.remove(user)
@@ -116,6 +233,12 @@ class ReplyUpvoteView(APIView):
         else:
             reply.upvoted_by.add(user)
             upvoted = True
+        reputation.apply_vote(reply.author_id, user.pk, upvoted, reputation.REPLY_VOTE_POINTS)
+        events.record(
+            ActivityEvent.REPLY_VOTED,
+            actor=user, post=reply.post_id, reply=reply, upvoted=upvoted
+        )
+        readmodels.schedule_refresh(reply.post_id)
 
         return Response({
             'upvotes': reply.upvotes,
@@ -127,10 +250,12 @@ class SortedPostListView(generics.ListAPIView):
     permission_classes = [permissions.AllowAny]
     serializer_class = PostSerializer
 
-    queryset = ForumPost.objects.annotate(
-        reply_count = Count('replies'),
-        latest_reply_time = Max('replies__created_at'),
-        upvotes = Count('upvoted_by')
+    # Counters come from the post_stats projection instead of aggregating
+    # replies and votes on every request, so they can lag writes slightly
+    queryset = ForumPost.objects.filter(is_hidden=False).annotate(
+        reply_count = Coalesce('stats__reply_count', Value(0)),
+        latest_reply_time = F('stats__latest_reply_time'),
+        upvotes = Coalesce('stats__upvotes', Value(0))
     )
 
     filter_backends = [filters.OrderingFilter]
@@ -142,7 +267,7 @@ class PostSearchView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = PostSerializer
 
-    queryset = ForumPost.objects.annotate(
+    queryset = ForumPost.objects.filter(is_hidden=False).annotate(
         reply_count=Count('replies')
     )
 
@@ -155,7 +280,7 @@ class CurrentUserPostView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return ForumPost.objects.filter(author=self.request.user).order_by('-created_at')
+        return ForumPost.objects.filter(author=self.request.user, is_hidden=False).order_by('-created_at')
     
 class PostByUserView(generics.ListAPIView):
     serializer_class = PostSerializer
@@ -165,4 +290,219 @@ class PostByUserView(generics.ListAPIView):
     def get_queryset(self):
         user_id = self.kwargs['user_id']
         get_object_or_404(User, id=user_id)
-        return ForumPost.objects.filter(author__id=user_id).order_by('-created_at')
\ No newline at end of file
+        return ForumPost.objects.filter(author__id=user_id, is_hidden=False).order_by('-created_at')
+
+class FollowAuthorView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticatedAndActive]
+
+    def post(self, request, user_id):
+        author = get_object_or_404(User, pk=user_id)
+        if author.pk == request.user.pk:
+            return Response({'detail': "You can't follow yourself"}, status=status.HTTP_400_BAD_REQUEST)
+        following = feeds.follow(request.user, author=author)
+        return Response({'following': following}, status=status.HTTP_200_OK)
+
+class FollowPostView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticatedAndActive]
+
+    def post(self, request, pk):
+        post = get_object_or_404(ForumPost, pk=pk, is_hidden=False)
+        following = feeds.follow(request.user, post=post)
+        return Response({'following': following}, status=status.HTTP_200_OK)
+
+class FeedView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        try:
+            before = int(request.query_params['before']) if 'before' in request.query_params else None
+            limit = min(int(request.query_params.get('limit', settings.FEED_PAGE_SIZE)), 100)
+        except ValueError:
+            return Response({'detail': "before and limit must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        items, next_cursor = feeds.read_timeline(request.user, before=before, limit=max(limit, 1))
+        return Response({
+            'next': next_cursor,
+            'results': FeedItemSerializer(items, many=True, context={'request': request}).data,
+        }, status=status.HTTP_200_OK)
+
+class NotificationListView(generics.ListAPIView):
+    serializer_class = NotificationSerializer
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return (
+            Notification.objects.filter(recipient=self.request.user)
+            .select_related('post').order_by('-updated_at')
+        )
+
+class NotificationUnreadCountView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        return Response({'unread': notifications.unread_count(request.user.pk)}, status=status.HTTP_200_OK)
+
+class NotificationMarkReadView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    @transaction.atomic
+    def post(self, request):
+        serializer = MarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        marked = notifications.mark_read(request.user.pk, serializer.validated_data['ids'])
+        return Response({'marked': marked}, status=status.HTTP_200_OK)
+
+class PostRevisionListView(generics.ListAPIView):
+    serializer_class = RevisionSerializer
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticatedAndActive, IsAuthorOrModToRead]
+    model = ForumPost
+
+    def get_target(self):
+        target = get_object_or_404(visible_to(self.model.objects.all(), self.request.user), pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, target)
+        return target
+
+    def get_queryset(self):
+        return self.get_target().revisions.order_by('-number')
+
+class ReplyRevisionListView(PostRevisionListView):
+    model = Reply
+
+class PostRevisionView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticatedAndActive, IsAuthorOrModToRead]
+    model = ForumPost
+
+    def get(self, request, pk, number):
+        target = get_object_or_404(visible_to(self.model.objects.all(), request.user), pk=pk)
+        self.check_object_permissions(request, target)
+        revision = revisions.rebuild(target, number)
+        if revision is None:
+            raise Http404
+        return Response(revision, status=status.HTTP_200_OK)
+
+class ReplyRevisionView(PostRevisionView):
+    model = Reply
+
+class DraftListCreateView(generics.ListCreateAPIView):
+    serializer_class = DraftSerializer
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticatedAndActive]
+
+    def get_queryset(self):
+        return Draft.objects.filter(author=self.request.user).order_by('-updated_at')
+
+    def perform_create(self, serializer):
+        serializer.save(author=self.request.user)
+
+class DraftDetailView(generics.RetrieveDestroyAPIView):
+    serializer_class = DraftSerializer
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticatedAndActive]
+
+    def get_queryset(self):
+        return Draft.objects.filter(author=self.request.user)
+
+    def patch(self, request, pk):
+        # Autosave: a small patch against `version` instead of the whole body
+        draft = self.get_object()
+        serializer = DraftPatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if data['version'] != draft.version:
+            return Response({'version': draft.version, 'title': draft.title, 'content': draft.content},
+                            status=status.HTTP_409_CONFLICT)
+        try:
+            content = revisions.apply_delta(draft.content, data['patch'])
+        except ValueError as e:
+            return Response({'patch': [str(e)]}, status=status.HTTP_400_BAD_REQUEST)
+        changes = {'content': content, 'version': draft.version + 1, 'updated_at': timezone.now()}
+        if 'title' in data:
+            changes['title'] = data['title']
+        # Conditional on the version, a concurrent autosave makes this one a conflict
+        if not Draft.objects.filter(pk=draft.pk, version=draft.version).update(**changes):
+            draft.refresh_from_db()
+            return Response({'version': draft.version, 'title': draft.title, 'content': draft.content},
+                            status=status.HTTP_409_CONFLICT)
+        return Response({'version': changes['version']}, status=status.HTTP_200_OK)
+
+class StatsView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        # Read from the rollup buckets, so this lags writes by the projection settle time
+        serializer = StatsQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        since = timezone.now() - data['span']
+        return Response({
+            'window': data['window'],
+            'resolution': data['resolution'],
+            'totals': rollups.totals(since),
+            'series': rollups.series(since, data['resolution']),
+        }, status=status.HTTP_200_OK)
+
+class TrendingView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        serializer = StatsQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        # Room for threads hidden or deleted since
+        top = rollups.top_threads(timezone.now() - data['span'], limit=data['limit'] * 2)
+        posts = ForumPost.objects.filter(pk__in=[pk for pk, _ in top], is_hidden=False).select_related('author').in_bulk()
+        results = [
+            {'score': score, 'post': PostSerializer(posts[pk], context={'request': request}).data}
+            for pk, score in top if pk in posts
+        ][:data['limit']]
+        return Response({'window': data['window'], 'results': results}, status=status.HTTP_200_OK)
+
+class BulkModerationView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsModerator]
+
+    def post(self, request):
+        serializer = BulkModerationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        # Whole-user cleanups and big id lists run in the background
+        size = len(data['posts']) + len(data['replies'])
+        if data['user'] or size > settings.MODERATION_SYNC_LIMIT:
+            enqueue('moderation.bulk', kwargs=dict(data, actor_id=request.user.pk))
+            return Response({'detail': 'Moderation queued'}, status=status.HTTP_202_ACCEPTED)
+
+        done = moderation.run_bulk(data['action'], request.user, data['posts'], data['replies'])
+        return Response(done, status=status.HTTP_200_OK)
+
+class HeldContentListView(generics.ListAPIView):
+    serializer_class = HeldContentSerializer
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsModerator]
+
+    def get_queryset(self):
+        return (
+            ContentSignature.objects.filter(held=True)
+            .select_related('post', 'reply', 'author').order_by('created_at')
+        )
+
+class HeldContentDecisionView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsModerator]
+
+    def post(self, request, pk):
+        serializer = HeldDecisionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        approve = serializer.validated_data['action'] == 'approve'
+        if not spam.release(pk, request.user, approve):
+            raise Http404
+        return Response({'action': serializer.validated_data['action']}, status=status.HTTP_200_OK)
@@ -0,0 +1,28 @@
+from django.contrib.auth import get_user_model, hashers
+from django.contrib.auth.backends import ModelBackend
+
+from . import hashing
+
+
+class PooledModelBackend(ModelBackend):
+    """ModelBackend whose password work runs on the bounded hash pool."""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Hash anyway, so an unknown username takes as long as a wrong password
+            hashing.make_password(password)
+            return None
+        if not hashing.check_password(password, user.password) or not self.user_can_authenticate(user):
+            return None
+        # Upgrade hashes made with older settings, like User.check_password() does
+        if hashers.identify_hasher(user.password).must_update(user.password):
+            user.password = hashing.make_password(password)
+            user.save(update_fields=['password'])
+        return user
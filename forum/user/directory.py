@@ -0,0 +1,73 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+
+User = get_user_model()
+
+#User directory for @mention autocomplete.
+#Prefix matches on the case-folded username/nickname columns, one indexed
+#range scan per column. Results are cached per prefix as compact dicts, up to
+#MAX_LIMIT of them whatever limit was asked for. Registrations, profile edits
+#and bans drop only the prefixes of the names involved (invalidate_names());
+#bulk changes bump a generation number instead (invalidate()).
+
+GENERATION_KEY = 'forum:userdir:generation'
+# Longest query and largest page the search view accepts
+MAX_QUERY_LENGTH = 30
+MAX_LIMIT = 25
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+def _key(generation, prefix):
+    # Hashed: raw input may hold spaces, control characters or non-ASCII, which memcached keys can't
+    return f'forum:userdir:{generation}:{hashlib.md5(prefix.encode()).hexdigest()}'
+
+def invalidate():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 1, None)
+
+def invalidate_names(*names):
+    """Drop the cached answers of every prefix of `names`, pass old and new names on a rename."""
+    generation = _generation()
+    keys = {
+        _key(generation, folded[:end])
+        for folded in {(name or '').casefold() for name in names}
+        for end in range(1, min(len(folded), MAX_QUERY_LENGTH) + 1)
+    }
+    cache.delete_many(keys)
+
+def search(query, limit=10):
+    """Active users whose username or nickname starts with `query`, as small dicts."""
+    prefix = query.strip().casefold()
+    if not prefix:
+        return []
+    key = _key(_generation(), prefix)
+    result = cache.get(key)
+    if result is None:
+        result = _lookup(prefix, MAX_LIMIT)
+        cache.set(key, result, getattr(settings, 'USER_DIRECTORY_CACHE_SECONDS', 60))
+    return result[:limit]
+def _lookup(prefix, limit):
+    found = {}
+    for column in ('username_folded', 'nickname_folded'):
+        rows = (
+            User.objects.filter(is_active=True, **{f'{column}__startswith': prefix})
+            .order_by(column).values_list('id', 'username', 'nickname', 'avatar')[:limit]
+        )
+        for row in rows:
+            found.setdefault(row[0], row)
+    storage = User._meta.get_field('avatar').storage
+    ranked = sorted(found.values(), key=lambda row: (row[1].casefold(), row[0]))
+    return [
+        {'id': pk, 'username': username, 'nickname': nickname, 'avatar': storage.url(avatar)}
+        for pk, username, nickname, avatar in ranked[:limit]
+    ]
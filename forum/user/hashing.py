@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework.exceptions import APIException
+
+#Bounded pool for password hashing.
+#PBKDF2 (hashlib) releases the GIL, so a few threads hash in parallel while
+#request threads just wait on the result. At most PASSWORD_HASH_WORKERS hashes
+#run at once and PASSWORD_HASH_QUEUE_SIZE more may wait; beyond that, or past
+#PASSWORD_HASH_TIMEOUT, callers get a 503 instead of piling onto the CPU.
+
+
+class HashPoolBusy(APIException):
+    status_code = 503
+    default_detail = "Too many sign-ups/logins right now, try again shortly."
+    default_code = 'busy'
+    # DRF turns this into a Retry-After header
+    wait = 1
+
+
+class HashPool:
+    def __init__(self, workers, queue_size, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hash')
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.lock = threading.Lock()
+        self.metrics = dict.fromkeys(
+            ('submitted', 'completed', 'rejected', 'timed_out', 'pending', 'max_pending'), 0
+        )
+        self.metrics.update(wait_seconds=0.0, hash_seconds=0.0)
+
+    def run(self, func, *args):
+        if not self.slots.acquire(blocking=False):
+            self._count(rejected=1)
+            raise HashPoolBusy()
+        with self.lock:
+            self.metrics['submitted'] += 1
+            self.metrics['pending'] += 1
+            self.metrics['max_pending'] = max(self.metrics['max_pending'], self.metrics['pending'])
+        future = self.executor.submit(self._call, time.perf_counter(), func, args)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            self._count(timed_out=1)
+            raise HashPoolBusy()
+
+    def _call(self, queued_at, func, args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            done = time.perf_counter()
+            with self.lock:
+                self.metrics['pending'] -= 1
+                self.metrics['completed'] += 1
+                self.metrics['wait_seconds'] += started - queued_at
+                self.metrics['hash_seconds'] += done - started
+            # Freed when the hash finishes, not when a timed out caller gives up
+            self.slots.release()
+
+    def _count(self, **deltas):
+        with self.lock:
+            for name, n in deltas.items():
+                self.metrics[name] += n
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.metrics)
+        completed = stats['completed'] or 1
+        stats['mean_wait_ms'] = stats['wait_seconds'] / completed * 1000
+        stats['mean_hash_ms'] = stats['hash_seconds'] / completed * 1000
+        return stats
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool, _pool_pid
+    # Threads don't survive a fork, pre-fork servers need a pool per process
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = HashPool(
+                workers=settings.PASSWORD_HASH_WORKERS,
+                queue_size=settings.PASSWORD_HASH_QUEUE_SIZE,
+                timeout=settings.PASSWORD_HASH_TIMEOUT,
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+def reset_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown()
+        _pool = None
+        _pool_pid = None
+
+def make_password(raw_password):
+    return get_pool().run(hashers.make_password, raw_password)
+
+def check_password(raw_password, encoded):
+    return get_pool().run(hashers.check_password, raw_password, encoded)
+
+def stats():
+    return get_pool().stats()
@@ -0,0 +1,84 @@
+import os
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import authenticate, get_user_model
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from user import hashing
+from user.serializers import RegisterSerializer
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure registration and login throughput through the real serializer "
+        "and authentication backend. Creates throwaway users and deletes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Registrations (and logins) to run")
+        parser.add_argument('--concurrency', type=int, default=os.cpu_count() or 2, help="Simulated client threads")
+
+    def handle(self, *args, **options):
+        n, concurrency = options['requests'], options['concurrency']
+        prefix = 'bench' + uuid.uuid4().hex[:8]
+        password = 'Bench-Secret-123'
+        cores = os.cpu_count() or 1
+        self.stdout.write(f"{n} request(s), {concurrency} client thread(s), {cores} core(s), "
+                          f"{hashing.get_pool().workers} hash worker(s)")
+
+        def register(i):
+            serializer = RegisterSerializer(data={
+                'username': f'{prefix}{i}', 'nickname': f'{prefix}{i}', 'password': password,
+            })
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+        def login(i):
+            if authenticate(username=f'{prefix}{i}', password=password) is None:
+                raise RuntimeError(f"Login {i} failed")
+
+        try:
+            for label, func in (('register', register), ('login', login)):
+                elapsed, latencies = self.run(func, n, concurrency)
+                rate = n / elapsed
+                self.stdout.write(
+                    f"{label:>8}: {rate:8.1f}/s total, {rate / min(cores, concurrency):8.1f}/s per core, "
+                    f"p50 {self.pct(latencies, 50):6.1f} ms, p95 {self.pct(latencies, 95):6.1f} ms"
+                )
+        finally:
+            User.objects.filter(username__startswith=prefix).delete()
+
+        stats = hashing.stats()
+        self.stdout.write(
+            "hash pool: {completed} done, {rejected} rejected, {timed_out} timed out, "
+            "max {max_pending} pending, mean wait {mean_wait_ms:.1f} ms, mean hash {mean_hash_ms:.1f} ms".format(**stats)
+        )
+
+    def run(self, func, n, concurrency):
+        def timed(i):
+            started = time.perf_counter()
+            try:
+                func(i)
+            finally:
+                if concurrency > 1:
+                    close_old_connections()
+            return (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                latencies = list(pool.map(timed, range(n)))
+        else:
+            latencies = [timed(i) for i in range(n)]
+        return time.perf_counter() - started, latencies
+
+    def pct(self, values, p):
+        if len(values) < 2:
+            return values[0] if values else 0.0
+        return statistics.quantiles(values, n=100)[p - 1]
@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from user import directory
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Backfill the case-folded username/nickname/email columns for existing users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Users per bulk update")
+
+    def handle(self, *args, **options):
+        fields = ['username_folded', 'nickname_folded', 'email_folded']
+        changed = 0
+        last = 0
+        while True:
+            batch = list(User.objects.filter(pk__gt=last).order_by('pk')[:options['batch_size']])
+            if not batch:
+                break
+            stale = []
+            for user in batch:
+                before = [getattr(user, f) for f in fields]
+                user.fold_names()
+                if before != [getattr(user, f) for f in fields]:
+                    stale.append(user)
+            User.objects.bulk_update(stale, fields)
+            changed += len(stale)
+            last = batch[-1].pk
+        directory.invalidate()
+        self.stdout.write(self.style.SUCCESS(f"Folded names of {changed} user(s)"))
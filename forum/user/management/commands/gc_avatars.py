@@ -0,0 +1,64 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from user.storage import avatar_storage
+
+User = get_user_model()
+
+DEFAULT_AVATAR = 'avatar/default.png'
+
+
+class Command(BaseCommand):
+    help = "Delete avatar files no user points at any more, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Files deleted per batch")
+        parser.add_argument('--max-batches', type=int, default=None, help="Stop after this many batches")
+        parser.add_argument('--grace-minutes', type=int, default=60,
+                            help="Keep files younger than this, their upload may not be committed yet")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        referenced = set(
+            User.objects.exclude(avatar='').values_list('avatar', flat=True).distinct().iterator()
+        )
+        referenced.add(DEFAULT_AVATAR)
+        cutoff = timezone.now() - timedelta(minutes=options['grace_minutes'])
+
+        batch, deleted, batches = [], 0, 0
+        for name in self.walk('avatar'):
+            if name in referenced or avatar_storage.get_modified_time(name) > cutoff:
+                continue
+            batch.append(name)
+            if len(batch) >= options['batch_size']:
+                deleted += self.delete(batch, cutoff, options['dry_run'])
+                batch, batches = [], batches + 1
+                if options['max_batches'] and batches >= options['max_batches']:
+                    break
+        else:
+            deleted += self.delete(batch, cutoff, options['dry_run'])
+
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {deleted} unreferenced avatar file(s)"))
+
+    def walk(self, folder):
+        # Covers the sharded content-addressed layout and the old avatar/<username>/ folders
+        if not avatar_storage.exists(folder):
+            return
+        dirs, files = avatar_storage.listdir(folder)
+        for name in files:
+            yield f"{folder}/{name}"
+        for sub in dirs:
+            yield from self.walk(f"{folder}/{sub}")
+
+    def delete(self, names, cutoff, dry_run):
+        # An upload may have deduped onto one of these since the walk started
+        names = set(names) - set(User.objects.filter(avatar__in=names).values_list('avatar', flat=True))
+        names = [name for name in sorted(names) if avatar_storage.get_modified_time(name) <= cutoff]
+        if not dry_run:
+            for name in names:
+                avatar_storage.delete(name)
+        return len(names)
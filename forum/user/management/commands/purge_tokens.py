@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from user.tokens import blacklist_jti
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired rows from the token_blacklist tables in batches. With "
+        "--seed-cache, first copy still valid blacklisted tokens into the cache blacklist."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per DELETE")
+        parser.add_argument('--seed-cache', action='store_true',
+                            help="Carry over tokens blacklisted before the blacklist moved to the cache")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        batch_size = options['batch_size']
+
+        if options['seed_cache']:
+            seeded = 0
+            live = BlacklistedToken.objects.filter(token__expires_at__gt=now).order_by('pk')
+            for jti, expires_at in live.values_list('token__jti', 'token__expires_at').iterator(chunk_size=batch_size):
+                blacklist_jti(jti, expires_at.timestamp())
+                seeded += 1
+            self.stdout.write(f"Seeded {seeded} blacklisted token(s) into the cache")
+
+        deleted = 0
+        while True:
+            ids = list(
+                OutstandingToken.objects.filter(expires_at__lte=now)
+                .order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            # Blacklist rows point at their outstanding token, remove them first
+            BlacklistedToken.objects.filter(token_id__in=ids)._raw_delete(BlacklistedToken.objects.db)
+            OutstandingToken.objects.filter(pk__in=ids)._raw_delete(OutstandingToken.objects.db)
+            deleted += len(ids)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired token(s)"))
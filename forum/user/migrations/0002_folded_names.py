@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:57
+
+import user.models
+import user.storage
+from django.db import migrations, models
+
+
+def fold_names(apps, schema_editor):
+    # Same as User.fold_names() and manage.py fold_user_names, casefold() has no SQL equivalent
+    User = apps.get_model('user', 'User')
+    db = schema_editor.connection.alias
+    fields = ['username_folded', 'nickname_folded', 'email_folded']
+    last = 0
+    while True:
+        batch = list(User.objects.using(db).filter(pk__gt=last).order_by('pk')[:500])
+        if not batch:
+            break
+        for user in batch:
+            user.username_folded = (user.username or '').casefold()
+            user.nickname_folded = (user.nickname or '').casefold()
+            user.email_folded = (user.email or '').casefold()
+        User.objects.using(db).bulk_update(batch, fields)
+        last = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('user', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='email_folded',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='nickname_folded',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=30),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='username_folded',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=150),
+        ),
+        migrations.RunPython(fold_names, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(default='avatar/default.png', help_text="User's profile picture.", storage=user.storage.ContentAddressedStorage(), upload_to=user.models.avatar_upload_to),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-reputation', 'id'], name='user_reputation_idx'),
+        ),
+    ]
@@ -1,20 +1,13 @@
 import os
-import uuid
 from django.contrib.auth.models import AbstractUser
-from django.core.files.storage import default_storage
 from django.db import models
 from django.utils import timezone
+from .storage import avatar_storage
 
 def avatar_upload_to(instance, filename):
+    # The storage renames the file after its content hash, only the extension matters here
     ext = os.path.splitext(filename)[1].lower()
-    folder = f"avatar/{instance.username}"
-
-    while True:
-        name = uuid.uuid4().hex + ext
-        path = f"{folder}/{name}"
-        if not default_storage.exists(path):
-            return path
-        
+    return f"avatar/upload{ext}"
 
 
 class User(AbstractUser):
@@ -33,6 +26,7 @@ class User(AbstractUser):
 
     avatar = models.ImageField(
         upload_to=avatar_upload_to,
+        storage=avatar_storage,
         default='avatar/default.png',
         help_text="User's profile picture."
         # Some validation here, file extension/size etc.
@@ -46,4 +40,29 @@ class User(AbstractUser):
     reputation = models.IntegerField(
         default=0,
         help_text="" # For ranking or user group or whatever, optional
-    )
\ No newline at end of file
+        # Maintained from upvotes, see forum_main/reputation.py
+    )
+
+    # Case-folded copies kept in sync by save(), so case-insensitive and
+    # prefix lookups hit a plain index instead of UPPER()/LOWER() scans
+    username_folded = models.CharField(max_length=150, db_index=True, editable=False, default='')
+    nickname_folded = models.CharField(max_length=30, db_index=True, editable=False, default='')
+    email_folded    = models.CharField(max_length=254, db_index=True, editable=False, default='')
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Leaderboard
+            models.Index(fields=['-reputation', 'id'], name='user_reputation_idx'),
+        ]
+
+    def fold_names(self):
+        self.username_folded = (self.username or '').casefold()
+        self.nickname_folded = (self.nickname or '').casefold()
+        self.email_folded    = (self.email or '').casefold()
+
+    def save(self, *args, **kwargs):
+        self.fold_names()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'username', 'nickname', 'email'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'username_folded', 'nickname_folded', 'email_folded'}
+        super().save(*args, **kwargs)
\ No newline at end of file
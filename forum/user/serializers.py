@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from django.db import IntegrityError, transaction
+from . import hashing
 
 User = get_user_model()
 
@@ -18,8 +20,9 @@ class RegisterSerializer(serializers.ModelSerializer):
         # Required: Username, Password, Nickname
         # Optional: Email, Avatar, First name, Last name
         extra_kwargs = {
-            'username':   {'required': True,  'allow_blank': False, 'min_length': 4, 'max_length': 20},
-            'nickname':   {'required': True,  'allow_blank': False, 'min_length': 1, 'max_length': 30},
+            # Uniqueness comes from the database constraints in create(), no pre-check queries
+            'username':   {'required': True,  'allow_blank': False, 'min_length': 4, 'max_length': 20, 'validators': []},
+            'nickname':   {'required': True,  'allow_blank': False, 'min_length': 1, 'max_length': 30, 'validators': []},
             'avatar':     {'required': False, 'allow_null': True},
             'email':      {'required': False, 'allow_blank': True},
             'first_name': {'required': False, 'allow_blank': True},
@@ -32,8 +35,6 @@ class RegisterSerializer(serializers.ModelSerializer):
     def validate_username(self, value):
         if not value.isalnum():
             raise serializers.ValidationError("Username can only contail latin characters and numbers")
-        if User.objects.filter(username=value).exists():
-            raise serializers.ValidationError("Username already exists")
         return value
     
     def validate(self, attrs):
@@ -49,10 +50,23 @@ class RegisterSerializer(serializers.ModelSerializer):
             user.avatar = 'avatar/default.png'
         else:
             user.avatar = avatar
-        user.set_password(pwd)
-        user.save()
+        user.password = hashing.make_password(pwd)
+        try:
+            with transaction.atomic():
+                user.save()
+        except IntegrityError:
+            raise serializers.ValidationError(self.duplicate_errors(user))
         return user
 
+    def duplicate_errors(self, user):
+        # Only runs after the insert failed, the happy path never queries
+        errors = {}
+        if User.objects.filter(username=user.username).exists():
+            errors['username'] = "Username already exists"
+        if User.objects.filter(nickname=user.nickname).exists():
+            errors['nickname'] = "Nickname already exists"
+        return errors or {'detail': "User already exists"}
+
 class UserUpdateSerializer(serializers.ModelSerializer):
     email = serializers.EmailField(required=False)
     nickname = serializers.CharField(required=False)
@@ -64,20 +78,20 @@ class UserUpdateSerializer(serializers.ModelSerializer):
 
     def validate_email(self, value):
         user = self.context['request'].user
-        if User.objects.exclude(pk=user.pk).filter(email__iexact=value).exists():
+        if User.objects.exclude(pk=user.pk).filter(email_folded=value.casefold()).exists():
             raise serializers.ValidationError("Email already in use.")
         return value
 
     def validate_nickname(self, value):
         user = self.context['request'].user
-        if User.objects.exclude(pk=user.pk).filter(nickname__iexact=value).exists():
+        if User.objects.exclude(pk=user.pk).filter(nickname_folded=value.casefold()).exists():
             raise serializers.ValidationError("Nickname already in use.")
         return value
 
     def update(self, instance, validated_data):
         pwd = validated_data.pop('password', None)
         if pwd:
-            instance.set_password(pwd)
+            instance.password = hashing.make_password(pwd)
         avatar = validated_data.pop('avatar', None)
         if avatar is not None:
             instance.avatar = avatar                
@@ -94,4 +108,11 @@ class UserSerializer(serializers.ModelSerializer):
             'first_name', 'last_name',
             'nickname', 'avatar'
         )
-        read_only_fields = fields
\ No newline at end of file
+        read_only_fields = fields
+
+
+class LeaderboardSerializer(serializers.ModelSerializer):
+    class Meta:
+        model  = User
+        fields = ('id', 'username', 'nickname', 'avatar', 'reputation')
+        read_only_fields = fields
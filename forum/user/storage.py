@@ -0,0 +1,106 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import Storage, storages
+from django.core.files.utils import validate_file_name
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible(path='user.storage.ContentAddressedStorage')
+class ContentAddressedStorage(Storage):
+    """
+    Stores each file under the sha256 of its bytes, fanned out over two levels
+    of directories: <upload folder>/ab/cd/abcd....ext
+
+    The files live in the backend configured in STORAGES under `alias`
+    (AVATAR_STORAGE by default), local disk or remote. Identical uploads map to
+    the same name, so an upload that finds its name taken is the same content:
+    the existing file is touched and its name returned.
+    """
+
+    def __init__(self, alias=None):
+        self.alias = alias
+
+    @property
+    def backend(self):
+        # Looked up each time, STORAGES can change under tests
+        return storages[self.alias or settings.AVATAR_STORAGE]
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        validate_file_name(name, allow_relative_path=True)
+        if self.backend.exists(name) and self.touch(name, content):
+            return name
+        stored = self.backend.save(name, content, max_length=max_length)
+        if stored != name:
+            # An identical upload got there first and the backend picked another name, keep one copy
+            self.backend.delete(stored)
+        return name
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk if isinstance(chunk, bytes) else chunk.encode())
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        digest = digest.hexdigest()
+        folder = os.path.dirname(name)
+        ext = os.path.splitext(name)[1].lower()
+        return '/'.join(p for p in (folder, digest[:2], digest[2:4], digest + ext) if p)
+
+    def touch(self, name, content):
+        """
+        A new reference to an existing file: restart its gc_avatars grace
+        period. Returns False if the file was collected in between.
+        """
+        try:
+            os.utime(self.backend.path(name))
+            return True
+        except (NotImplementedError, FileNotFoundError):
+            pass
+        if not self.backend.exists(name):
+            return False
+        # Not a local file (remote storages, or path() names nothing on disk),
+        # writing the same bytes again moves its modified time
+        with self.backend.open(name, 'wb') as f:
+            for chunk in content.chunks():
+                f.write(chunk)
+        return True
+
+    def _open(self, name, mode='rb'):
+        return self.backend.open(name, mode)
+
+    def delete(self, name):
+        self.backend.delete(name)
+
+    def exists(self, name):
+        return self.backend.exists(name)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def size(self, name):
+        return self.backend.size(name)
+
+    def url(self, name):
+        return self.backend.url(name)
+
+    def path(self, name):
+        return self.backend.path(name)
+
+    def get_accessed_time(self, name):
+        return self.backend.get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return self.backend.get_created_time(name)
+
+    def get_modified_time(self, name):
+        return self.backend.get_modified_time(name)
+
+avatar_storage = ContentAddressedStorage()
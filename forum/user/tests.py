@@ -1,9 +1,27 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from forum_main import moderation
+from . import directory, hashing, tokens
+from .management.commands import gc_avatars
+from .storage import avatar_storage
+from datetime import timedelta
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
 
 User = get_user_model()
 
@@ -155,4 +173,287 @@ class UserUpdateTests(APITestCase):
         new_avatar_url = self.user.avatar.url
 
         print(resp.data)
-        print(new_avatar_url)
\ No newline at end of file
+        print(new_avatar_url)
+
+GIF = (
+    b'GIF87a\x01\x00\x01\x00\x80\x00\x00\x00\x00'
+    b'\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00,'
+    b'\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02'
+    b'D\x01\x00;'
+)
+
+class AvatarStorageTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def make_user(self, username):
+        user = User.objects.create_user(username=username, password='Secret123!', nickname=username)
+        user.avatar = SimpleUploadedFile('me.GIF', GIF, content_type='image/gif')
+        user.save()
+        return user
+
+    def test_identical_uploads_share_one_sharded_file(self):
+        alice = self.make_user('alice')
+        bob = self.make_user('bob')
+        self.assertEqual(alice.avatar.name, bob.avatar.name)
+        self.assertRegex(alice.avatar.name, r'^avatar/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.gif$')
+        self.assertTrue(os.path.exists(os.path.join(self.media, alice.avatar.name)))
+
+    def test_gc_removes_only_unreferenced_files(self):
+        alice = self.make_user('alice')
+        orphan = 'avatar/alice/old.gif'
+        os.makedirs(os.path.join(self.media, 'avatar/alice'))
+        with open(os.path.join(self.media, orphan), 'wb') as f:
+            f.write(GIF)
+
+        out = StringIO()
+        call_command('gc_avatars', grace_minutes=0, stdout=out)
+        self.assertIn('Deleted 1', out.getvalue())
+        self.assertFalse(os.path.exists(os.path.join(self.media, orphan)))
+        self.assertTrue(os.path.exists(os.path.join(self.media, alice.avatar.name)))
+
+    def orphan_from(self, username):
+        # An avatar nobody uses any more, last written long ago
+        user = self.make_user(username)
+        name = user.avatar.name
+        user.delete()
+        old = (timezone.now() - timedelta(days=1)).timestamp()
+        os.utime(os.path.join(self.media, name), (old, old))
+        return name
+
+    def test_dedupe_hit_restarts_gc_grace_period(self):
+        name = self.orphan_from('alice')
+        started = timezone.now() - timedelta(seconds=1)
+        bob = self.make_user('bob')
+        self.assertEqual(bob.avatar.name, name)
+        self.assertGreater(avatar_storage.get_modified_time(name), started)
+
+        # A GC that can't see bob yet (upload not committed) still keeps the file
+        out = StringIO()
+        with mock.patch.object(User.objects, 'filter', return_value=User.objects.none()), \
+                mock.patch.object(User.objects, 'exclude', return_value=User.objects.none()):
+            call_command('gc_avatars', grace_minutes=60, stdout=out)
+        self.assertIn('Deleted 0', out.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(self.media, name)))
+
+    def test_wraps_a_backend_without_local_paths(self):
+        memory = {
+            'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        }
+        with override_settings(STORAGES=memory):
+            name = self.make_user('alice').avatar.name
+            old = avatar_storage.get_modified_time(name)
+            bob = self.make_user('bob')
+            self.assertEqual(bob.avatar.name, name)
+            # Rewritten in place, the gc grace period starts over
+            self.assertGreater(avatar_storage.get_modified_time(name), old)
+            with avatar_storage.open(name) as f:
+                self.assertEqual(f.read(), GIF)
+            self.assertEqual(avatar_storage.listdir(os.path.dirname(name))[1], [os.path.basename(name)])
+        self.assertFalse(os.path.exists(os.path.join(self.media, name)))
+
+    def test_gc_rechecks_references_before_deleting(self):
+        name = self.orphan_from('alice')
+        walk = gc_avatars.Command.walk
+
+        def walk_then_upload(command, folder):
+            yield from walk(command, folder)
+            if folder == 'avatar':
+                # Dedupes onto the orphan after the walk picked it
+                self.make_user('bob')
+
+        out = StringIO()
+        with mock.patch.object(gc_avatars.Command, 'walk', walk_then_upload):
+            call_command('gc_avatars', grace_minutes=0, stdout=out)
+        self.assertIn('Deleted 0', out.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(self.media, name)))
+
+
+class UserDirectoryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='Alice', password='Secret123!', nickname='Wonderland', email='A@Example.com')
+        self.alfred = User.objects.create_user(username='alfred', password='Secret123!', nickname='butler')
+        self.bob = User.objects.create_user(username='bob', password='Secret123!', nickname='ALbatross')
+        self.client.force_authenticate(self.bob)
+
+    def search(self, q):
+        resp = self.client.get(reverse('user-search'), {'q': q})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        return [u['username'] for u in resp.data]
+
+    def test_folded_columns_follow_saves(self):
+        self.assertEqual(
+            (self.alice.username_folded, self.alice.nickname_folded, self.alice.email_folded),
+            ('alice', 'wonderland', 'a@example.com'),
+        )
+        self.alice.nickname = 'Queen'
+        self.alice.save(update_fields=['nickname'])
+        self.assertEqual(User.objects.get(pk=self.alice.pk).nickname_folded, 'queen')
+
+    def test_prefix_search_on_username_and_nickname(self):
+        self.assertEqual(self.search('AL'), ['alfred', 'Alice', 'bob'])
+        self.assertEqual(self.search('wond'), ['Alice'])
+        self.assertEqual(self.search(''), [])
+
+    def test_results_are_cached_until_a_profile_changes(self):
+        self.search('al')
+        with self.assertNumQueries(0):
+            directory.search('al')
+
+        resp = self.client.patch(reverse('user-update'), {'nickname': 'Alpine'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.search('alp'), ['bob'])
+
+    def test_odd_prefixes_make_safe_cache_keys(self):
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            self.assertEqual(self.search('al bo\x07ñ'), [])
+        key = cache_set.call_args.args[0]
+        self.assertRegex(key, r'^forum:userdir:\d+:[0-9a-f]{32}$')
+
+    def test_profile_change_drops_only_its_own_prefixes(self):
+        self.assertEqual(self.search('wo'), ['Alice'])
+        self.assertEqual(self.search('bu'), ['alfred'])
+        self.client.force_authenticate(self.alice)
+        resp = self.client.patch(reverse('user-update'), {'nickname': 'Queen'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+        # Old and new nickname prefixes are recomputed, unrelated ones stay cached
+        self.assertEqual(self.search('wo'), [])
+        self.assertEqual(self.search('qu'), ['Alice'])
+        with self.assertNumQueries(0):
+            self.assertEqual([u['username'] for u in directory.search('bu')], ['alfred'])
+
+    def test_smaller_limits_share_one_cached_answer(self):
+        self.assertEqual(self.search('al'), ['alfred', 'Alice', 'bob'])
+        with self.assertNumQueries(0):
+            self.assertEqual([u['username'] for u in directory.search('al', limit=1)], ['alfred'])
+
+    def test_banned_users_leave_cached_results(self):
+        self.assertEqual(self.search('al'), ['alfred', 'Alice', 'bob'])
+        moderation.ban_user(self.alfred.pk)
+        self.assertEqual(self.search('al'), ['Alice', 'bob'])
+
+    def test_update_checks_nickname_and_email_case_insensitively(self):
+        resp = self.client.patch(reverse('user-update'), {'nickname': 'WONDERLAND'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.patch(reverse('user-update'), {'email': 'a@example.COM'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_backfill_command(self):
+        User.objects.update(username_folded='', nickname_folded='')
+        out = StringIO()
+        call_command('fold_user_names', batch_size=2, stdout=out)
+        self.assertIn('3 user(s)', out.getvalue())
+        self.assertEqual(self.search('bu'), ['alfred'])
+
+
+class MigrationTests(TransactionTestCase):
+    def test_folded_names_migration_backfills_and_indexes(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('user', '0001_initial')])
+        old_apps = executor.loader.project_state([('user', '0001_initial')]).apps
+        old_apps.get_model('user', 'User').objects.create(username='Ada', nickname='Countess', email='ADA@x.org')
+
+        executor = MigrationExecutor(connection)
+        executor.migrate([('user', '0002_folded_names')])
+        ada = User.objects.get(username='Ada')
+        self.assertEqual((ada.username_folded, ada.nickname_folded, ada.email_folded), ('ada', 'countess', 'ada@x.org'))
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, User._meta.db_table)
+        self.assertIn('user_reputation_idx', constraints)
+
+
+class PasswordHashPoolTests(APITestCase):
+    user_data = {'username': 'alice', 'password': 'secret123', 'nickname': 'guten_tag'}
+
+    def test_register_relies_on_constraints(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.post(reverse('auth_register'), self.user_data, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('SELECT')])
+
+        resp = self.client.post(reverse('auth_register'), dict(self.user_data, nickname='other'), format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(resp.data), {'username'})
+        resp = self.client.post(reverse('auth_register'), dict(self.user_data, username='bobby'), format='json')
+        self.assertEqual(set(resp.data), {'nickname'})
+
+    def test_login_hashes_on_the_pool(self):
+        self.client.post(reverse('auth_register'), self.user_data, format='json')
+        before = hashing.stats()['completed']
+        resp = self.client.post(reverse('token_obtain_pair'), {'username': 'alice', 'password': 'secret123'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.post(reverse('token_obtain_pair'), {'username': 'nobody', 'password': 'secret123'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(hashing.stats()['completed'], before + 2)
+
+    def test_full_pool_answers_503(self):
+        pool = hashing.HashPool(workers=1, queue_size=0, timeout=5)
+        self.addCleanup(pool.shutdown)
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+        threading.Thread(target=pool.run, args=(block,)).start()
+        started.wait(5)
+        try:
+            with mock.patch('user.hashing.get_pool', return_value=pool):
+                resp = self.client.post(reverse('auth_register'), self.user_data, format='json')
+        finally:
+            release.set()
+        self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(resp['Retry-After'], '1')
+        self.assertEqual(pool.stats()['rejected'], 1)
+
+    def test_bench_command(self):
+        out = StringIO()
+        call_command('bench_auth', requests=3, concurrency=1, stdout=out)
+        self.assertIn('register:', out.getvalue())
+        self.assertIn('login:', out.getvalue())
+        self.assertFalse(User.objects.exists())
+
+
+class TokenBlacklistTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username='alice', password='Secret123!', nickname='alice')
+
+    def login(self):
+        resp = self.client.post(reverse('token_obtain_pair'), {'username': 'alice', 'password': 'Secret123!'}, format='json')
+        return resp.data['refresh']
+
+    def test_rotation_blacklists_in_cache_only(self):
+        refresh = self.login()
+        resp = self.client.post(reverse('token_refresh'), {'refresh': refresh}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn('refresh', resp.data)
+
+        resp = self.client.post(reverse('token_refresh'), {'refresh': refresh}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertFalse(OutstandingToken.objects.exists())
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+    def test_purge_command_batches_and_seeds_cache(self):
+        user = User.objects.get()
+        now = timezone.now()
+        for n in range(3):
+            OutstandingToken.objects.create(user=user, jti=f'old{n}', token='x', expires_at=now - timedelta(days=1))
+        kept = OutstandingToken.objects.create(user=user, jti='live', token='x', expires_at=now + timedelta(days=1))
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti='old0'))
+        BlacklistedToken.objects.create(token=kept)
+
+        out = StringIO()
+        call_command('purge_tokens', batch_size=2, seed_cache=True, stdout=out)
+        self.assertIn('Deleted 3 expired', out.getvalue())
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), ['live'])
+        self.assertTrue(tokens.is_blacklisted('live'))
+        self.assertFalse(tokens.is_blacklisted('old0'))
+
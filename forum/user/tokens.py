@@ -0,0 +1,53 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import BlacklistMixin, RefreshToken
+
+#Refresh token blacklist kept in the cache instead of the token_blacklist tables.
+#A blacklisted jti is one key that expires together with the token, so the store
+#never outgrows the set of live tokens and a refresh is one cache GET. Nothing
+#is written for tokens that are merely issued (no OutstandingToken rows).
+
+def _cache():
+    return caches[getattr(settings, 'JWT_BLACKLIST_CACHE', 'default')]
+
+def _key(jti):
+    return f'forum:jwt:blacklist:{jti}'
+
+def blacklist_jti(jti, exp):
+    ttl = int(exp - time.time()) + 1
+    if ttl > 0:
+        _cache().set(_key(jti), 1, ttl)
+
+def is_blacklisted(jti):
+    return _cache().get(_key(jti)) is not None
+
+
+class CachedRefreshToken(RefreshToken):
+    def check_blacklist(self):
+        if is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        blacklist_jti(self.payload[api_settings.JTI_CLAIM], self.payload['exp'])
+
+    def outstand(self):
+        return None
+
+    @classmethod
+    def for_user(cls, user):
+        # Skip BlacklistMixin, which records every issued token in the database
+        return super(BlacklistMixin, cls).for_user(user)
+
+
+class CachedTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = CachedRefreshToken
+
+
+class CachedTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = CachedRefreshToken
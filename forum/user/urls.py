@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import RegisterView, LogoutView, UserUpdateView, CurrentUserView, UserDetailView, UserListView
+from .views import RegisterView, LogoutView, UserUpdateView, CurrentUserView, UserDetailView, UserListView, LeaderboardView, UserSearchView
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -16,4 +16,6 @@ urlpatterns = [
     path('current/', CurrentUserView.as_view(), name='current-user'),
     path('get/<int:pk>/', UserDetailView.as_view(), name='get-user'),
     path('list/', UserListView.as_view(), name='user-list'),
+    path('leaderboard/', LeaderboardView.as_view(), name='user-leaderboard'),
+    path('search/', UserSearchView.as_view(), name='user-search'),
 ]
\ No newline at end of file
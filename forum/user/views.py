@@ -1,14 +1,18 @@
 from django.shortcuts import render
 from rest_framework import generics, status, permissions
 from rest_framework.response import Response
-from .serializers import RegisterSerializer, UserSerializer
+from .serializers import LeaderboardSerializer, RegisterSerializer, UserSerializer
 from django.contrib.auth import get_user_model
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.tokens import RefreshToken
+from .tokens import CachedRefreshToken
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from .serializers import UserUpdateSerializer
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
+from forum_main import readmodels
+from django.utils.cache import patch_cache_control
+from django.conf import settings
+from . import directory
 
 User = get_user_model()
 
@@ -20,6 +24,7 @@ class RegisterView(generics.CreateAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
+        directory.invalidate_names(user.username, user.nickname)
         data = serializer.data
         return Response(data, status=status.HTTP_201_CREATED)
     
@@ -32,7 +37,7 @@ class LogoutView(APIView):
         if not refresh_token:
             return Response({"detail": "No refresh token provided"}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            token = RefreshToken(refresh_token)
+            token = CachedRefreshToken(refresh_token)
             token.blacklist()
         except Exception as e:
             return Response({"detail": "Invalid token"}, status=status.HTTP_400_BAD_REQUEST)
@@ -47,6 +52,12 @@ class UserUpdateView(generics.RetrieveUpdateAPIView):
 
     def get_object(self):
         return self.request.user
+
+    def perform_update(self, serializer):
+        old_names = (serializer.instance.username, serializer.instance.nickname)
+        user = serializer.save()
+        readmodels.schedule_user_invalidation(user.pk)
+        directory.invalidate_names(*old_names, user.username, user.nickname)
     
 
 class CurrentUserView(generics.RetrieveAPIView):
@@ -67,4 +78,26 @@ class UserListView(generics.ListAPIView):
     queryset               = User.objects.all().order_by('id')
     serializer_class       = UserSerializer
     authentication_classes = [JWTAuthentication]
-    permission_classes     = [permissions.IsAuthenticated]
\ No newline at end of file
+    permission_classes     = [permissions.IsAuthenticated]
+
+class LeaderboardView(generics.ListAPIView):
+    # Reads user_reputation_idx in order, no aggregation over votes
+    queryset               = User.objects.filter(is_active=True).order_by('-reputation', 'id')
+    serializer_class       = LeaderboardSerializer
+    authentication_classes = [JWTAuthentication]
+    permission_classes     = [permissions.AllowAny]
+
+class UserSearchView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes     = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        query = request.query_params.get('q', '')[:directory.MAX_QUERY_LENGTH]
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), directory.MAX_LIMIT)
+        except ValueError:
+            return Response({"detail": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        response = Response(directory.search(query, limit), status=status.HTTP_200_OK)
+        # Autocomplete fires on every keystroke, let the client reuse answers too
+        patch_cache_control(response, private=True, max_age=settings.USER_DIRECTORY_CACHE_SECONDS)
+        return response